@@ -0,0 +1,112 @@
+# coding=utf-8
+"""Benchmark cases of the compile hot paths.
+
+Each case is a function returning a callable without arguments which runs
+the measured operation once.
+"""
+from __future__ import absolute_import
+from collections import OrderedDict
+
+from sql import Table
+
+from ooquery import OOQuery, Parser
+from ooquery.fingerprint import domain_fingerprint
+from ooquery.domain_converter import (
+    convert_from_domain, convert_from_domains, convert_to_domain,
+    convert_to_domains
+)
+
+from benchmarks.common import (
+    deep_domain, fake_fk, large_domain, saved_filters, small_domain,
+    wide_fields
+)
+
+CASES = OrderedDict()
+
+
+def case(number):
+    """Register a benchmark case run ``number`` times per repetition."""
+    def register(func):
+        CASES[func.__name__] = (func, number)
+        return func
+    return register
+
+
+@case(number=2000)
+def parse_small():
+    table = Table('account_invoice')
+    domain = small_domain()
+    return lambda: Parser(table, fake_fk).parse(domain)
+
+
+@case(number=5)
+def parse_10k_leaves():
+    table = Table('account_invoice')
+    domain = large_domain(10000)
+    return lambda: Parser(table, fake_fk).parse(domain)
+
+
+@case(number=1000)
+def parse_deep_joins():
+    table = Table('account_invoice')
+    domain = deep_domain(5)
+    return lambda: Parser(table, fake_fk).parse(domain)
+
+
+@case(number=100)
+def select_wide():
+    fields = wide_fields()
+    domain = [('rel_1_id.code', '=', 'XXX'), ('state', '=', 'open')]
+
+    def run():
+        q = OOQuery('account_invoice', fake_fk)
+        return tuple(q.select(fields, group_by=['state']).where(domain))
+    return run
+
+
+@case(number=500)
+def domain_roundtrip_small():
+    domain = small_domain()
+    return lambda: convert_to_domain(convert_from_domain(domain))
+
+
+@case(number=5)
+def domain_roundtrip_10k_leaves():
+    domain = large_domain(10000)
+    return lambda: convert_to_domain(convert_from_domain(domain))
+
+
+@case(number=3)
+def domain_from_100k_leaves():
+    domain = large_domain(100000)
+    return lambda: convert_from_domain(domain)
+
+
+@case(number=3)
+def domain_to_100k_leaves():
+    query = convert_from_domain(large_domain(100000))
+    return lambda: convert_to_domain(query)
+
+
+@case(number=3)
+def domains_from_saved_filters():
+    domains = saved_filters()
+    return lambda: convert_from_domains(domains)
+
+
+@case(number=3)
+def domains_to_saved_filters():
+    queries = convert_from_domains(saved_filters())
+    return lambda: convert_to_domains(queries)
+
+
+@case(number=500)
+def fingerprint_small():
+    domain = small_domain()
+    return lambda: domain_fingerprint(domain)
+
+
+@case(number=5)
+def fingerprint_10k_leaves():
+    domain = large_domain(10000)
+    return lambda: domain_fingerprint(domain)
@@ -0,0 +1,83 @@
+# coding=utf-8
+"""Fake foreign keys and domain generators shared by the benchmarks."""
+from __future__ import absolute_import
+
+from sql import Literal
+from sql.aggregate import Max, Sum
+from sql.conditionals import Coalesce
+from sql.operators import Concat
+
+
+def fake_fk(table, field):
+    """Foreign key resolver: ``<name>_id`` fields point to table ``<name>``.
+    """
+    return {
+        'constraint_name': 'fk_{}_{}'.format(table, field),
+        'table_name': table,
+        'column_name': field,
+        'foreign_table_name': field[:-3],
+        'foreign_column_name': 'id'
+    }
+
+
+def small_domain():
+    return [
+        ('state', '=', 'open'),
+        '|', ('partner_id.name', 'ilike', 'pepito%'), ('number', '=', 'X'),
+        ('amount', '>', 10),
+        ('type', 'in', ['out_invoice', 'out_refund']),
+    ]
+
+
+def large_domain(n_leaves=10000):
+    """Domain of ``n_leaves`` leaves mixing ANDs and ORs."""
+    domain = []
+    for idx in range(n_leaves):
+        if idx % 2 == 0 and idx + 1 < n_leaves:
+            domain.append('|')
+        domain.append(('field_{}'.format(idx % 50), '=', idx))
+    return domain
+
+
+def saved_filters(n_filters=200, n_distinct=20, rule_leaves=500):
+    """Domains sharing a big record rule, ``n_distinct`` of them different.
+    """
+    rule = large_domain(rule_leaves)
+    return [
+        rule + [('state', '=', 'open'), ('user_id', '=', idx % n_distinct)]
+        for idx in range(n_filters)
+    ]
+
+
+def deep_path(depth=5):
+    return '.'.join('rel_{}_id'.format(idx) for idx in range(depth))
+
+
+def deep_domain(depth=5):
+    path = deep_path(depth)
+    return [
+        ('{}.name'.format(path), '=', 'XXX'),
+        ('{}.code'.format(path), '=', 'YYY'),
+        ('rel_0_id.state', '=', 'open'),
+    ]
+
+
+def wide_fields(n_columns=80, n_joins=8):
+    """Select list with columns, joined columns, aggregates, aliases,
+    conditionals and operators.
+    """
+    fields = []
+    for idx in range(n_columns):
+        if idx % 10 == 0:
+            fields.append(Max('amount_{}'.format(idx)))
+        elif idx % 10 == 5:
+            fields.append(Sum('amount_{}'.format(idx)).as_('total_{}'.format(idx)))
+        elif idx % 10 == 3:
+            fields.append(Coalesce('field_{}'.format(idx), Literal(0)))
+        elif idx % 10 == 7:
+            fields.append(Concat('field_{}'.format(idx), Literal('-')))
+        elif idx % 4 == 0:
+            fields.append('rel_{}_id.name_{}'.format(idx % n_joins, idx))
+        else:
+            fields.append('field_{}'.format(idx))
+    return fields
@@ -0,0 +1,91 @@
+# coding=utf-8
+"""Run the benchmarks and compare them with the saved baseline.
+
+Usage::
+
+    python -m benchmarks.run                 # compare with the baseline
+    python -m benchmarks.run --save          # save a new baseline
+    python -m benchmarks.run -k parse        # only cases matching "parse"
+    python -m benchmarks.run --threshold 0.5 # allow 50% slower
+
+Exits with status 1 if any case is slower than the baseline by more than the
+threshold. Baselines are machine dependent: save a new one before comparing
+changes on a different machine.
+"""
+from __future__ import absolute_import, print_function
+import argparse
+import json
+import os
+import sys
+import timeit
+
+from benchmarks.cases import CASES
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def measure(name, repeat=7):
+    """Return the best time in seconds of one run of the case."""
+    func, number = CASES[name]
+    run = func()
+    return min(timeit.repeat(run, number=number, repeat=repeat)) / number
+
+
+def load_baseline(path=BASELINE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baseline:
+        return json.load(baseline)
+
+
+def save_baseline(results, path=BASELINE):
+    with open(path, 'w') as baseline:
+        json.dump(results, baseline, indent=2, sort_keys=True)
+        baseline.write('\n')
+
+
+def compare(results, baseline, threshold):
+    """Return the names of the cases slower than the baseline."""
+    regressions = []
+    for name, elapsed in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            status = 'new'
+        else:
+            ratio = elapsed / reference
+            status = '{:.2f}x'.format(ratio)
+            if ratio > 1 + threshold:
+                status += ' REGRESSION'
+                regressions.append(name)
+        print('{:<30} {:>12.4f} ms  {}'.format(name, elapsed * 1000, status))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-k', dest='keyword', default='',
+                        help='only run the cases containing KEYWORD')
+    parser.add_argument('--save', action='store_true',
+                        help='save the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.3,
+                        help='allowed slowdown ratio (default: 0.3)')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--baseline', default=BASELINE)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in CASES:
+        if args.keyword in name:
+            results[name] = measure(name, repeat=args.repeat)
+    baseline = load_baseline(args.baseline)
+    regressions = compare(results, baseline, args.threshold)
+    if args.save:
+        baseline.update(results)
+        save_baseline(baseline, args.baseline)
+        print('Baseline saved to {}'.format(args.baseline))
+        return 0
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,45 @@
+# coding=utf-8
+"""Compile time of wide selects with joins.
+
+Compares the memoized ``OOQuery.fields`` against resolving the columns on
+every access (the behaviour before the memoization)::
+
+    python -m benchmarks.wide_select
+"""
+from __future__ import absolute_import, print_function
+import timeit
+
+from ooquery import OOQuery
+
+from benchmarks.common import fake_fk, wide_fields
+
+
+class UnmemoizedQuery(OOQuery):
+    @property
+    def fields(self):
+        return self.resolve_fields()
+
+
+def compile_wide(query_class, fields, domain):
+    q = query_class('table', fake_fk)
+    return tuple(q.select(fields).where(domain))
+
+
+def main(number=200):
+    fields = wide_fields()
+    domain = [('rel_1_id.code', '=', 'XXX'), ('state', '=', 'open')]
+    results = {}
+    for name, query_class in (('memoized', OOQuery),
+                              ('unmemoized', UnmemoizedQuery)):
+        results[name] = min(timeit.repeat(
+            lambda: compile_wide(query_class, fields, domain),
+            number=number, repeat=5
+        )) / number
+        print('{:<12} {:.3f} ms/query'.format(name, results[name] * 1000))
+    print('speedup      {:.2f}x'.format(
+        results['unmemoized'] / results['memoized']
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,25 @@
 # coding=utf-8
 
 from __future__ import absolute_import
+import sys
 
 from ooquery.expression import Expression
 from ooquery.parser import Parser
 from ooquery.operators import *
 from ooquery.ooquery import OOQuery
-from ooquery.domain_converter import convert_from_domain, convert_to_domain
+from ooquery.domain_converter import (
+    convert_from_domain, convert_from_domains, convert_to_domain,
+    convert_to_domains
+)
+from ooquery.cache import ForeignKeyCache, CompileCache, ResultCache
+from ooquery.compiler import CompiledQuery
+from ooquery.executor import (
+    ConnectionPool, ParallelExecutor, QueryExecutor
+)
+from ooquery.fingerprint import (
+    canonical_domain, domain_fingerprint, domain_skeleton_fingerprint
+)
+from ooquery.stats import QueryStats
+
+if sys.version_info >= (3, 7):
+    from ooquery.aio import AsyncOOQuery, AsyncParallelExecutor
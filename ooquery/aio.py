@@ -0,0 +1,145 @@
+# coding=utf-8
+"""
+Asyncio support.
+
+The foreign keys of all the join paths of a query are resolved concurrently
+with a coroutine resolver before building the query, so the event loop is
+never blocked by the catalog lookups. Queries are executed concurrently on
+the connections of a `ConnectionPool` from threads.
+"""
+from __future__ import absolute_import
+import asyncio
+
+from ooquery.cache import ForeignKeyCache
+from ooquery.executor import ParallelExecutor
+from ooquery.ooquery import OOQuery
+from ooquery.parser import get_join_paths
+
+
+class AsyncOOQuery(object):
+    """`OOQuery` with a coroutine foreign key resolver.
+
+    Usage::
+
+        q = AsyncOOQuery('account_invoice', async_fk_function)
+        sql = await q.select(['number', 'partner_id.name']).where(domain)
+
+    :param table: Name of the table
+    :param foreign_key: Coroutine function ``foreign_key(table, field)``
+    :param fk_cache: `ForeignKeyCache` to store the resolved foreign keys
+    """
+
+    def __init__(self, table, foreign_key=None, fk_cache=None, **options):
+        if fk_cache is None:
+            fk_cache = ForeignKeyCache()
+        self.foreign_key = foreign_key
+        self.fk_cache = fk_cache
+        self.query = OOQuery(table, fk_cache=fk_cache, **options)
+        self._fields = []
+        self.select_opts = {}
+
+    @property
+    def table(self):
+        return self.query.table
+
+    @property
+    def parser(self):
+        return self.query.parser
+
+    def select(self, fields=None, **kwargs):
+        self._fields = fields
+        self.select_opts = kwargs
+        return self
+
+    async def where(self, domain):
+        await self.resolve(self._fields, domain, self.select_opts)
+        return self.query.select(self._fields, **self.select_opts).where(
+            domain
+        )
+
+    async def compile(self, fields, domain, **kwargs):
+        await self.resolve(fields, domain, kwargs)
+        return self.query.compile(fields, domain, **kwargs)
+
+    async def resolve(self, fields, domain, select_opts=None):
+        """Resolve the foreign keys of all the join paths of a query.
+
+        Paths are resolved level by level (the table of a segment is only
+        known once its parent segment is resolved) and all the distinct
+        ``(table, field)`` of a level are resolved concurrently.
+        """
+        select_opts = select_opts or {}
+        paths = get_join_paths(
+            fields, domain, select_opts.get('order_by'),
+            select_opts.get('group_by')
+        )
+        tables = {(): self.table._name}
+        depth = 1
+        while True:
+            level = {}
+            for path in paths:
+                if len(path) == depth:
+                    key = (tables[path[:-1]], path[-1])
+                    level.setdefault(key, []).append(path)
+            if not level:
+                break
+            keys = list(level)
+            fks = await asyncio.gather(*[
+                self.get_foreign_key(table, field) for table, field in keys
+            ])
+            for key, fk in zip(keys, fks):
+                for path in level[key]:
+                    tables[path] = fk['foreign_table_name']
+            depth += 1
+
+    async def get_foreign_key(self, table, field):
+        key = (table, field)
+        if key in self.fk_cache:
+            return self.fk_cache.get(key)
+        fk = await self.foreign_key(table, field)
+        self.fk_cache.set(key, fk)
+        return fk
+
+
+class AsyncParallelExecutor(object):
+    """`ParallelExecutor` for asyncio.
+
+    The queries run in the threads of ``loop_executor`` (the default
+    executor of the event loop if None) with the connections of the pool,
+    at most ``max_workers`` at the same time.
+
+    Usage::
+
+        executor = AsyncParallelExecutor(pool)
+        results = await executor.execute(queries)
+    """
+
+    def __init__(self, pool, max_workers=None, stats=None,
+                 loop_executor=None):
+        self.executor = ParallelExecutor(pool, max_workers, stats=stats)
+        self.loop_executor = loop_executor
+
+    @property
+    def max_workers(self):
+        return self.executor.max_workers
+
+    async def execute_one(self, query):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.loop_executor, self.executor.execute_one, query
+        )
+
+    async def execute(self, queries):
+        """Execute the queries concurrently.
+
+        :return: List of `QueryResult` in the order of ``queries``
+        """
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def execute_one(query):
+            async with semaphore:
+                return await self.execute_one(query)
+
+        return list(await asyncio.gather(*[
+            execute_one(query) for query in queries
+        ]))
@@ -0,0 +1,381 @@
+# coding=utf-8
+from __future__ import absolute_import
+import sys
+import time
+from collections import OrderedDict
+from functools import partial
+from threading import RLock
+from weakref import WeakKeyDictionary
+
+from ooquery.compiler import CompiledQuery, freeze, table_names
+
+
+class LRUCache(object):
+    """Thread-safe LRU mapping with optional time to live.
+
+    :param maxsize: Maximum number of entries (None for unbounded)
+    :param ttl: Seconds an entry is valid (None for no expiration)
+    :param timer: Callable returning the current time
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, timer=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def _lookup(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires <= self.timer():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            # Move to the end to mark it as the most recently used
+            del self._data[key]
+            self._data[key] = entry
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            expires = None
+            if self.ttl is not None:
+                expires = self.timer() + self.ttl
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            return entry[1]
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'maxsize': self.maxsize
+        }
+
+
+class ForeignKeyCache(LRUCache):
+    """Cache of foreign key metadata keyed by ``(table, field)``.
+
+    It can be used directly as the ``foreign_key`` callable of a `Parser` or
+    an `OOQuery`. When a ``table_loader`` is given, a miss loads all the
+    foreign keys of the table at once (one catalog round trip per table
+    instead of one per field).
+
+    :param foreign_key: Callable ``foreign_key(table, field)`` to resolve misses
+    :param table_loader: Callable ``table_loader(table)`` returning a dict
+        ``{field: fk}`` with all the foreign keys of a table
+    """
+
+    def __init__(self, foreign_key=None, table_loader=None, maxsize=1024,
+                 ttl=None, timer=time.time):
+        super(ForeignKeyCache, self).__init__(
+            maxsize=maxsize, ttl=ttl, timer=timer
+        )
+        self.foreign_key = foreign_key
+        self.table_loader = table_loader
+
+    def __call__(self, table, field):
+        return self.resolve(table, field)
+
+    def resolve(self, table, field, foreign_key=None):
+        key = (table, field)
+        fk = self.get(key)
+        if fk is not None:
+            return fk
+        if self.table_loader is not None:
+            self.preload([table])
+            fk = self._data.get(key)
+            if fk is not None:
+                return fk[1]
+        foreign_key = foreign_key or self.foreign_key
+        if foreign_key is None:
+            raise KeyError(
+                u"No foreign key for '{field}' on table '{table}'".format(
+                    field=field, table=table
+                )
+            )
+        fk = foreign_key(table, field)
+        self.set(key, fk)
+        return fk
+
+    def bind(self, foreign_key):
+        """Return a ``foreign_key`` callable resolving misses with
+        ``foreign_key`` and storing them in this cache.
+        """
+        return partial(self.resolve, foreign_key=foreign_key)
+
+    def preload(self, tables, table_loader=None):
+        """Load all the foreign keys of ``tables`` with a single call to
+        ``table_loader`` per table.
+        """
+        table_loader = table_loader or self.table_loader
+        for table in tables:
+            for field, fk in table_loader(table).items():
+                self.set((table, field), fk)
+
+    def invalidate(self, table=None, field=None):
+        """Remove cached entries.
+
+        Without arguments the whole cache is cleared, with ``table`` only
+        the foreign keys of that table are removed and with ``field`` too
+        only that entry.
+        """
+        if table is None:
+            return self.clear()
+        with self._lock:
+            if field is not None:
+                self._data.pop((table, field), None)
+            else:
+                for key in self.keys():
+                    if key[0] == table:
+                        del self._data[key]
+
+
+# Process-wide foreign key caches by resolver, dropped with the resolver
+_fk_caches = WeakKeyDictionary()
+_fk_caches_lock = RLock()
+
+
+def shared_fk_cache(foreign_key, maxsize=1024, ttl=3600):
+    """Return the process-wide `ForeignKeyCache` of a resolver.
+
+    Caches are kept while the resolver exists, so only long-lived resolvers
+    (one per database) share them. Entries expire after ``ttl`` seconds to
+    pick up schema changes.
+
+    Usage::
+
+        q = OOQuery(table, fk_function, fk_cache=shared_fk_cache(fk_function))
+    """
+    if isinstance(foreign_key, ForeignKeyCache):
+        return foreign_key
+    # Bound methods are created on every access, key them by their object
+    owner = getattr(foreign_key, '__self__', None)
+    func = getattr(foreign_key, '__func__', None)
+    if owner is None or func is None:
+        owner, func = foreign_key, None
+    with _fk_caches_lock:
+        try:
+            caches = _fk_caches.setdefault(owner, {})
+        except TypeError:
+            # Not weakly referenceable
+            return ForeignKeyCache(maxsize=maxsize, ttl=ttl)
+        cache = caches.get(func)
+        if cache is None:
+            cache = ForeignKeyCache(maxsize=maxsize, ttl=ttl)
+            caches[func] = cache
+        return cache
+
+
+class CompileCache(LRUCache):
+    """Cache of `ooquery.compiler.QueryTemplate` keyed by query shape.
+    """
+
+
+def estimate_size(value):
+    """Return an estimation of the memory used by a result in bytes."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        for row in value:
+            size += sys.getsizeof(row)
+            if isinstance(row, (list, tuple)):
+                size += sum(sys.getsizeof(v) for v in row)
+            elif isinstance(row, dict):
+                size += sum(sys.getsizeof(v) for v in row.values())
+    return size
+
+
+class ByteLRUCache(LRUCache):
+    """LRU cache bounded by the size of its values in bytes.
+
+    Values bigger than ``max_bytes`` are not stored.
+
+    :param max_bytes: Maximum size of all the values
+    :param sizeof: Callable returning the size of a value
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, sizeof=estimate_size,
+                 maxsize=None, ttl=None, timer=time.time):
+        super(ByteLRUCache, self).__init__(
+            maxsize=maxsize, ttl=ttl, timer=timer
+        )
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._sizes = {}
+
+    def _forget(self, key):
+        self.bytes -= self._sizes.pop(key, 0)
+
+    def _lookup(self, key):
+        entry = super(ByteLRUCache, self)._lookup(key)
+        if entry is None:
+            self._forget(key)
+        return entry
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            self.pop(key)
+            if size > self.max_bytes:
+                return
+            expires = None
+            if self.ttl is not None:
+                expires = self.timer() + self.ttl
+            self._data[key] = (expires, value)
+            self._sizes[key] = size
+            self.bytes += size
+            while self.bytes > self.max_bytes or (
+                    self.maxsize is not None
+                    and len(self._data) > self.maxsize):
+                oldest, _ = self._data.popitem(last=False)
+                self._forget(oldest)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            self._forget(key)
+            return super(ByteLRUCache, self).pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            super(ByteLRUCache, self).clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    @property
+    def stats(self):
+        stats = super(ByteLRUCache, self).stats
+        stats.update({'bytes': self.bytes, 'max_bytes': self.max_bytes})
+        return stats
+
+
+class TableVersions(object):
+    """Version of each table, bumped every time the table changes.
+
+    Replace it by an object with the same ``get`` and ``bump`` methods
+    sharing the versions (in redis, memcached...) when the results are
+    shared between processes.
+    """
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = RLock()
+
+    def get(self, tables):
+        """Return the versions of ``tables``."""
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+    def bump(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+
+class ResultCache(object):
+    """Cache of query results invalidated by table.
+
+    Results are keyed by the SQL, the parameters and the versions of the
+    tables used by the query, so bumping the version of a table with
+    `invalidate` makes all the results using it unreachable. They are
+    evicted from the backend as the least recently used ones.
+
+    Usage::
+
+        cache = ResultCache(max_bytes=256 * 1024 * 1024)
+        executor = QueryExecutor(conn, cache=cache)
+        rows = executor.execute(q.compile(['code', 'name'], domain))
+        # Later, in the write paths
+        cache.invalidate('res_country')
+
+    :param backend: Object with ``get(key)`` and ``set(key, value)``
+        methods, by default a `ByteLRUCache` of ``max_bytes``
+    :param versions: `TableVersions` (or an object with the same methods)
+    """
+
+    def __init__(self, backend=None, versions=None,
+                 max_bytes=64 * 1024 * 1024):
+        if backend is None:
+            backend = ByteLRUCache(max_bytes=max_bytes)
+        if versions is None:
+            versions = TableVersions()
+        self.backend = backend
+        self.versions = versions
+
+    def key(self, query, tables=None):
+        """Return the key of the results of a query.
+
+        :param query: python-sql query or `CompiledQuery`
+        :param tables: Names of the tables used by the query, required for
+            ``(sql, params)`` tuples
+        """
+        if tables is None:
+            if isinstance(query, CompiledQuery):
+                tables = query.tables
+            elif isinstance(query, tuple):
+                raise ValueError('The tables of the query are required')
+            else:
+                tables = table_names(query)
+        sql, params = tuple(query)
+        return (sql, freeze(params), tuple(tables), self.versions.get(tables))
+
+    def get(self, query, tables=None):
+        """Return the cached rows of the query or None."""
+        return self.backend.get(self.key(query, tables))
+
+    def set(self, query, rows, tables=None):
+        self.backend.set(self.key(query, tables), rows)
+
+    def fetch(self, query, execute, tables=None):
+        """Return the cached rows of the query or the ones returned by
+        ``execute(query)``, storing them.
+        """
+        key = self.key(query, tables)
+        rows = self.backend.get(key)
+        if rows is None:
+            rows = execute(query)
+            self.backend.set(key, rows)
+        return rows
+
+    def invalidate(self, *tables):
+        """Invalidate the results of the queries using ``tables``."""
+        self.versions.bump(*tables)
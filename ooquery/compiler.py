@@ -0,0 +1,321 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+from sql import (
+    Column, Expression as SQLExpression, Flavor, FromItem, Join, Query, Select,
+    Table
+)
+
+from sql.operators import In, NotIn
+
+from ooquery.expression import OPERATORS, Expression, Field
+from ooquery.operators import JoinType
+
+SCALAR = 'value'
+ARRAY = 'array'
+
+
+_SLOTS = {}
+
+
+def _slots(cls):
+    slots = _SLOTS.get(cls)
+    if slots is None:
+        slots = []
+        for klass in reversed(cls.__mro__):
+            names = klass.__dict__.get('__slots__', ())
+            if isinstance(names, str):
+                names = (names, )
+            slots.extend(names)
+        _SLOTS[cls] = slots
+    return slots
+
+
+def freeze(value):
+    """Convert value to a hashable structure usable as a cache key.
+    """
+    if isinstance(value, (SQLExpression, JoinType, Field)):
+        key = [value.__class__.__name__]
+        key.extend(freeze(getattr(value, s, None)) for s in _slots(type(value)))
+        if isinstance(value, list):
+            key.append(tuple(freeze(v) for v in value))
+        return tuple(key)
+    elif isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    elif isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    return value
+
+
+def table_names(query):
+    """Return the sorted names of the tables used by a python-sql query,
+    its joins and its subqueries.
+    """
+    names = set()
+    stack = [query]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, Column):
+            stack.append(value.table)
+        elif isinstance(value, Table):
+            names.add(value._name)
+        elif isinstance(value, CompiledQuery):
+            names.update(value.tables or ())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        elif isinstance(value, (SQLExpression, Query, FromItem, Join)):
+            stack.extend(getattr(value, s, None) for s in _slots(type(value)))
+            if isinstance(value, list):
+                stack.extend(value)
+    return tuple(sorted(names))
+
+
+def flavor_key():
+    """Return the parts of the current python-sql flavor which change the
+    rendered SQL.
+    """
+    flavor = Flavor.get()
+    return (
+        flavor.limitstyle, flavor.max_limit, flavor.paramstyle, flavor.ilike,
+        flavor.no_as, flavor.no_boolean, flavor.null_ordering
+    )
+
+
+def is_subquery(value):
+    """Check if the value is a query (`OOQuery`, `CompiledQuery`) to be used
+    as a subquery.
+    """
+    return hasattr(value, 'as_subquery')
+
+
+def subquery_key(value):
+    """Return the SQL and the parameters of a subquery value."""
+    subquery = value.as_subquery()
+    return ('subquery', str(subquery), freeze(subquery.params))
+
+
+def is_bindable(value):
+    """Check if the value of a leaf can be bound as a parameter."""
+    return not (
+        value is None or isinstance(value, (Field, SQLExpression, Select))
+        or is_subquery(value)
+    )
+
+
+def is_array_in(operator, value, in_threshold):
+    """Check if the value of a leaf is compiled as one array parameter."""
+    return (
+        in_threshold is not None and isinstance(value, (list, tuple))
+        and len(value) >= in_threshold
+        and OPERATORS.get(operator) in (In, NotIn)
+    )
+
+
+def value_shape(value):
+    if is_subquery(value):
+        return subquery_key(value)
+    elif not is_bindable(value):
+        return freeze(value)
+    elif isinstance(value, (list, tuple)):
+        return ('list', len(value))
+    return SCALAR
+
+
+def domain_skeleton(domain, in_threshold=None):
+    """Return the structure of the domain with the values stripped.
+
+    Two domains with the same skeleton only differ on the values of their
+    leaves, so they compile to the same SQL with different parameters. The
+    lists of at least ``in_threshold`` values have the same shape whatever
+    their length, as they are bound as one array parameter.
+    """
+    skeleton = []
+    for element in domain:
+        if Expression.is_expression(element):
+            field, operator, value = element
+            if is_array_in(operator, value, in_threshold):
+                shape = ARRAY
+            else:
+                shape = value_shape(value)
+            skeleton.append((freeze(field), operator, shape))
+        else:
+            skeleton.append(element)
+    return tuple(skeleton)
+
+
+def domain_values(domain):
+    """Return the values of the leaves of the domain in order."""
+    return [
+        element[2] for element in domain if Expression.is_expression(element)
+    ]
+
+
+class Slot(object):
+    """Placeholder of the value of a leaf while rendering a template."""
+    __slots__ = ('leaf', 'item')
+
+    def __init__(self, leaf, item=None):
+        self.leaf = leaf
+        self.item = item
+
+    def __repr__(self):
+        return 'Slot({}, {})'.format(self.leaf, self.item)
+
+    def value(self, values):
+        value = values[self.leaf]
+        if self.item is not None:
+            value = value[self.item]
+        return value
+
+
+class ArraySlot(Slot):
+    """Placeholder of a list of values bound as one array parameter."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'ArraySlot({})'.format(self.leaf)
+
+    def value(self, values):
+        return list(values[self.leaf])
+
+
+def slot_domain(domain, in_threshold=None):
+    """Return a copy of the domain with the values replaced by `Slot`.
+
+    The lists of at least ``in_threshold`` values of ``in`` and ``not in``
+    are replaced by an `ArraySlot`.
+    """
+    result = []
+    leaf = 0
+    for element in domain:
+        if Expression.is_expression(element):
+            field, operator, value = element
+            if is_bindable(value):
+                if is_array_in(operator, value, in_threshold):
+                    value = ArraySlot(leaf)
+                elif isinstance(value, (list, tuple)):
+                    value = [Slot(leaf, idx) for idx in range(len(value))]
+                else:
+                    value = Slot(leaf)
+            element = (field, operator, value)
+            leaf += 1
+        result.append(element)
+    return result
+
+
+class QueryTemplate(object):
+    """Rendered SQL of a domain shape and the map of its parameters.
+
+    Each parameter is either a `Slot` pointing to a leaf value of the domain
+    or a constant (limit, literals...) rendered with the query.
+    """
+    __slots__ = ('sql', 'params_map', 'skeleton', 'tables', 'in_threshold')
+
+    def __init__(self, sql, params_map, skeleton=None, tables=None,
+                 in_threshold=None):
+        self.sql = sql
+        self.params_map = tuple(params_map)
+        self.skeleton = skeleton
+        self.tables = tables
+        self.in_threshold = in_threshold
+
+    @classmethod
+    def from_query(cls, query, skeleton=None, in_threshold=None):
+        sql, params = tuple(query)
+        return cls(sql, params, skeleton, table_names(query), in_threshold)
+
+    def bind_params(self, values):
+        params = []
+        for param in self.params_map:
+            if isinstance(param, Slot):
+                param = param.value(values)
+            elif isinstance(param, list) and param and isinstance(
+                    param[0], Slot):
+                # Values bound as an array parameter
+                param = [slot.value(values) for slot in param]
+            params.append(param)
+        return tuple(params)
+
+    def bind(self, domain):
+        """Return a `CompiledQuery` with the values of the domain."""
+        return CompiledQuery(self, self.bind_params(domain_values(domain)))
+
+
+class CompiledQuery(object):
+    """Immutable compiled query, safe to share between threads.
+
+    It unpacks as ``(sql, params)`` so it can be passed directly to
+    ``cursor.execute(*compiled)``.
+    """
+    __slots__ = ('template', 'params')
+
+    def __init__(self, template, params):
+        object.__setattr__(self, 'template', template)
+        object.__setattr__(self, 'params', tuple(params))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CompiledQuery is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('CompiledQuery is immutable')
+
+    @property
+    def sql(self):
+        return self.template.sql
+
+    @property
+    def tables(self):
+        """Names of the tables used by the query."""
+        return self.template.tables
+
+    def __iter__(self):
+        return iter((self.sql, self.params))
+
+    def __eq__(self, other):
+        if isinstance(other, CompiledQuery):
+            other = tuple(other)
+        return tuple(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.sql, freeze(self.params)))
+
+    def __repr__(self):
+        return 'CompiledQuery({!r}, {!r})'.format(self.sql, self.params)
+
+    def as_subquery(self):
+        """Return the query as a python-sql expression, to be used as the
+        value of a leaf.
+
+        The SQL is used as is, so it must be compiled with the paramstyle of
+        the query using it.
+        """
+        return CompiledSubquery(self)
+
+    def bind(self, domain):
+        """Return a new `CompiledQuery` with the values of ``domain``.
+
+        The domain must have the same shape as the compiled one.
+        """
+        skeleton = domain_skeleton(domain, self.template.in_threshold)
+        if skeleton != self.template.skeleton:
+            raise ValueError('Domain does not match the compiled query shape')
+        return self.template.bind(domain)
+
+
+class CompiledSubquery(SQLExpression):
+    """`CompiledQuery` used as a subquery in a python-sql expression."""
+    __slots__ = ('query', )
+
+    def __init__(self, query):
+        super(CompiledSubquery, self).__init__()
+        self.query = query
+
+    def __str__(self):
+        return '({})'.format(self.query.sql)
+
+    @property
+    def params(self):
+        return self.query.params
@@ -8,6 +8,7 @@ in gisce/ooquery-ts.
 """
 
 from __future__ import absolute_import
+from collections import defaultdict, deque
 
 # Operator mapping to convert OpenERP/Odoo operators to more standard ones
 OPERATOR_MAP = {
@@ -67,46 +68,50 @@ def convert_from_domain(domain):
     """
     if not domain:
         return {'combinator': 'and', 'rules': []}
-        
-    result = _parse_domain_stack(domain)
-    return _optimize_query(result)
 
+    return _finalize(_parse_domain(domain))
 
-def _parse_domain_stack(domain):
-    """Parse domain using stack-based approach."""
-    stack = []
-    
-    for element in reversed(domain):  # Process in reverse to handle prefix operators
-        if element == '|':
-            # OR operator - pop two operands and create OR rule
-            if len(stack) < 2:
-                raise ValueError("Invalid domain: OR operator needs two operands")
-            left = stack.pop()
-            right = stack.pop()
-            stack.append({
-                'combinator': 'or',
-                'rules': [left, right]
-            })
-        elif element == '&':
-            # AND operator - pop two operands and create AND rule  
-            if len(stack) < 2:
-                raise ValueError("Invalid domain: AND operator needs two operands")
-            left = stack.pop()
-            right = stack.pop()
-            stack.append({
-                'combinator': 'and',
-                'rules': [left, right]
-            })
-        elif isinstance(element, (list, tuple)):
-            # Check if it's a nested domain or a condition tuple
-            if len(element) > 0 and element[0] in ('|', '&'):
-                # It's a nested domain, parse it recursively
-                stack.append(_parse_domain_stack(element))
-            else:
-                # It's a condition tuple
-                stack.append(_process_element(element))
-    
-    # Combine remaining stack elements with AND (reverse to maintain order)
+
+def _parse_domain(domain, process_element=None):
+    """Parse domain to a flattened JSON tree without recursion.
+
+    Nested domains are parsed with an explicit stack of frames. Groups with
+    the same combinator are merged while they are built and `_finalize`
+    converts the rules left in a deque to lists.
+    """
+    process_element = process_element or _process_element
+    frames = [(reversed(domain), [])]  # Process in reverse to handle prefix operators
+    result = None
+    while frames:
+        elements, stack = frames[-1]
+        if result is not None:
+            # A nested domain has just been parsed
+            stack.append(result)
+            result = None
+        for element in elements:
+            if isinstance(element, (list, tuple)):
+                # Check if it's a nested domain or a condition tuple
+                if len(element) > 0 and element[0] in ('|', '&'):
+                    frames.append((reversed(element), []))
+                    break
+                stack.append(process_element(element))
+            elif element == '|' or element == '&':
+                if len(stack) < 2:
+                    raise ValueError("Invalid domain: {} operator needs two operands".format(
+                        'OR' if element == '|' else 'AND'
+                    ))
+                left = stack.pop()
+                right = stack.pop()
+                combinator = 'or' if element == '|' else 'and'
+                stack.append(_combine(combinator, left, right))
+        else:
+            frames.pop()
+            result = _close_domain(stack)
+    return result
+
+
+def _close_domain(stack):
+    """Combine remaining stack elements with AND (reverse to maintain order)."""
     if len(stack) == 0:
         return {'combinator': 'and', 'rules': []}
     elif len(stack) == 1:
@@ -115,9 +120,54 @@ def _parse_domain_stack(domain):
         if 'field' in result:
             return {'combinator': 'and', 'rules': [result]}
         return result
-    else:
-        # Multiple rules left, combine with AND and reverse to maintain original order
-        return {'combinator': 'and', 'rules': list(reversed(stack))}
+    rules = []
+    for rule in reversed(stack):
+        if rule.get('combinator') == 'and':
+            rules.extend(rule['rules'])
+        else:
+            rules.append(rule)
+    return {'combinator': 'and', 'rules': rules}
+
+
+def _combine(combinator, left, right):
+    """Combine two rules, merging the groups with the same combinator.
+
+    The rules of the smaller group are moved into the bigger one so long
+    chains of the same operator are built in linear time. Rules are only
+    turned into a deque when something has to be prepended to them.
+    """
+    left_same = left.get('combinator') == combinator
+    right_same = right.get('combinator') == combinator
+    if left_same and (not right_same or len(left['rules']) >= len(right['rules'])):
+        if right_same:
+            left['rules'].extend(right['rules'])
+        else:
+            left['rules'].append(right)
+        return left
+    elif right_same:
+        rules = right['rules']
+        if isinstance(rules, list):
+            rules = right['rules'] = deque(rules)
+        if left_same:
+            rules.extendleft(reversed(left['rules']))
+        else:
+            rules.appendleft(left)
+        return right
+    return {'combinator': combinator, 'rules': [left, right]}
+
+
+def _finalize(query):
+    """Convert the rules of every group of the tree to lists."""
+    pending = [query]
+    while pending:
+        group = pending.pop()
+        rules = group['rules']
+        if not isinstance(rules, list):
+            rules = group['rules'] = list(rules)
+        for rule in rules:
+            if 'rules' in rule:
+                pending.append(rule)
+    return query
 
 
 def _process_element(element):
@@ -164,40 +214,160 @@ def convert_to_domain(query):
     """
     if not query or not isinstance(query, dict):
         return []
-        
+
     rules = query.get('rules', [])
     if not rules:
         return []
 
-    combinator = query.get('combinator', 'and')
-    
-    if combinator == 'and':
-        # For AND, return a flat list combining all rules
-        result = []
-        for rule in rules:
-            processed = _process_rule(rule)
-            if (isinstance(processed, list) and len(processed) > 0 and 
-                all(isinstance(item, (tuple, str)) for item in processed)):
-                # It's a domain list, extend result with its elements
-                result.extend(processed)
+    return _emit(query, _summarize(query))
+
+
+def _summary(query, children):
+    """Return the shape of the domain of a group without building it.
+
+    ``children`` has the shapes of the groups in the rules of ``query``, in
+    order. The shape is ``(size, only_tuples_or_str, only_tuples,
+    starts_with_operator)``.
+    """
+    rules = query.get('rules', [])
+    if not rules:
+        return 0, True, True, False
+    n_simple = len(rules) - len(children)
+    if query.get('combinator', 'and') == 'and':
+        size = n_simple
+        only_tuples_or_str = only_tuples = True
+        for child in children:
+            if _splice_and(child):
+                size += child[0]
+                only_tuples = only_tuples and child[2]
             else:
-                result.append(processed)
-        return result
-    else:
-        # For OR, build binary expression with prefix notation
-        return _build_binary_expression('|', rules)
+                # The domain is kept as a nested list
+                size += 1
+                only_tuples_or_str = only_tuples = False
+        starts_with_operator = False
+        if _is_group(rules[0]) and _splice_and(children[0]):
+            starts_with_operator = children[0][3]
+        return size, only_tuples_or_str, only_tuples, starts_with_operator
+    if len(rules) == 1:
+        if n_simple:
+            return 1, True, True, False
+        return children[0]
+    # For OR, n-1 operators in prefix notation followed by the rules
+    size = len(rules) - 1 + n_simple
+    only_tuples_or_str = True
+    for child in children:
+        if _splice_or(child):
+            size += 2 * child[0] - 1
+        else:
+            size += child[0]
+            only_tuples_or_str = only_tuples_or_str and child[1]
+    return size, only_tuples_or_str, False, True
+
+
+def _splice_and(summary):
+    """Check if the domain of a group is spliced into an AND domain."""
+    return summary[0] > 0 and summary[1]
+
+
+def _splice_or(summary):
+    """Check if the domain of a group needs explicit ``&`` inside an OR."""
+    return summary[0] > 0 and not summary[3] and summary[2]
+
+
+def _is_group(rule):
+    return isinstance(rule, dict) and 'rules' in rule
+
+
+def _summarize(query):
+    """Compute the shape of the domain of every group of the tree.
+
+    The tree is walked once in post-order without recursion. Returns a dict
+    with the shapes keyed by the ``id`` of the groups.
+    """
+    summaries = {}
+    pending = [(query, iter(query['rules']), [])]
+    while pending:
+        group, rules, children = pending[-1]
+        for rule in rules:
+            if isinstance(rule, dict) and 'rules' in rule:
+                summary = summaries.get(id(rule))
+                if summary is None:
+                    pending.append((rule, iter(rule['rules'] or ()), []))
+                    break
+                children.append(summary)
+        else:
+            pending.pop()
+            summary = summaries[id(group)] = _summary(group, children)
+            if pending:
+                pending[-1][2].append(summary)
+    return summaries
+
+
+def _emit(query, summaries, process_rule=None, key=id, emitted=None):
+    """Write the domain of the query in prefix notation.
+
+    Every rule is visited once and appended to a single list, nested groups
+    are walked with an explicit stack so the nesting depth is not limited
+    by the recursion limit.
+
+    ``summaries`` are keyed by ``key(group)``. The domain of the groups
+    whose key is in ``emitted`` is stored there the first time and copied
+    afterwards.
+    """
+    process_rule = process_rule or _process_rule
+    result = []
+    pending = []
+    group, target = query, result
+    while True:
+        if group is not None:
+            group_key = key(group)
+            rules = group.get('rules', [])
+            if emitted is not None and emitted.get(group_key) is not None:
+                target.extend(emitted[group_key])
+            elif rules:
+                start = len(target)
+                if group.get('combinator', 'and') == 'and':
+                    mode = 'and'
+                elif len(rules) == 1:
+                    mode = 'single'
+                else:
+                    # For OpenERP/Odoo domains, use flat prefix notation
+                    # Multiple OR: ['|', '|', rule1, rule2, rule3]
+                    target.extend(['|'] * (len(rules) - 1))
+                    mode = 'or'
+                pending.append((iter(rules), target, mode, group_key, start))
+            group = None
+        if not pending:
+            return result
+        rules, target, mode, group_key, start = pending[-1]
+        for rule in rules:
+            if not (isinstance(rule, dict) and 'rules' in rule):
+                target.append(process_rule(rule))
+                continue
+            group = rule
+            summary = summaries[key(rule)]
+            if mode == 'and':
+                if not _splice_and(summary):
+                    # Keep the domain of the group as a nested list
+                    nested = []
+                    target.append(nested)
+                    target = nested
+            elif mode == 'or' and _splice_or(summary) and summary[0] > 1:
+                # Add explicit & operators to preserve the grouping of an
+                # AND domain within the OR
+                target.extend(['&'] * (summary[0] - 1))
+            break
+        else:
+            pending.pop()
+            if emitted is not None and group_key in emitted:
+                emitted[group_key] = target[start:]
 
 
 def _process_rule(rule):
-    """Process a single rule into a domain tuple or sub-domain."""
+    """Process a simple rule into a domain tuple."""
     if not isinstance(rule, dict):
         raise ValueError("Rule must be a dictionary: {}".format(rule))
-    
-    if 'rules' in rule:
-        # It's a nested query, convert recursively
-        nested_domain = convert_to_domain(rule)
-        return nested_domain
-    
+
     # It's a simple rule
     if 'field' not in rule or 'operator' not in rule or 'value' not in rule:
         raise ValueError("Rule must have field, operator and value: {}".format(rule))
@@ -216,79 +386,223 @@ def _process_rule(rule):
     return (field, domain_operator, value)
 
 
-def _build_binary_expression(operator, rules):
-    """Build binary expression for OR operations using flat prefix notation."""
-    if len(rules) == 0:
-        return []
-    
-    if len(rules) == 1:
-        processed = _process_rule(rules[0])
-        return processed if isinstance(processed, list) else [processed]
-    
-    # For OpenERP/Odoo domains, use flat prefix notation
-    # Multiple OR: ['|', '|', rule1, rule2, rule3]
-    # Nested groups within OR: always explicit to preserve grouping semantics
-    result = []
-    
-    # Add n-1 operators for n rules (prefix notation)
-    for i in range(len(rules) - 1):
-        result.append(operator)
-    
-    # Add all processed rules
-    for rule in rules:
-        processed_rule = _process_rule(rule)
-        if isinstance(processed_rule, list):
-            # Check if this is an AND domain that needs explicit operators
-            if (len(processed_rule) > 0 and 
-                processed_rule[0] not in ('|', '&') and
-                all(isinstance(item, tuple) for item in processed_rule)):
-                # It's an AND domain - add explicit & operators for any multi-rule group
-                # to preserve semantic grouping within the OR
-                if len(processed_rule) > 1:
-                    # Add explicit & operators in prefix notation
-                    for i in range(len(processed_rule) - 1):
-                        result.append('&')
-                result.extend(processed_rule)
-            else:
-                # It already has operators or is a single rule
-                result.extend(processed_rule if isinstance(processed_rule, list) else [processed_rule])
+def _leaf_key(field, operator, value):
+    """Return a hashable key of a condition or None if it can't be hashed.
+
+    The key keeps the type of the values, ``1``, ``1.0`` and ``True`` are
+    equal in Python but they must not be shared.
+    """
+    if isinstance(value, (list, tuple)):
+        value = (type(value), tuple((type(item), item) for item in value))
+    key = (type(field), field, type(operator), operator, type(value), value)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _share_groups(query, groups):
+    """Replace the groups of the tree by the identical ones in ``groups``.
+
+    The rules of a group are already shared when it is visited, so groups
+    are compared by their combinator and the identity of their rules.
+    """
+    pending = [(query, iter(enumerate(query['rules'])), None)]
+    while True:
+        group, rules, position = pending[-1]
+        for idx, rule in rules:
+            if 'rules' in rule:
+                pending.append((rule, iter(enumerate(rule['rules'])), idx))
+                break
         else:
-            result.append(processed_rule)
-    
-    return result
+            pending.pop()
+            key = (group['combinator'], tuple(map(id, group['rules'])))
+            shared = groups.setdefault(key, group)
+            if not pending:
+                return shared
+            if shared is not group:
+                pending[-1][0]['rules'][position] = shared
 
 
-def _optimize_query(query):
-    """Optimize query by flattening unnecessary nesting."""
-    if not isinstance(query, dict) or 'rules' not in query:
-        return query
-        
-    rules = query['rules']
-    
-    # If only one rule, return it directly if it's a query
-    if len(rules) == 1:
-        rule = rules[0]
-        if isinstance(rule, dict) and 'combinator' in rule:
-            return rule
-        # Otherwise keep the single rule in the query
-        return query
-    
-    # Flatten rules with same combinator
-    optimized_rules = []
-    for rule in rules:
-        if (isinstance(rule, dict) and 
-            'combinator' in rule and 
-            rule['combinator'] == query['combinator']):
-            # Same combinator - flatten the rules
-            optimized_rule = _optimize_query(rule)
-            if 'rules' in optimized_rule:
-                optimized_rules.extend(optimized_rule['rules'])
+def convert_from_domains(domains):
+    """
+    Convert many OpenERP/Odoo domains to JSON format at once.
+
+    Identical domains and conditions are only converted once and identical
+    groups are shared between the results, so the results must not be
+    modified in place.
+
+    Args:
+        domains (iterable): Domains to convert
+
+    Returns:
+        list: JSON structures in the same order as the domains
+
+    Example:
+        >>> company = ['|', ('company_id', '=', False), ('company_id', '=', 1)]
+        >>> first, second = convert_from_domains([
+        ...     company + [('state', '=', 'open')],
+        ...     company + [('type', '=', 'out_invoice')]
+        ... ])
+        >>> first['rules'][0] is second['rules'][0]
+        True
+    """
+    # Keep the domains alive, conditions are cached by their id
+    domains = list(domains)
+    converted = {}
+    conditions = {}
+    rules = {}
+    groups = {}
+
+    def process_element(element):
+        rule = conditions.get(id(element))
+        if rule is None:
+            key = None
+            if len(element) == 3:
+                key = _leaf_key(*element)
+            rule = rules.get(key) if key is not None else None
+            if rule is None:
+                rule = _process_element(element)
+                if key is not None:
+                    rules[key] = rule
+            conditions[id(element)] = rule
+        return rule
+
+    def domain_key(domain):
+        key = []
+        for element in reversed(domain):
+            if element == '|' or element == '&':
+                key.append(element)
+            elif (isinstance(element, (list, tuple)) and not (
+                    len(element) > 0 and element[0] in ('|', '&'))):
+                rule = conditions.get(id(element)) or process_element(element)
+                key.append(id(rule))
+            else:
+                # Nested domains are not cached
+                return None
+        return tuple(key)
+
+    results = []
+    for domain in domains:
+        try:
+            key = domain_key(domain)
+        except (TypeError, ValueError):
+            # Let the parser raise the error of the invalid domain
+            key = None
+        result = converted.get(key) if key is not None else None
+        if result is None:
+            if not domain:
+                result = {'combinator': 'and', 'rules': []}
+            else:
+                result = _finalize(_parse_domain(domain, process_element))
+            result = _share_groups(result, groups)
+            if key is not None:
+                converted[key] = result
+        results.append(result)
+    return results
+
+
+class _QueryIndex(object):
+    """Shapes of the groups of many queries indexed by their structure.
+
+    Identical groups get the same reference, the ``id`` of the first one
+    found, so their shape is computed once and their domain can be built
+    once.
+    """
+
+    def __init__(self):
+        self.refs = {}
+        self.structures = {}
+        self.summaries = {}
+        self.counts = defaultdict(int)
+        self.leaves = {}
+        self.tuples = {}
+
+    def key(self, group):
+        return self.refs[id(group)]
+
+    def process_rule(self, rule):
+        leaf = self.leaves.get(id(rule))
+        if leaf is None:
+            return _process_rule(rule)
+        return leaf
+
+    def rule_ref(self, rule):
+        """Return the reference of a simple rule and share its tuple."""
+        if not (isinstance(rule, dict) and 'field' in rule
+                and 'operator' in rule and 'value' in rule):
+            # Invalid rules raise when the domain is built
+            return id(rule)
+        key = _leaf_key(rule['field'], rule['operator'], rule['value'])
+        if key is None:
+            return id(rule)
+        leaf = self.tuples.get(key)
+        if leaf is None:
+            leaf = self.tuples[key] = _process_rule(rule)
+        self.leaves[id(rule)] = leaf
+        return key
+
+    def add(self, query):
+        """Index the groups of the query walking it in post-order."""
+        pending = [(query, iter(query['rules']), [], [])]
+        while pending:
+            group, rules, children, structure = pending[-1]
+            for rule in rules:
+                if not (isinstance(rule, dict) and 'rules' in rule):
+                    structure.append(self.rule_ref(rule))
+                    continue
+                ref = self.refs.get(id(rule))
+                if ref is None:
+                    pending.append((rule, iter(rule['rules'] or ()), [], []))
+                    break
+                self.counts[ref] += 1
+                children.append(self.summaries[ref])
+                structure.append(ref)
             else:
-                optimized_rules.append(optimized_rule)
+                pending.pop()
+                is_and = group.get('combinator', 'and') == 'and'
+                ref = self.structures.setdefault(
+                    (is_and, tuple(structure)), id(group)
+                )
+                self.refs[id(group)] = ref
+                if ref not in self.summaries:
+                    self.summaries[ref] = _summary(group, children)
+                self.counts[ref] += 1
+                if pending:
+                    pending[-1][2].append(self.summaries[ref])
+                    pending[-1][3].append(ref)
+
+
+def convert_to_domains(queries):
+    """
+    Convert many JSON query structures to OpenERP/Odoo domains at once.
+
+    The domain of a group found more than once in the queries is only built
+    the first time and copied afterwards, and identical conditions share
+    the same tuple.
+
+    Args:
+        queries (iterable): JSON structures with combinator and rules
+
+    Returns:
+        list: OpenERP/Odoo domains in the same order as the queries
+    """
+    # Keep the queries alive, groups are indexed by their id
+    queries = list(queries)
+    index = _QueryIndex()
+    for query in queries:
+        if query and isinstance(query, dict) and query.get('rules'):
+            index.add(query)
+    emitted = dict(
+        (ref, None) for ref, count in index.counts.items() if count > 1
+    )
+    results = []
+    for query in queries:
+        if query and isinstance(query, dict) and query.get('rules'):
+            results.append(_emit(
+                query, index.summaries, index.process_rule, index.key, emitted
+            ))
         else:
-            optimized_rules.append(rule)
-    
-    return {
-        'combinator': query['combinator'],
-        'rules': optimized_rules
-    }
\ No newline at end of file
+            results.append([])
+    return results
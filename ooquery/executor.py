@@ -0,0 +1,358 @@
+# coding=utf-8
+"""
+Query execution on DB-API connections.
+
+OOQuery only builds queries. `QueryExecutor` runs them (python-sql selects,
+`CompiledQuery` or ``(sql, params)`` tuples) on a DB-API 2.0 connection and
+streams the rows in ``fetchmany`` batches, so big results never have to be
+loaded at once. `ParallelExecutor` runs many independent queries
+concurrently on the connections of a `ConnectionPool`.
+"""
+from __future__ import absolute_import
+import threading
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from itertools import count
+from timeit import default_timer
+
+try:
+    from queue import Empty, Queue
+except ImportError:
+    from Queue import Empty, Queue
+
+_cursor_names = count(1)
+
+QueryResult = namedtuple('QueryResult', ['query', 'rows', 'elapsed'])
+
+
+def server_side_cursor(connection, name=None):
+    """Return a named (server-side) cursor of the connection.
+
+    Drivers without named cursors (sqlite3, ...) get a plain cursor, which
+    is still read with ``fetchmany``.
+    """
+    if name is None:
+        name = 'ooquery_{}'.format(next(_cursor_names))
+    try:
+        return connection.cursor(name=name)
+    except TypeError:
+        return connection.cursor()
+
+
+class QueryExecutor(object):
+    """Execute queries on a DB-API connection.
+
+    Usage::
+
+        executor = QueryExecutor(conn, batch_size=5000)
+        q = OOQuery('account_invoice', fk_function)
+        sql = q.select(['number', 'amount_total']).where(domain)
+        for row in executor.iterate(sql):
+            writer.writerow(row)
+
+    :param connection: DB-API 2.0 connection
+    :param batch_size: Rows fetched in each ``fetchmany``
+    :param server_side: Stream the rows with named (server-side) cursors
+        when the driver supports them (psycopg2). In PostgreSQL they must be
+        used inside a transaction
+    :param stats: Optional `QueryStats` to record ``execute`` timings and
+        the ``fetch.batches`` and ``fetch.rows`` counters
+    :param cache: Optional `ooquery.cache.ResultCache` for the results of
+        `execute`
+    """
+
+    def __init__(self, connection, batch_size=1000, server_side=True,
+                 stats=None, cache=None):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.server_side = server_side
+        self.stats = stats
+        self.cache = cache
+
+    def cursor(self, stream=False):
+        if stream and self.server_side:
+            cursor = server_side_cursor(self.connection)
+        else:
+            cursor = self.connection.cursor()
+        if stream and hasattr(cursor, 'itersize'):
+            cursor.itersize = self.batch_size
+        return cursor
+
+    def _execute(self, cursor, query):
+        sql, params = tuple(query)
+        if self.stats is None:
+            cursor.execute(sql, params)
+        else:
+            with self.stats.timing('execute'):
+                cursor.execute(sql, params)
+
+    def execute(self, query):
+        """Execute the query and return all its rows.
+
+        It can be used as the ``fetch`` of `OOQuery.paginate`. With a
+        ``cache`` the cached rows are returned, they must not be modified.
+        """
+        if self.cache is not None:
+            return self.cache.fetch(query, self._fetchall)
+        return self._fetchall(query)
+
+    def _fetchall(self, query):
+        cursor = self.cursor()
+        try:
+            self._execute(cursor, query)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        if self.stats is not None:
+            self.stats.incr('fetch.rows', len(rows))
+        return rows
+
+    __call__ = execute
+
+    def write(self, queries):
+        """Execute the writing queries (``update``, ``delete``,
+        ``iter_insert``...) in order on the same cursor.
+
+        The queries are consumed one by one, so a generator of batches is
+        never held in memory.
+
+        :return: List of the rows returned by the queries with ``RETURNING``
+        """
+        cursor = self.cursor()
+        result = []
+        try:
+            for query in queries:
+                self._execute(cursor, query)
+                if self.stats is not None:
+                    self.stats.incr('write.statements')
+                if cursor.description is not None:
+                    result.extend(cursor.fetchall())
+        finally:
+            cursor.close()
+        return result
+
+    def batches(self, query, batch_size=None):
+        """Execute the query and yield its rows in lists of at most
+        ``batch_size`` rows.
+
+        Only one batch is held in memory. The cursor is closed when the
+        generator is exhausted or closed.
+        """
+        if batch_size is None:
+            batch_size = self.batch_size
+        cursor = self.cursor(stream=True)
+        try:
+            self._execute(cursor, query)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                if self.stats is not None:
+                    self.stats.incr('fetch.batches')
+                    self.stats.incr('fetch.rows', len(rows))
+                yield rows
+                if len(rows) < batch_size:
+                    break
+        finally:
+            cursor.close()
+
+    def iterate(self, query, batch_size=None):
+        """Execute the query and yield its rows one by one, fetched in
+        batches of ``batch_size`` rows.
+        """
+        for rows in self.batches(query, batch_size):
+            for row in rows:
+                yield row
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of at most ``maxsize`` DB-API connections.
+
+    Connections are created on demand with ``connect()`` and reused.
+
+    :param connect: Callable returning a new connection
+    :param maxsize: Maximum number of connections
+    :param commit: Commit the transaction of the connections returned to the
+        pool by `connection` instead of rolling it back
+    """
+
+    def __init__(self, connect, maxsize=4, commit=False):
+        if maxsize < 1:
+            raise ValueError('The pool needs at least one connection')
+        self.connect = connect
+        self.maxsize = maxsize
+        self.commit = commit
+        self.created = 0
+        self._idle = deque()
+        # Notified when a connection is released or discarded
+        self._available = threading.Condition(threading.Lock())
+
+    def acquire(self, timeout=None):
+        """Return an idle connection, creating it if the pool is not full,
+        or wait for one to be released or discarded.
+
+        :raises Empty: If there is no connection after ``timeout`` seconds
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = default_timer() + timeout
+        with self._available:
+            while not self._idle and self.created >= self.maxsize:
+                if deadline is None:
+                    self._available.wait()
+                    continue
+                remaining = deadline - default_timer()
+                if remaining <= 0:
+                    raise Empty
+                self._available.wait(remaining)
+            if self._idle:
+                return self._idle.popleft()
+            self.created += 1
+        try:
+            return self.connect()
+        except Exception:
+            with self._available:
+                self.created -= 1
+                self._available.notify()
+            raise
+
+    def release(self, connection):
+        with self._available:
+            self._idle.append(connection)
+            self._available.notify()
+
+    def discard(self, connection):
+        """Close a broken connection, freeing its place in the pool."""
+        with self._available:
+            self.created -= 1
+            self._available.notify()
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager with a connection of the pool.
+
+        The transaction is ended before returning the connection to the
+        pool, so idle connections do not hold locks: it is rolled back, or
+        committed with ``commit`` unless the block raises.
+        """
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        except Exception:
+            try:
+                connection.rollback()
+            except Exception:
+                self.discard(connection)
+            else:
+                self.release(connection)
+            raise
+        if self.commit:
+            try:
+                connection.commit()
+            except Exception:
+                self.discard(connection)
+                raise
+        else:
+            try:
+                connection.rollback()
+            except Exception:
+                self.discard(connection)
+                return
+        self.release(connection)
+
+    def close(self):
+        """Close the idle connections."""
+        with self._available:
+            connections = list(self._idle)
+            self._idle.clear()
+            self.created -= len(connections)
+            self._available.notify_all()
+        for connection in connections:
+            connection.close()
+
+
+class ParallelExecutor(object):
+    """Execute independent queries concurrently with a pool of connections.
+
+    Usage::
+
+        pool = ConnectionPool(lambda: psycopg2.connect(dsn), maxsize=8)
+        executor = ParallelExecutor(pool)
+        results = executor.execute([
+            q.compile(fields, domain) for domain in domains
+        ])
+        for result in results:
+            print(result.rows, result.elapsed)
+
+    :param pool: `ConnectionPool`
+    :param max_workers: Maximum number of queries running at the same time,
+        by default the size of the pool
+    :param stats: Optional `QueryStats`, see `QueryExecutor`
+    :param cache: Optional `ooquery.cache.ResultCache`, see `QueryExecutor`
+    """
+
+    def __init__(self, pool, max_workers=None, stats=None, cache=None,
+                 timer=default_timer):
+        self.pool = pool
+        self.max_workers = max_workers or pool.maxsize
+        self.stats = stats
+        self.cache = cache
+        self.timer = timer
+
+    def execute_one(self, query):
+        """Execute a query on a connection of the pool.
+
+        :return: `QueryResult` with the rows and the time to get them
+        """
+        start = self.timer()
+        if self.cache is not None:
+            rows = self.cache.fetch(query, self._execute)
+        else:
+            rows = self._execute(query)
+        return QueryResult(query, rows, self.timer() - start)
+
+    def _execute(self, query):
+        with self.pool.connection() as connection:
+            return QueryExecutor(connection, stats=self.stats).execute(query)
+
+    def execute(self, queries):
+        """Execute the queries concurrently.
+
+        :return: List of `QueryResult` in the order of ``queries``. If a
+            query fails the exception of the first failed query is raised
+            once all of them are finished
+        """
+        queries = list(queries)
+        results = [None] * len(queries)
+        errors = [None] * len(queries)
+        pending = Queue()
+        for idx, query in enumerate(queries):
+            pending.put((idx, query))
+
+        def worker():
+            while True:
+                try:
+                    idx, query = pending.get_nowait()
+                except Empty:
+                    return
+                try:
+                    results[idx] = self.execute_one(query)
+                except Exception as error:
+                    errors[idx] = error
+
+        workers = [
+            threading.Thread(target=worker)
+            for _ in range(min(self.max_workers, len(queries)))
+        ]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        for error in errors:
+            if error is not None:
+                raise error
+        return results
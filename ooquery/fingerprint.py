@@ -0,0 +1,206 @@
+# coding=utf-8
+"""
+Canonical form and fingerprints of domains.
+
+The same logical domain can be written in many ways: conditions as tuples
+or lists, ``<>`` instead of ``!=``, ``=like`` instead of ``like``, AND
+conjuncts in any order... `canonical_domain` rewrites all of them to the
+same domain and `domain_fingerprint` returns a stable hash of it, usable as
+a cache key between processes.
+"""
+from __future__ import absolute_import
+import hashlib
+import json
+from collections import deque
+
+from sql import Expression as SQLExpression, Select
+
+from ooquery.compiler import freeze, is_subquery
+from ooquery.expression import OPERATORS, Field
+from ooquery.optimizer import AND, LEAF, NOT, parse_domain, to_domain
+
+# Shortest name of every operator class: '<>' is '!=', '=like' is 'like'...
+CANONICAL_OPERATORS = {}
+for _name, _operator in OPERATORS.items():
+    _current = CANONICAL_OPERATORS.get(_operator)
+    if _current is None or (len(_name), _name) < (len(_current), _current):
+        CANONICAL_OPERATORS[_operator] = _name
+del _name, _operator, _current
+
+
+def canonical_operator(operator):
+    try:
+        return CANONICAL_OPERATORS[OPERATORS[operator]]
+    except KeyError:
+        raise ValueError('Operator {} is not supported'.format(operator))
+
+
+def encode_value(value):
+    """Return a JSON serializable representation of value keeping its type.
+    """
+    if value is None:
+        return ['null']
+    elif isinstance(value, bool):
+        return ['bool', value]
+    elif isinstance(value, float):
+        return ['float', repr(value)]
+    elif isinstance(value, (int, type(2 ** 64))):
+        return ['int', str(value)]
+    elif isinstance(value, bytes) and not isinstance(value, str):
+        return ['bytes', value.decode('latin-1')]
+    elif isinstance(value, (str, type(u''))):
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        return ['str', value]
+    elif isinstance(value, Field):
+        return ['field', value.name]
+    elif isinstance(value, (list, tuple)):
+        return ['list'] + [encode_value(item) for item in value]
+    elif is_subquery(value):
+        subquery = value.as_subquery()
+        return ['subquery', str(subquery), encode_value(subquery.params)]
+    return ['repr', repr(freeze(value))]
+
+
+def value_shape(value):
+    """Return the part of the value changing the SQL of a condition."""
+    if value is None or isinstance(value, Field):
+        return encode_value(value)
+    elif isinstance(value, (SQLExpression, Select)):
+        return ['sql', repr(freeze(value))]
+    elif is_subquery(value):
+        return ['subquery', str(value.as_subquery())]
+    elif isinstance(value, (list, tuple)):
+        return ['list', len(value)]
+    return ['value']
+
+
+def _dumps(parts):
+    return json.dumps(parts, separators=(',', ':'))
+
+
+def _digest(kind, text):
+    return hashlib.sha1((kind + text).encode('utf-8')).hexdigest()
+
+
+def _canonical_leaf(leaf, normalize_values, values):
+    """Return the canonical leaf and its serialized form."""
+    field, operator, value = leaf
+    operator = canonical_operator(operator)
+    if isinstance(value, tuple):
+        value = list(value)
+    if not values:
+        return (field, operator, value), _dumps(
+            [encode_value(field), operator, value_shape(value)]
+        )
+    if (normalize_values and operator in ('in', 'not in')
+            and isinstance(value, list)):
+        # Sort and remove duplicates from the list of values
+        items = {}
+        for item in value:
+            items.setdefault(_dumps(encode_value(item)), item)
+        value = [items[key] for key in sorted(items)]
+    leaf = (field, operator, value)
+    return leaf, _dumps([encode_value(field), operator, encode_value(value)])
+
+
+def canonicalize(domain, normalize_values=True, values=True):
+    """Return the canonical tree of the domain and its digest.
+
+    Operators of the same kind are flattened and their operands sorted,
+    conditions first. With ``values`` duplicated operands are removed,
+    without them the digest only depends on the shape of the values.
+    """
+    if not domain:
+        return None, _digest(AND, '')
+    root = parse_domain(domain)
+    result = None
+    # Canonical items are (node, digest, sort key, operands)
+    pending = [(root, iter(root[1]) if root[0] != LEAF else None, [])]
+    while pending:
+        node, children, operands = pending[-1]
+        if children is not None:
+            child = next(children, None)
+            if child is not None:
+                pending.append(
+                    (child, iter(child[1]) if child[0] != LEAF else None, [])
+                )
+                continue
+        pending.pop()
+        operator = node[0]
+        if operator == LEAF:
+            leaf, serialized = _canonical_leaf(
+                node[1], normalize_values, values
+            )
+            digest = _digest(LEAF, serialized)
+            item = ((LEAF, leaf), digest, (0, serialized), None)
+        elif operator == NOT:
+            child = operands[0]
+            if child[0][0] == NOT:
+                # Double negation
+                item = child[3][0]
+            else:
+                digest = _digest(NOT, child[1])
+                item = ((NOT, deque([child[0]])), digest, (1, digest), [child])
+        else:
+            flat = []
+            for child in operands:
+                if child[0][0] == operator:
+                    # Operand reduced to the same operator
+                    flat.extend(child[3])
+                else:
+                    flat.append(child)
+            flat.sort(key=lambda child: child[2])
+            if values:
+                unique = []
+                for child in flat:
+                    if not unique or unique[-1][1] != child[1]:
+                        unique.append(child)
+                flat = unique
+            if len(flat) == 1:
+                item = flat[0]
+            else:
+                digest = _digest(
+                    operator, ''.join(sorted(child[1] for child in flat))
+                )
+                item = (
+                    (operator, deque(child[0] for child in flat)),
+                    digest, (1, digest), flat
+                )
+        if pending:
+            pending[-1][2].append(item)
+        else:
+            result = item
+    return result[0], result[1]
+
+
+def canonical_domain(domain, normalize_values=True):
+    """Return the canonical form of the domain.
+
+    >>> canonical_domain([['state', '<>', 'draft'], ('amount', '>', 10)])
+    [('amount', '>', 10), ('state', '!=', 'draft')]
+    """
+    node, _ = canonicalize(domain, normalize_values)
+    if node is None:
+        return []
+    return to_domain(node)
+
+
+def domain_fingerprint(domain, normalize_values=True):
+    """Return a stable hash of the canonical form of the domain.
+
+    Two domains with the same fingerprint are logically the same. With
+    ``normalize_values`` the order and the duplicates of the values of
+    ``in`` and ``not in`` are ignored.
+    """
+    return canonicalize(domain, normalize_values)[1]
+
+
+def domain_skeleton_fingerprint(domain):
+    """Return a stable hash of the canonical form of the domain without the
+    values.
+
+    Only the shape of the values which changes the SQL (lists lengths,
+    ``None``, fields) is kept.
+    """
+    return canonicalize(domain, values=False)[1]
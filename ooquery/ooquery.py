@@ -1,26 +1,111 @@
 # coding=utf-8
 from __future__ import absolute_import
+from copy import copy
 from functools import reduce
 
-from sql import Table, Literal, NullOrder, As
-from sql.aggregate import Aggregate
+from sql import Table, Literal, NullOrder, NullsFirst, As
+from sql import Expression as SQLExpression
+from sql.aggregate import Aggregate, Count
 from sql.conditionals import Conditional
-from sql.operators import Operator
-from ooquery.parser import Parser
+from sql.operators import And, Equal, Greater, GreaterEqual, Less, Operator, Or
+from ooquery.operators import LEFT_JOINS, Star
+from ooquery.parser import Parser, get_join_paths
+from ooquery.cache import ForeignKeyCache, CompileCache
+from ooquery.statements import WRITE_STRATEGIES, DeleteUsing, Upsert
+from ooquery.compiler import (
+    QueryTemplate, domain_skeleton, flavor_key, freeze, is_subquery,
+    slot_domain
+)
+from ooquery.expression import Field
+
+
+def parse_order(item):
+    """Return ``(field, descending, nulls_first)`` of an ``order_by`` item.
+
+    Without an explicit `NullOrder` the PostgreSQL default is used: nulls
+    are bigger than any value.
+
+    >>> parse_order('partner_id.name.desc')
+    ('partner_id.name', True, True)
+    """
+    null_order = None
+    if isinstance(item, NullOrder):
+        null_order = item.__class__
+        item = item.expression
+    field, descending = item, False
+    if '.' in item:
+        name, direction = item.rsplit('.', 1)
+        if direction.lower() in ('asc', 'desc'):
+            field, descending = name, direction.lower() == 'desc'
+    if null_order is None:
+        nulls_first = descending
+    else:
+        nulls_first = issubclass(null_order, NullsFirst)
+    return field, descending, nulls_first
+
+
+def seek_condition(keys, values):
+    """Return the condition of the rows after ``values`` in the order of
+    ``keys``, a list of ``(column, descending, nulls_first)``.
+
+    Returns None if there are no rows after ``values``.
+    """
+    terms = []
+    equals = []
+    for (column, descending, nulls_first), value in zip(keys, values):
+        if value is None:
+            # After a null there are only the values when nulls go first
+            after = column != None if nulls_first else None
+        else:
+            after = Less(column, value) if descending else Greater(column, value)
+            if not nulls_first:
+                after = Or([after, Equal(column, None)])
+        if after is not None:
+            terms.append(And(equals + [after]))
+        equals.append(Equal(column, value))
+    if not terms:
+        return None
+    condition = Or(terms) if len(terms) > 1 else terms[0]
+    column, descending, nulls_first = keys[0]
+    value = values[0]
+    if value is not None and not descending and nulls_first:
+        # Redundant bound on the first key to allow an index range scan
+        condition = And([GreaterEqual(column, value), condition])
+    elif value is not None and descending and nulls_first:
+        condition = And([column <= value, condition])
+    return condition
 
 
 class OOQuery(object):
-    def __init__(self, table, foreign_key=None):
+    def __init__(self, table, foreign_key=None, fk_cache=None,
+                 compile_cache=None, stats=None, **parser_options):
         self._fields = []
+        self._fields_memo = None
         self.table = Table(table)
         self.foreign_key = foreign_key
+        if fk_cache is None and foreign_key is not None:
+            if isinstance(foreign_key, ForeignKeyCache):
+                fk_cache = foreign_key
+            else:
+                fk_cache = ForeignKeyCache(foreign_key)
+        self.fk_cache = fk_cache
+        if foreign_key is None or foreign_key is fk_cache:
+            self._foreign_key = fk_cache
+        else:
+            self._foreign_key = fk_cache.bind(foreign_key)
+        self.compile_cache = compile_cache
+        self.stats = stats
+        self.parser_options = parser_options
         self._select = self.table.select()
         self.parser = self.create_parser()
         self.select_opts = {}
         self.as_ = {}
 
     def create_parser(self):
-        return Parser(self.table, self.foreign_key)
+        return Parser(
+            self.table, self._foreign_key, stats=self.stats,
+            **self.parser_options
+        )
 
     @property
     def select_on(self):
@@ -31,6 +116,25 @@ class OOQuery(object):
 
     @property
     def fields(self):
+        """Columns of the select, resolved once for each select."""
+        return list(self.memoize_fields())
+
+    def memoize_fields(self):
+        """Resolve the columns of the select and memoize them.
+
+        The memoized columns are discarded if any of the joins they were
+        resolved with is missing or replaced in the parser.
+        """
+        if self._fields_memo is not None:
+            joins, fields = self._fields_memo
+            joins_map = self.parser.joins_map
+            if all(joins_map.get(path) is join for path, join in joins):
+                return fields
+        fields = self.resolve_fields()
+        self._fields_memo = (list(self.parser.joins_map.items()), fields)
+        return fields
+
+    def resolve_fields(self):
         fields = []
         for field in self._fields:
             output_name = None
@@ -84,6 +188,7 @@ class OOQuery(object):
     def select(self, fields=None, **kwargs):
         self.parser = self.create_parser()
         self._fields = fields
+        self._fields_memo = None
         self.select_opts = kwargs
         self.as_ = kwargs.pop('as_', self.as_)
         order_by = kwargs.pop('order_by', None)
@@ -116,6 +221,404 @@ class OOQuery(object):
 
     def where(self, domain):
         where = self.parser.parse(domain)
-        self._select = self.select_on.select(*self.fields, **self.select_opts)
+        fields = self.fields
+        if self.parser.eliminate_joins:
+            self.parser.prune_unused_joins([fields, where] + [
+                self.select_opts.get(key)
+                for key in ('order_by', 'group_by', 'having')
+            ])
+        if self.parser.promote_joins:
+            self.parser.promote_outer_joins(where)
+        if self.parser.eliminate_joins or self.parser.promote_joins:
+            self._fields_memo = (list(self.parser.joins_map.items()), fields)
+        self._select = self.select_on.select(*fields, **self.select_opts)
         self._select.where = where
         return self._select
+
+    def count(self, domain):
+        """Return the query counting the rows of the select matching the
+        domain.
+
+        The select list, ``order_by``, ``limit`` and ``offset`` are dropped
+        and so are the LEFT joins not used by the domain, as they do not
+        filter rows. If one of the remaining joins is a to-many join the
+        rows are counted with ``COUNT(DISTINCT id)``.
+        """
+        parser = self.parser.copy()
+        where = parser.parse(domain)
+        keep = ['.'.join(path) for path in get_join_paths(domain=domain)]
+        for dotted_path, join in parser.joins_map.items():
+            if join.type_ not in LEFT_JOINS:
+                keep.append(dotted_path)
+        parser.prune_joins(keep)
+        if parser.eliminate_joins:
+            parser.prune_unused_joins([where])
+        if parser.promote_joins:
+            parser.promote_outer_joins(where)
+        if any(parser.is_to_many(path) for path in parser.joins_map):
+            count = Count(self.table.id, distinct=True)
+        else:
+            count = Count(Star())
+        select_on = parser.joins[-1] if parser.joins else self.table
+        select = select_on.select(count.as_('count'))
+        select.where = where
+        return select
+
+    def write_condition(self, domain, strategy='join'):
+        """Return the table to write, the tables to join with it and the
+        condition of the rows of the domain.
+
+        With the ``join`` strategy the joins of the domain are flattened to
+        a list of tables and their conditions are added to the ``WHERE``.
+        If there are outer joins, or with the ``subquery`` strategy, the
+        rows are filtered with ``id IN (SELECT id ...)`` on a new instance
+        of the table.
+        """
+        if strategy not in WRITE_STRATEGIES:
+            raise ValueError(
+                'Write strategy {} is not supported'.format(strategy)
+            )
+        parser = self.create_parser()
+        where = parser.parse(domain)
+        if parser.eliminate_joins:
+            parser.prune_unused_joins([where])
+        if parser.promote_joins:
+            parser.promote_outer_joins(where)
+        if not parser.joins:
+            return self.table, [], where
+        if strategy == 'join' and all(
+                join.type_ == 'INNER' for join in parser.joins):
+            conditions = [join.condition for join in parser.joins]
+            if where:
+                conditions.append(where)
+            return (
+                self.table, [join.right for join in parser.joins],
+                And(conditions)
+            )
+        table = Table(self.table._name)
+        select = parser.join_on.select(self.table.id)
+        select.where = where
+        return table, [], table.id.in_(select)
+
+    def get_write_column(self, table, field):
+        if '.' in field:
+            raise ValueError(
+                "Field '{}' is not a field of table '{}'".format(
+                    field, table._name
+                )
+            )
+        return getattr(table, field)
+
+    def update(self, values, domain, returning=None, strategy='join'):
+        """Return the query updating the rows matching the domain.
+
+        Usage::
+
+            sql = q.update({'state': 'cancel'}, [
+                ('partner_id.country_id.code', '=', 'ES')
+            ])
+            cursor.execute(*sql)
+
+        :param values: Dict of the new values by field. Values can be
+            `Field` of the table, python-sql expressions or subqueries
+        :param returning: Fields of the table to return
+        :param strategy: ``join`` (``UPDATE ... FROM``) or ``subquery``
+            (``WHERE id IN (SELECT ...)``), see `write_condition`
+        """
+        if not values:
+            raise ValueError('There are no values to update')
+        table, from_, where = self.write_condition(domain, strategy)
+        columns = []
+        update_values = []
+        for field, value in sorted(values.items(), key=lambda item: item[0]):
+            columns.append(self.get_write_column(table, field))
+            if isinstance(value, Field):
+                value = self.get_write_column(table, value.name)
+            elif is_subquery(value):
+                value = value.as_subquery()
+            update_values.append(value)
+        return table.update(
+            columns, update_values, from_=from_ or None, where=where or None,
+            returning=self.get_returning(table, returning)
+        )
+
+    def delete(self, domain, returning=None, strategy='join'):
+        """Return the query deleting the rows matching the domain.
+
+        :param returning: Fields of the table to return
+        :param strategy: ``join`` (``DELETE ... USING``) or ``subquery``
+            (``WHERE id IN (SELECT ...)``), see `write_condition`
+        """
+        table, using, where = self.write_condition(domain, strategy)
+        return DeleteUsing(
+            table, using=using, where=where or None,
+            returning=self.get_returning(table, returning)
+        )
+
+    def insert(self, fields, rows, on_conflict=None, update=None,
+               returning=None, batch_size=1000, max_params=32766):
+        """Return the queries inserting the rows, see `iter_insert`."""
+        return list(self.iter_insert(
+            fields, rows, on_conflict, update, returning, batch_size,
+            max_params
+        ))
+
+    def iter_insert(self, fields, rows, on_conflict=None, update=None,
+                    returning=None, batch_size=1000, max_params=32766):
+        """Yield the queries inserting the rows with multi-row ``VALUES``.
+
+        The rows are read from the iterable as the queries are consumed, so
+        only one batch is held in memory.
+
+        Usage::
+
+            for sql in q.iter_insert(['code', 'name'], rows,
+                                     on_conflict=['code']):
+                cursor.execute(*sql)
+
+        :param fields: Fields of the table to insert
+        :param rows: Iterable of sequences in the order of ``fields`` or of
+            mappings by field
+        :param on_conflict: Fields of the unique constraint for an
+            ``ON CONFLICT`` upsert
+        :param update: Fields updated on conflict, by default all the
+            inserted fields but the ``on_conflict`` ones. With an empty list
+            the conflicting rows are skipped
+        :param returning: Fields of the table to return
+        :param batch_size: Maximum number of rows of each query
+        :param max_params: Maximum number of parameters of each query
+        """
+        table = self.table
+        columns = [self.get_write_column(table, field) for field in fields]
+        returning = self.get_returning(table, returning)
+        if on_conflict:
+            if update is None:
+                update = [f for f in fields if f not in on_conflict]
+            conflict = [
+                self.get_write_column(table, field) for field in on_conflict
+            ]
+            update = [self.get_write_column(table, field) for field in update]
+
+        def query(values):
+            if on_conflict:
+                return Upsert(
+                    table, conflict, update, columns=columns, values=values,
+                    returning=returning
+                )
+            return table.insert(columns, values, returning=returning)
+
+        values = []
+        params = 0
+        for row in rows:
+            if hasattr(row, 'keys'):
+                row = [row[field] for field in fields]
+            else:
+                row = list(row)
+            if len(row) != len(columns):
+                raise ValueError(
+                    'Rows must have {} values'.format(len(columns))
+                )
+            row_params = sum(
+                len(value.params) if isinstance(value, SQLExpression) else 1
+                for value in row
+            )
+            if values and (len(values) >= batch_size
+                           or params + row_params > max_params):
+                yield query(values)
+                values = []
+                params = 0
+            values.append(row)
+            params += row_params
+        if values:
+            yield query(values)
+
+    def get_returning(self, table, returning):
+        if not returning:
+            return None
+        return [self.get_write_column(table, field) for field in returning]
+
+    def as_subquery(self):
+        """Return the select of the last `select` or `where`, to be used as
+        the value of a leaf of another query.
+
+        Usage::
+
+            partners = OOQuery('res_partner').select(['id'])
+            partners.where([('customer', '=', True)])
+            sql = q.select(['number']).where([
+                ('partner_id', 'in', partners)
+            ])
+
+        Raises ValueError if the query has no select list.
+        """
+        if not self._fields:
+            raise ValueError(
+                "Query on table '{}' has no fields, call select before "
+                "using it as a subquery".format(self.table._name)
+            )
+        return self._select
+
+    def compile_key(self, fields, domain, select_opts):
+        """Return the key of the compile cache for a query.
+
+        The key includes the aliases kept from previous selects and the
+        foreign key resolver, so queries with different resolvers can share
+        the cache. Returns None if the query can not be cached.
+        """
+        resolver = self.foreign_key
+        if resolver is None:
+            resolver = self.fk_cache
+        key = (
+            self.table._name, freeze(fields), freeze(select_opts),
+            freeze(self.as_),
+            domain_skeleton(domain, self.parser_options.get('in_threshold')),
+            freeze(self.parser_options), flavor_key(), resolver
+        )
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def compile(self, fields, domain, **kwargs):
+        """Compile the query to an immutable `CompiledQuery`.
+
+        It does not change the state of the `OOQuery`, so it can be called
+        from different threads. When the query has a ``compile_cache``, the
+        SQL is rendered once for each shape of the domain (the domain
+        without its values) and next calls only bind the values.
+        """
+        return self._compile(
+            fields, domain, kwargs, self.compile_cache,
+            lambda: copy(self).select(fields, **kwargs)
+        )
+
+    def compile_many(self, fields, domains, **kwargs):
+        """Compile one query for each domain with the same select.
+
+        The foreign keys of the union of the join paths are resolved once,
+        the select list and its joins are built once and shared by all the
+        queries and domains with the same shape are rendered once.
+
+        :return: List of `CompiledQuery` in the order of ``domains``
+        """
+        domains = list(domains)
+        self.resolve_join_paths(get_join_paths(
+            fields, [leaf for domain in domains for leaf in domain],
+            kwargs.get('order_by'), kwargs.get('group_by')
+        ))
+        base = copy(self).select(fields, **kwargs)
+        # Resolve the select list once, the copies of base share the memo
+        base.memoize_fields()
+        cache = self.compile_cache
+        if cache is None:
+            cache = CompileCache(maxsize=None)
+
+        def prepare():
+            query = copy(base)
+            query.parser = base.parser.copy()
+            return query
+
+        def compile_domain(domain):
+            return self._compile(fields, domain, kwargs, cache, prepare)
+
+        return [compile_domain(domain) for domain in domains]
+
+    def resolve_join_paths(self, paths):
+        """Resolve the foreign keys of the join paths with the cache."""
+        if self._foreign_key is None:
+            return
+        tables = {(): self.table._name}
+        for path in sorted(paths, key=len):
+            fk = self._foreign_key(tables[path[:-1]], path[-1])
+            tables[path] = fk['foreign_table_name']
+
+    def _compile(self, fields, domain, select_opts, cache, prepare):
+        key = None
+        if cache is not None:
+            key = self.compile_key(fields, domain, select_opts)
+        template = None
+        if key is not None:
+            template = cache.get(key)
+        if template is None:
+            in_threshold = self.parser_options.get('in_threshold')
+            select = prepare().where(slot_domain(domain, in_threshold))
+            skeleton = domain_skeleton(domain, in_threshold)
+            if self.stats is None:
+                template = QueryTemplate.from_query(
+                    select, skeleton, in_threshold
+                )
+            else:
+                with self.stats.timing('render'):
+                    template = QueryTemplate.from_query(
+                        select, skeleton, in_threshold
+                    )
+            if key is not None:
+                cache.set(key, template)
+        return template.bind(domain)
+
+    def paginate(self, fields, domain, order_by, page_size, fetch, **kwargs):
+        """Iterate the pages of a query with keyset (seek) pagination.
+
+        Instead of an ``offset``, every page is filtered with the values of
+        the ``order_by`` keys of the last row of the previous one, so the
+        database only reads the rows of the page. ``id`` is added to the
+        keys as a tie breaker and the keys not in ``fields`` are added to
+        the select list.
+
+        :param fetch: Callable executing a query and returning its rows,
+            either as mappings by column name or as sequences in the order
+            of the select list
+        :return: Generator of pages (the lists returned by ``fetch``)
+        """
+        for option in ('limit', 'offset'):
+            if option in kwargs:
+                raise ValueError(
+                    'Paginated queries do not accept {}, the size of the '
+                    'pages is page_size'.format(option)
+                )
+        keys = []
+        for item in order_by or []:
+            field, descending, nulls_first = parse_order(item)
+            if field == 'id':
+                # ids are never null
+                nulls_first = True
+            keys.append((field, descending, nulls_first))
+        if 'id' not in [field for field, _, _ in keys]:
+            keys.append(('id', False, True))
+            order_by = list(order_by or []) + ['id.asc']
+        fields = list(fields)
+        positions = []
+        for field, _, _ in keys:
+            if field not in fields:
+                fields.append(field)
+            positions.append(fields.index(field))
+        values = None
+        while True:
+            query = copy(self).select(
+                fields, order_by=order_by, limit=page_size, **kwargs
+            )
+            select = query.where(domain)
+            if values is not None:
+                seek = seek_condition([
+                    (query.parser.get_table_field(query.table, field),
+                     descending, nulls_first)
+                    for field, descending, nulls_first in keys
+                ], values)
+                if seek is None:
+                    return
+                if select.where:
+                    seek = And([select.where, seek])
+                select.where = seek
+            rows = fetch(select)
+            if rows:
+                yield rows
+            if len(rows) < page_size:
+                return
+            last = rows[-1]
+            if hasattr(last, 'keys'):
+                values = [
+                    last[query.as_.get(field, field)] for field, _, _ in keys
+                ]
+            else:
+                values = [last[position] for position in positions]
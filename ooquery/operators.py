@@ -1,7 +1,14 @@
 # coding=utf-8
 from __future__ import absolute_import
 
-from sql import operators
+from sql import operators, Expression as SQLExpression, Select
+from sql.functions import Function
+
+__all__ = [
+    'OOOperator', 'Or', 'And', 'Not', 'OPERATORS_MAP', 'JoinType',
+    'InnerJoin', 'LeftJoin', 'LeftOuterJoin', 'RightJoin', 'RightOuterJoin',
+    'FullJoin', 'FullOuterJoin', 'CrossJoin', 'SemiJoin'
+]
 
 
 class OOOperator(object):
@@ -29,6 +36,58 @@ OPERATORS_MAP = {
 }
 
 
+class ArrayAny(Function):
+    __slots__ = ()
+    _function = 'ANY'
+
+
+class ArrayAll(Function):
+    __slots__ = ()
+    _function = 'ALL'
+
+
+class Unnest(Function):
+    __slots__ = ()
+    _function = 'UNNEST'
+
+
+class Star(SQLExpression):
+    """The ``*`` of ``COUNT(*)``."""
+    __slots__ = ()
+
+    def __str__(self):
+        return '*'
+
+    @property
+    def params(self):
+        return ()
+
+
+IN_STRATEGIES = ('any', 'unnest')
+
+
+def array_in(column, values, negate=False, strategy='any'):
+    """Return an IN condition with all the values as one array parameter.
+
+    The SQL is the same whatever the number of values:
+
+    - ``any``: ``column = ANY(%s)`` or ``column != ALL(%s)``
+    - ``unnest``: ``column IN (SELECT UNNEST(%s))``
+
+    ``values`` can also be a placeholder bound to the list later.
+    """
+    if hasattr(values, '__iter__'):
+        values = list(values)
+    if strategy == 'any':
+        if negate:
+            return operators.NotEqual(column, ArrayAll(values))
+        return operators.Equal(column, ArrayAny(values))
+    elif strategy == 'unnest':
+        operator = operators.NotIn if negate else operators.In
+        return operator(column, Select([Unnest(values)]))
+    raise ValueError('IN strategy {} is not supported'.format(strategy))
+
+
 class JoinType(object):
     type_ = None
     __slots__ = ('field', )
@@ -46,6 +105,10 @@ class JoinType(object):
         return self.field.replace(*args)
 
 
+# Joins keeping all the rows of the left side
+LEFT_JOINS = ('LEFT', 'LEFT OUTER')
+
+
 class InnerJoin(JoinType):
     type_ = 'INNER'
 
@@ -76,3 +139,11 @@ class FullOuterJoin(JoinType):
 
 class CrossJoin(JoinType):
     type_ = 'CROSS'
+
+
+class SemiJoin(JoinType):
+    """Filter through the to-many joins of the path with ``EXISTS``."""
+    type_ = 'INNER'
+
+    def __repr__(self):
+        return 'SemiJoin({})'.format(self.field)
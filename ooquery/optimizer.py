@@ -0,0 +1,274 @@
+# coding=utf-8
+"""
+Domain optimizer.
+
+Rewrites a domain to a smaller equivalent one before it is translated to SQL:
+nested operators are flattened, duplicated leaves removed, equalities on the
+same field joined with OR are merged into an ``in``, single value ``in``
+lists become equalities and conjuncts shared by all the branches of an OR are
+factored out.
+"""
+from __future__ import absolute_import
+from collections import deque, OrderedDict
+
+from sql import Expression as SQLExpression, Select
+
+from ooquery.compiler import freeze, is_subquery
+from ooquery.expression import Expression, Field, InvalidExpressionException
+from ooquery.operators import OPERATORS_MAP, JoinType
+
+LEAF = 'leaf'
+AND = '&'
+OR = '|'
+NOT = '!'
+
+
+def parse_domain(domain):
+    """Parse a domain to a tree of ``(operator, children)`` nodes.
+
+    Leaves are ``('leaf', expression)``. Nested operators of the same kind are
+    flattened while parsing.
+    """
+    stack = []
+    for element in reversed(domain):
+        if Expression.is_expression(element):
+            stack.append((LEAF, tuple(element)))
+        elif element in OPERATORS_MAP:
+            n_pops = OPERATORS_MAP[element].n_pops
+            if len(stack) < n_pops:
+                raise InvalidExpressionException
+            if element == NOT:
+                stack.append((NOT, deque([stack.pop()])))
+                continue
+            left = stack.pop()
+            right = stack.pop()
+            stack.append(_combine(element, left, right))
+        else:
+            raise InvalidExpressionException
+    if len(stack) == 1:
+        return stack[0]
+    return (AND, deque(reversed(stack)))
+
+
+def _combine(operator, left, right):
+    left_same = left[0] == operator
+    right_same = right[0] == operator
+    if left_same and (not right_same or len(left[1]) >= len(right[1])):
+        children = left[1]
+        if right_same:
+            children.extend(right[1])
+        else:
+            children.append(right)
+    elif right_same:
+        children = right[1]
+        if left_same:
+            children.extendleft(reversed(left[1]))
+        else:
+            children.appendleft(left)
+    else:
+        children = deque([left, right])
+    return (operator, children)
+
+
+def _mergeable(leaf):
+    field, operator, value = leaf
+    if operator == '=':
+        return not (
+            value is None or is_subquery(value) or isinstance(
+                value, (Field, list, tuple, SQLExpression, Select)
+            )
+        )
+    if operator == 'in':
+        return (
+            isinstance(value, (list, tuple))
+            and all(v is not None for v in value)
+        )
+    return False
+
+
+def _simplify_leaf(leaf):
+    field, operator, value = leaf
+    if (operator in ('in', 'not in') and isinstance(value, (list, tuple))
+            and len(value) == 1 and value[0] is not None):
+        operator = '=' if operator == 'in' else '!='
+        leaf = (field, operator, value[0])
+    return (LEAF, leaf), (LEAF, freeze(leaf))
+
+
+def _merge_equalities(children):
+    """Merge ORed ``=`` and ``in`` leaves on the same field into an ``in``.
+    """
+    groups = OrderedDict()
+    order = []
+    for node, key in children:
+        if node[0] == LEAF and _mergeable(node[1]):
+            field_key = freeze(node[1][0])
+            if field_key not in groups:
+                groups[field_key] = []
+                # Keep the position of the first leaf of the group
+                order.append((None, field_key))
+            groups[field_key].append(node[1])
+        else:
+            order.append((node, key))
+    merged = []
+    for node, key in order:
+        if node is not None:
+            merged.append((node, key))
+            continue
+        leaves = groups[key]
+        if len(leaves) == 1:
+            merged.append(_simplify_leaf(leaves[0]))
+            continue
+        values = []
+        seen = set()
+        for leaf in leaves:
+            leaf_values = leaf[2] if leaf[1] == 'in' else [leaf[2]]
+            for value in leaf_values:
+                value_key = freeze(value)
+                if value_key not in seen:
+                    seen.add(value_key)
+                    values.append(value)
+        merged.append(_simplify_leaf((leaves[0][0], 'in', values)))
+    return merged
+
+
+def _join_paths(nodes):
+    """Return the ``(path, join type)`` of the joins added by the leaves of
+    the nodes.
+
+    Every dotted field joins its tables to the whole query, so a leaf can
+    only be dropped if its joins are still added by the kept leaves.
+    """
+    paths = set()
+    stack = list(nodes)
+    while stack:
+        operator, children = stack.pop()
+        if operator != LEAF:
+            stack.extend(children)
+            continue
+        field, _, value = children
+        names = [field]
+        if isinstance(value, Field):
+            names.append(value.name)
+        for name in names:
+            join_type = 'INNER'
+            if isinstance(name, JoinType):
+                join_type = name.type_
+                name = name.field
+            if not hasattr(name, 'split') or '.' not in name:
+                continue
+            path = tuple(name.split('.')[:-1])
+            for idx in range(1, len(path) + 1):
+                paths.add((path[:idx], join_type))
+    return paths
+
+
+def _children(node, key):
+    return list(zip(node[1], key[1]))
+
+
+def _make(operator, children):
+    if len(children) == 1:
+        return children[0]
+    nodes = deque(node for node, _ in children)
+    key = (operator, tuple(key for _, key in children))
+    return (operator, nodes), key
+
+
+def _factor(children):
+    """Factor out the conjuncts shared by all the branches of an OR."""
+    branches = []
+    for node, key in children:
+        if node[0] == AND:
+            branches.append(_children(node, key))
+        else:
+            branches.append([(node, key)])
+    common_keys = set(key for _, key in branches[0])
+    for branch in branches[1:]:
+        common_keys &= set(key for _, key in branch)
+    if not common_keys:
+        return None
+    common = [item for item in branches[0] if item[1] in common_keys]
+    remainders = []
+    for branch in branches:
+        remainder = [item for item in branch if item[1] not in common_keys]
+        if remainder:
+            remainders.append(_make(AND, remainder))
+    if len(remainders) < len(branches):
+        # One branch is only the common part, the OR is always true
+        dropped = _join_paths(node for node, _ in remainders)
+        if not dropped <= _join_paths(node for node, _ in common):
+            # Dropping the remainders would drop their joins
+            return None
+        return _simplify_node(AND, common)
+    return _simplify_node(AND, common + [_simplify_node(OR, remainders)])
+
+
+def _simplify_node(operator, children):
+    flat = []
+    seen = set()
+    for node, key in children:
+        if node[0] == operator:
+            items = _children(node, key)
+        else:
+            items = [(node, key)]
+        for item in items:
+            if item[1] not in seen:
+                seen.add(item[1])
+                flat.append(item)
+    if operator == OR:
+        flat = _merge_equalities(flat)
+        if len(flat) > 1:
+            factored = _factor(flat)
+            if factored is not None:
+                return factored
+    return _make(operator, flat)
+
+
+def simplify(node):
+    """Simplify a tree returned by `parse_domain`.
+
+    Returns the simplified node and a hashable key identifying it.
+    """
+    operator, children = node
+    if operator == LEAF:
+        return _simplify_leaf(children)
+    simplified = [simplify(child) for child in children]
+    if operator == NOT:
+        child, key = simplified[0]
+        if child[0] == NOT:
+            return child[1][0], key[1][0]
+        return (NOT, deque([child])), (NOT, (key, ))
+    return _simplify_node(operator, simplified)
+
+
+def to_domain(node):
+    """Convert a tree back to a domain."""
+    domain = []
+    if node[0] == AND:
+        stack = list(reversed(node[1]))
+    else:
+        stack = [node]
+    while stack:
+        operator, children = stack.pop()
+        if operator == LEAF:
+            domain.append(children)
+            continue
+        if operator == NOT:
+            domain.append(NOT)
+        else:
+            domain.extend([operator] * (len(children) - 1))
+        stack.extend(reversed(children))
+    return domain
+
+
+def optimize_domain(domain):
+    """Return a smaller domain equivalent to ``domain``.
+
+    >>> optimize_domain(['|', ('state', '=', 'open'), ('state', '=', 'paid')])
+    [('state', 'in', ['open', 'paid'])]
+    """
+    if not domain:
+        return []
+    node, _ = simplify(parse_domain(domain))
+    return to_domain(node)
@@ -1,23 +1,196 @@
 # coding=utf-8
 from __future__ import absolute_import
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from copy import copy
 
-from sql import Table, Join
-from sql.operators import Equal
+from sql import (
+    Table, Join, As, Column, Literal, Null, NullOrder, Query,
+    Expression as SQLExpression
+)
+from sql.aggregate import Aggregate
+from sql.conditionals import Conditional
+from sql.operators import (
+    And as SQLAnd, Equal, Exists, In, Not, NotEqual, NotIn, Operator,
+    Or as SQLOr
+)
 
 from ooquery.operators import *
-from ooquery.expression import Expression, InvalidExpressionException, Field
+from ooquery.operators import IN_STRATEGIES, LEFT_JOINS, array_in
+from ooquery.compiler import ArraySlot, _slots, is_subquery
+from ooquery.expression import (
+    Expression, InvalidExpressionException, Field, OPERATORS
+)
+from ooquery.optimizer import AND, LEAF, optimize_domain, parse_domain, to_domain
+
+
+def _field_names(field):
+    if isinstance(field, As):
+        field = field.expression
+    if isinstance(field, Aggregate):
+        return [field.expression]
+    elif isinstance(field, Conditional):
+        return [v for v in field.values if not isinstance(v, Literal)]
+    elif isinstance(field, Operator):
+        return [o for o in field._operands if not isinstance(o, Literal)]
+    return [field]
+
+
+def get_join_paths(fields=None, domain=None, order_by=None, group_by=None):
+    """Return the join paths needed by a query as tuples of field names.
+
+    >>> sorted(get_join_paths(['a', 'b_id.c'], [('b_id.d_id.e', '=', 1)]))
+    [('b_id',), ('b_id', 'd_id')]
+    """
+    names = []
+    for field in fields or []:
+        names.extend(_field_names(field))
+    for expression in domain or []:
+        if Expression.is_expression(expression):
+            names.append(expression[0])
+            if isinstance(expression[2], Field):
+                names.append(expression[2].name)
+    for item in order_by or []:
+        if isinstance(item, NullOrder):
+            item = item.expression
+        names.append(item.rsplit('.', 1)[0])
+    names.extend(group_by or [])
+    paths = set()
+    for name in names:
+        if isinstance(name, JoinType):
+            name = name.field
+        if not hasattr(name, 'split') or '.' not in name:
+            continue
+        path = tuple(name.split('.')[:-1])
+        for idx in range(1, len(path) + 1):
+            paths.add(path[:idx])
+    return paths
+
+
+def conjunct_leaves(domain):
+    """Return the positions of the leaves ANDed with the whole domain.
+
+    >>> sorted(conjunct_leaves([('a', '=', 1), '|', ('b', '=', 1), ('c', '=', 1)]))
+    [0]
+    """
+    positions = set()
+    # Operands left and if they are ANDed with the whole domain
+    pending = []
+    for idx, element in enumerate(domain):
+        conjunct = True
+        if pending:
+            conjunct = pending[-1][1]
+            pending[-1][0] -= 1
+            if not pending[-1][0]:
+                pending.pop()
+        if Expression.is_expression(element):
+            if conjunct:
+                positions.add(idx)
+        elif element in OPERATORS_MAP:
+            pending.append(
+                [OPERATORS_MAP[element].n_pops, conjunct and element == '&']
+            )
+    return positions
+
+
+def referenced_tables(expressions):
+    """Return the ids of the tables of the columns used by expressions."""
+    tables = set()
+    stack = list(expressions)
+    while stack:
+        value = stack.pop()
+        if isinstance(value, (list, tuple)):
+            stack.extend(value)
+        elif isinstance(value, Column):
+            tables.add(id(value.table))
+        elif isinstance(value, (SQLExpression, Query, Join)):
+            stack.extend(getattr(value, s, None) for s in _slots(type(value)))
+            if isinstance(value, list):
+                stack.extend(value)
+    return tables
+
+
+NULL_REJECTING_OPERATORS = tuple(set(OPERATORS.values()))
+
+
+def null_rejected_tables(condition, negate=False):
+    """Return the ids of the tables whose columns can not be null on the
+    rows matching the condition.
+
+    With ``negate`` the tables are the ones of ``NOT condition``.
+    """
+    if isinstance(condition, (SQLAnd, SQLOr)):
+        # NOT (a AND b) is NOT a OR NOT b, NOT (a OR b) is NOT a AND NOT b
+        union = isinstance(condition, SQLAnd) != negate
+        tables = None
+        for operand in condition:
+            operand_tables = null_rejected_tables(operand, negate)
+            if tables is None:
+                tables = operand_tables
+            elif union:
+                tables |= operand_tables
+            else:
+                tables &= operand_tables
+        return tables or set()
+    elif isinstance(condition, Not):
+        operand = condition.operand
+        # The parser wraps the negated expression in a list
+        if isinstance(operand, list):
+            if len(operand) != 1:
+                return set()
+            operand = operand[0]
+        return null_rejected_tables(operand, not negate)
+    elif isinstance(condition, NULL_REJECTING_OPERATORS):
+        operands = (condition.left, condition.right)
+        if (isinstance(condition, Equal)
+                and any(o is None or o is Null for o in operands)):
+            # IS NULL rejects nothing, IS NOT NULL rejects its tables
+            if isinstance(condition, NotEqual) == negate:
+                return set()
+        return set(
+            id(o.table) for o in operands if isinstance(o, Column)
+        )
+    return set()
 
 
 class Parser(object):
 
-    def __init__(self, table, foreign_key=None):
+    def __init__(self, table, foreign_key=None, in_threshold=None,
+                 in_strategy='any', optimize=False, eliminate_joins=False,
+                 promote_joins=False, semi_joins=False, stats=None):
+        if in_strategy not in IN_STRATEGIES:
+            raise ValueError(
+                'IN strategy {} is not supported'.format(in_strategy)
+            )
         self.operators = OPERATORS_MAP
         self.table = table
         self.joins_map = OrderedDict()
         self.joins = []
+        self.foreign_keys = {}
         self.join_path = []
         self.foreign_key = foreign_key
+        self.in_threshold = in_threshold
+        self.in_strategy = in_strategy
+        self.optimize = optimize
+        self.eliminate_joins = eliminate_joins
+        # INNER joins of the rewritten ``path.id`` conjuncts
+        self.eliminable_joins = set()
+        self.promote_joins = promote_joins
+        self.promoted_joins = []
+        self.semi_joins = semi_joins
+        self.stats = stats
+
+    def copy(self):
+        """Return a parser with a copy of the joins, sharing the join
+        objects already created.
+        """
+        parser = copy(self)
+        parser.joins_map = OrderedDict(self.joins_map)
+        parser.joins = list(self.joins)
+        parser.foreign_keys = dict(self.foreign_keys)
+        parser.promoted_joins = list(self.promoted_joins)
+        parser.eliminable_joins = set(self.eliminable_joins)
+        parser.join_path = list(self.join_path)
+        return parser
 
     def get_join(self, dottet_path):
         return self.joins_map.get(dottet_path, None)
@@ -54,24 +227,33 @@ class Parser(object):
         else:
             return self.get_field_from_table(table, field)
 
+    def resolve_foreign_key(self, table_name, field):
+        if self.stats is None:
+            return self.foreign_key(table_name, field)
+        with self.stats.timing('foreign_key'):
+            return self.foreign_key(table_name, field)
+
     def parse_join(self, fields_join, join_type):
         table = self.table
         self.join_path = []
+        stats = self.stats
         for field_join in fields_join:
             self.join_path.append(field_join)
-            fk = self.foreign_key(table._name, field_join)
-            table_join = Table(fk['foreign_table_name'])
-            join = Join(self.join_on, table_join, type_=join_type)
-            column = getattr(table, fk['column_name'])
-            fk_col = getattr(join.right, fk['foreign_column_name'])
-            join.condition = Equal(column, fk_col)
             dotted_path = '.'.join(self.join_path)
             join = self.get_join(dotted_path)
+            if stats is not None:
+                stats.incr('parse_join.iterations')
+                stats.incr('joins.reused' if join else 'joins.created')
             if not join:
+                fk = self.resolve_foreign_key(table._name, field_join)
+                table_join = Table(fk['foreign_table_name'])
+                column = getattr(table, fk['column_name'])
+                fk_col = getattr(table_join, fk['foreign_column_name'])
                 join = self.join_on.join(table_join, type_=join_type)
                 join.condition = Equal(column, fk_col)
                 self.joins_map[dotted_path] = join
                 self.joins.append(join)
+                self.foreign_keys[dotted_path] = fk
                 table = table_join
             else:
                 if join not in self.joins:
@@ -79,21 +261,322 @@ class Parser(object):
 
                 table = join.right
 
+    def is_to_many(self, dotted_path):
+        """Check if the join of the path can match more than one row."""
+        fk = self.foreign_keys.get(dotted_path)
+        return fk is not None and fk['foreign_column_name'] != 'id'
+
+    def prune_joins(self, dotted_paths):
+        """Rebuild the join chain with only the joins of ``dotted_paths``.
+
+        The parents of the kept joins are also kept. The joins are not
+        modified, so the columns already resolved on their tables are still
+        valid.
+        """
+        keep = set()
+        for dotted_path in dotted_paths:
+            path = dotted_path.split('.')
+            for idx in range(1, len(path) + 1):
+                keep.add('.'.join(path[:idx]))
+        self._rebuild_joins([
+            (dotted_path, join.type_)
+            for dotted_path, join in self.joins_map.items()
+            if dotted_path in keep
+        ])
+
+    def _rebuild_joins(self, types):
+        """Rebuild the join chain with the joins of the ``(dotted_path,
+        type_)`` pairs, in this order.
+        """
+        join_on = self.table
+        joins_map = OrderedDict()
+        joins = []
+        for dotted_path, type_ in types:
+            join = self.joins_map[dotted_path]
+            join_on = join_on.join(
+                join.right, type_=type_, condition=join.condition
+            )
+            joins_map[dotted_path] = join_on
+            joins.append(join_on)
+        self.joins_map = joins_map
+        self.joins = joins
+
+    def prune_unused_joins(self, expressions):
+        """Drop the LEFT to-one joins whose tables are not used by
+        expressions, as they neither filter nor duplicate rows, and the
+        INNER joins only used by ``path.id`` conjuncts rewritten to the
+        foreign key column.
+        """
+        tables = referenced_tables(expressions)
+        keep = [
+            dotted_path for dotted_path, join in self.joins_map.items()
+            if (join.type_ not in LEFT_JOINS
+                and dotted_path not in self.eliminable_joins)
+            or self.is_to_many(dotted_path) or id(join.right) in tables
+        ]
+        if len(keep) < len(self.joins_map):
+            if self.stats is not None:
+                self.stats.incr(
+                    'joins.eliminated', len(self.joins_map) - len(keep)
+                )
+            self.prune_joins(keep)
+
+    def promote_outer_joins(self, where):
+        """Turn the outer joins into inner joins when the null rows they
+        add are rejected by ``where``.
+
+        A LEFT join becomes an INNER join when ``where`` rejects the nulls of
+        its table, a RIGHT join when it rejects the nulls of a table before
+        it and a FULL join is reduced to LEFT, RIGHT or INNER. Inner join
+        conditions reject the nulls of the tables they compare, so the
+        promotion goes up the join chain.
+
+        :return: List of the ``(dotted_path, type_, promoted_type)``
+            promotions, also kept in ``promoted_joins``
+        """
+        rejected = null_rejected_tables(where)
+        paths = list(self.joins_map)
+        types = {}
+        # The tables on the left of each join
+        left_sides = []
+        left_side = set([id(self.table)])
+        for path in paths:
+            left_sides.append(set(left_side))
+            left_side.add(id(self.joins_map[path].right))
+        # The condition of an inner join only rejects the nulls added by the
+        # joins before it, so the chain is walked backwards
+        for path, left_side in reversed(list(zip(paths, left_sides))):
+            join = self.joins_map[path]
+            type_ = join.type_
+            right_rejected = id(join.right) in rejected
+            left_rejected = bool(left_side & rejected)
+            if type_ in ('LEFT', 'LEFT OUTER') and right_rejected:
+                type_ = 'INNER'
+            elif type_ in ('RIGHT', 'RIGHT OUTER') and left_rejected:
+                type_ = 'INNER'
+            elif type_ in ('FULL', 'FULL OUTER'):
+                if right_rejected and left_rejected:
+                    type_ = 'INNER'
+                elif right_rejected:
+                    type_ = 'RIGHT'
+                elif left_rejected:
+                    type_ = 'LEFT'
+            types[path] = type_
+            if type_ == 'INNER' and join.condition is not None:
+                rejected |= null_rejected_tables(join.condition)
+        promoted = [
+            (path, join.type_, types[path])
+            for path, join in self.joins_map.items()
+            if types[path] != join.type_
+        ]
+        if promoted:
+            if self.stats is not None:
+                self.stats.incr('joins.promoted', len(promoted))
+            self._rebuild_joins([(path, types[path]) for path in paths])
+        self.promoted_joins = promoted
+        return promoted
+
+    def get_foreign_key_column(self, field, value, conjunct=False):
+        """Return the local foreign key column of a ``path.id`` field.
+
+        ``partner_id.id`` is the same as ``partner_id`` when the join does
+        not change the rows: it is a LEFT join, or an INNER join and the
+        condition is ANDed with the whole domain and rejects nulls. Returns
+        None otherwise.
+        """
+        join_type = 'INNER'
+        if isinstance(field, JoinType):
+            join_type = field.type_
+            field = field.field
+        path = field.split('.')
+        if len(path) < 2 or path[-1] != 'id':
+            return None
+        join = self.get_join('.'.join(path[:-1]))
+        if join is not None:
+            join_type = join.type_
+        if not (join_type in LEFT_JOINS or (
+                join_type == 'INNER' and conjunct and value is not None)):
+            return None
+        table = self.table
+        if len(path) > 2:
+            self.parse_join(path[:-2], join_type)
+            table = self.joins_map['.'.join(path[:-2])].right
+        fk = self.resolve_foreign_key(table._name, path[-2])
+        if fk['foreign_column_name'] != 'id':
+            return None
+        # Register the join like the other leaves of the path would, so it
+        # keeps its type, `prune_unused_joins` drops it if it is not used
+        self.parse_join(path[:-1], join_type)
+        if self.joins_map['.'.join(path[:-1])].type_ == 'INNER':
+            self.eliminable_joins.add('.'.join(path[:-1]))
+        return self.get_field_from_table(table, fk['column_name'])
+
     def create_expressions(self, expression, column_left, column_right=None):
         expression = Expression(expression)
         expression.left = column_left
         if column_right:
             expression.right = column_right
+        elif is_subquery(expression.right):
+            expression.right = expression.right.as_subquery()
+        elif self.is_large_in(expression):
+            return [array_in(
+                expression.left, expression.right,
+                negate=expression.operator is NotIn,
+                strategy=self.in_strategy
+            )]
 
         return [expression.expression]
 
-    def get_expressions(self, expression):
+    def is_large_in(self, expression):
+        """Check if the expression must be compiled as an array parameter.
+        """
+        if expression.operator not in (In, NotIn):
+            return False
+        if isinstance(expression.right, ArraySlot):
+            # List of a compiled template
+            return True
+        return (
+            self.in_threshold is not None
+            and isinstance(expression.right, (list, tuple))
+            and len(expression.right) >= self.in_threshold
+        )
+
+    def get_semi_join_length(self, expression):
+        """Return the length of the path of the leaf up to its first to-many
+        join when it must be compiled as a semi-join, None otherwise.
+        """
+        field = expression[0]
+        if not (self.semi_joins or isinstance(field, SemiJoin)):
+            return None
+        if isinstance(expression[2], Field) or self.foreign_key is None:
+            return None
+        if isinstance(field, JoinType):
+            field = field.field
+        table_name = self.table._name
+        for idx, name in enumerate(field.split('.')[:-1]):
+            fk = self.resolve_foreign_key(table_name, name)
+            if fk['foreign_column_name'] != 'id':
+                return idx + 1
+            table_name = fk['foreign_table_name']
+        return None
+
+    def get_semi_join(self, expressions, length):
+        """Return the ``EXISTS`` condition of leaves sharing the path up to
+        their first to-many join, of ``length`` fields.
+
+        The to-one joins before it are joined as usual and the rest of the
+        paths are parsed on the table of the to-many join, correlated with
+        the foreign key.
+        """
+        field = expressions[0][0]
+        join_type = 'INNER'
+        if isinstance(field, JoinType):
+            join_type = field.type_
+            field = field.field
+        path = field.split('.')
+        table = self.table
+        if length > 1:
+            self.parse_join(path[:length - 1], join_type)
+            table = self.joins_map['.'.join(path[:length - 1])].right
+        fk = self.resolve_foreign_key(table._name, path[length - 1])
+        child = Table(fk['foreign_table_name'])
+        parser = Parser(
+            child, self.foreign_key, in_threshold=self.in_threshold,
+            in_strategy=self.in_strategy, semi_joins=True, stats=self.stats
+        )
+        domain = []
+        for expression in expressions:
+            field = expression[0]
+            if isinstance(field, JoinType):
+                field = field.field
+            domain.append((
+                '.'.join(field.split('.')[length:]), expression[1],
+                expression[2]
+            ))
+        where = parser.parse(domain)
+        condition = Equal(
+            self.get_field_from_table(table, fk['column_name']),
+            self.get_field_from_table(child, fk['foreign_column_name'])
+        )
+        if self.stats is not None:
+            self.stats.incr('semi_joins')
+        return Exists(parser.join_on.select(
+            Literal(1), where=And([condition] + list(where))
+        ))
+
+    def get_semi_joins(self, domain):
+        """Return the domain with the leaves of each semi-join grouped and
+        the semi-joins by the position of their leaf in it.
+
+        The leaves ANDed together (at the top level or in nested ``&``)
+        sharing the path up to the first to-many join are checked on the
+        same row, as with a join: only the first one is kept in the domain.
+        """
+        root = parse_domain(domain)
+        groups = {}
+        stack = [root]
+        while stack:
+            operator, children = stack.pop()
+            if operator == LEAF:
+                length = self.get_semi_join_length(children)
+                if length is not None:
+                    groups[id(children)] = ([children], length)
+                continue
+            if operator != AND:
+                stack.extend(children)
+                continue
+            kept = []
+            keyed = {}
+            pending = deque(children)
+            while pending:
+                child = pending.popleft()
+                if child[0] == AND:
+                    # Nested AND, flattened
+                    pending.extendleft(reversed(child[1]))
+                    continue
+                length = None
+                if child[0] == LEAF:
+                    length = self.get_semi_join_length(child[1])
+                if length is None:
+                    kept.append(child)
+                    if child[0] != LEAF:
+                        stack.append(child)
+                    continue
+                leaf = child[1]
+                field = leaf[0]
+                join_type = 'INNER'
+                if isinstance(field, JoinType):
+                    join_type = field.type_
+                    field = field.field
+                key = (tuple(field.split('.')[:length]), join_type)
+                if key in keyed:
+                    keyed[key][0].append(leaf)
+                    continue
+                keyed[key] = groups[id(leaf)] = ([leaf], length)
+                kept.append(child)
+            children.clear()
+            children.extend(kept)
+        domain = to_domain(root)
+        semi_joins = {}
+        for idx, element in enumerate(domain):
+            if Expression.is_expression(element) and id(element) in groups:
+                semi_joins[idx] = groups[id(element)]
+        return domain, semi_joins
+
+    def get_expressions(self, expression, conjunct=False):
         fields = [expression[0]]
         columns = []
         if isinstance(expression[2], Field):
             fields.append(expression[2].name)
 
         for idx, field in enumerate(fields):
+            if idx == 0 and self.eliminate_joins:
+                column = self.get_foreign_key_column(
+                    field, expression[2], conjunct
+                )
+                if column is not None:
+                    columns.append(column)
+                    continue
             columns.append(self.get_table_field(self.table, field))
             if isinstance(field, JoinType):
                 join_type = expression[0].type_
@@ -110,15 +593,40 @@ class Parser(object):
         return self.create_expressions(expression, *columns)
 
     def parse(self, query):
+        if self.stats is None:
+            return self._parse(query)
+        with self.stats.timing('parse'):
+            return self._parse(query)
+
+    def _parse(self, query):
         result = []
-        query = query[:]
+        if self.optimize:
+            query = optimize_domain(query)
+        else:
+            query = query[:]
+        semi_joins = {}
+        if self.semi_joins or any(
+                isinstance(e, (list, tuple)) and e
+                and isinstance(e[0], SemiJoin) for e in query):
+            query, semi_joins = self.get_semi_joins(query)
+        conjuncts = ()
+        if self.eliminate_joins:
+            conjuncts = conjunct_leaves(query)
+        stats = self.stats
         while query:
             expression = query.pop()
             if (not Expression.is_expression(expression)
                     and expression not in self.operators):
                 raise InvalidExpressionException
             if Expression.is_expression(expression):
-                result += self.get_expressions(expression)
+                if stats is not None:
+                    stats.incr('leaves')
+                if len(query) in semi_joins:
+                    result.append(self.get_semi_join(*semi_joins[len(query)]))
+                else:
+                    result += self.get_expressions(
+                        expression, len(query) in conjuncts
+                    )
             else:
                 op = self.operators[expression]
                 q = []
@@ -0,0 +1,96 @@
+# coding=utf-8
+"""Write statements not supported by python-sql."""
+from __future__ import absolute_import
+
+from sql import AliasManager, Delete, From, Insert
+
+WRITE_STRATEGIES = ('join', 'subquery')
+
+
+class DeleteUsing(Delete):
+    """``DELETE`` with the other tables of the condition in ``USING``.
+
+    With ``using`` the deleted table is aliased like in the other queries.
+    """
+    __slots__ = ('_using', )
+
+    def __init__(self, table, using=None, **kwargs):
+        super(DeleteUsing, self).__init__(table, **kwargs)
+        self.using = using
+
+    @property
+    def using(self):
+        return self._using
+
+    @using.setter
+    def using(self, value):
+        self._using = From(value) if value else None
+
+    def __str__(self):
+        if not self.using:
+            return super(DeleteUsing, self).__str__()
+        with AliasManager():
+            only = ' ONLY' if self.only else ''
+            table = '{} AS "{}"'.format(self.table, self.table.alias)
+            using = ' USING ' + str(self.using)
+            where = ''
+            if self.where:
+                where = ' WHERE ' + str(self.where)
+            returning = ''
+            if self.returning:
+                returning = ' RETURNING ' + ', '.join(map(str, self.returning))
+            return (
+                self._with_str() + 'DELETE FROM{} {}'.format(only, table)
+                + using + where + returning
+            )
+
+    @property
+    def params(self):
+        if not self.using:
+            return super(DeleteUsing, self).params
+        params = list(self._with_params())
+        params.extend(self.using.params)
+        if self.where:
+            params.extend(self.where.params)
+        for expression in self.returning or []:
+            params.extend(expression.params)
+        return tuple(params)
+
+
+class Upsert(Insert):
+    """``INSERT`` with an ``ON CONFLICT`` clause.
+
+    The rows conflicting on the ``conflict`` columns update the
+    ``update_columns`` with the inserted values, or are skipped without
+    ``update_columns``.
+    """
+    __slots__ = ('conflict', 'update_columns')
+
+    def __init__(self, table, conflict, update_columns=None, **kwargs):
+        super(Upsert, self).__init__(table, **kwargs)
+        self.conflict = conflict
+        self.update_columns = update_columns
+
+    def __str__(self):
+        assert all(col.table == self.table for col in self.columns)
+        columns = ', '.join(map(str, self.columns))
+        conflict = ', '.join(map(str, self.conflict))
+        if self.update_columns:
+            action = 'DO UPDATE SET ' + ', '.join(
+                '{0} = EXCLUDED.{0}'.format(column)
+                for column in map(str, self.update_columns)
+            )
+        else:
+            action = 'DO NOTHING'
+        with AliasManager():
+            values = str(self.values)
+            returning = ''
+            if self.returning:
+                returning = ' RETURNING ' + ', '.join(
+                    map(self._format, self.returning))
+            return (
+                self._with_str()
+                + 'INSERT INTO {} AS "{}" ({}) {}'.format(
+                    self.table, self.table.alias, columns, values)
+                + ' ON CONFLICT ({}) {}'.format(conflict, action) + returning
+            )
@@ -0,0 +1,76 @@
+# coding=utf-8
+from __future__ import absolute_import
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock
+from timeit import default_timer
+
+
+class QueryStats(object):
+    """Counters and timings of the compile hot paths.
+
+    Pass an instance as ``stats`` to a `Parser` or an `OOQuery` to record:
+
+    - ``foreign_key``: calls to the foreign key resolver
+    - ``parse_join.iterations``: path segments walked by ``parse_join``
+    - ``joins.created`` and ``joins.reused``: joins created or found in
+      ``joins_map``
+    - ``leaves``: domain leaves parsed
+    - ``parse``: calls to ``Parser.parse``
+    - ``render``: SQL renderings done by ``OOQuery.compile``
+
+    Timed events are also stored in ``timings`` (seconds). Callbacks added
+    with `subscribe` are called with ``(event, value)`` on every record, the
+    value being the increment for counters and the elapsed time for timings.
+
+    An instance can be shared between threads, as the parallel executor and
+    ``compile_many`` do: the updates are done holding a lock. Callbacks are
+    called outside the lock and must be thread safe themselves.
+    """
+
+    def __init__(self, timer=default_timer):
+        self.timer = timer
+        self.counters = defaultdict(int)
+        self.timings = defaultdict(float)
+        self.callbacks = []
+        self._lock = Lock()
+
+    def subscribe(self, callback):
+        with self._lock:
+            self.callbacks = self.callbacks + [callback]
+
+    def incr(self, event, value=1):
+        with self._lock:
+            self.counters[event] += value
+        for callback in self.callbacks:
+            callback(event, value)
+
+    def add_time(self, event, elapsed):
+        with self._lock:
+            self.counters[event] += 1
+            self.timings[event] += elapsed
+        for callback in self.callbacks:
+            callback(event, elapsed)
+
+    @contextmanager
+    def timing(self, event):
+        start = self.timer()
+        try:
+            yield
+        finally:
+            self.add_time(event, self.timer() - start)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timings.clear()
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'timings': dict(self.timings)
+            }
+
+    def __repr__(self):
+        return 'QueryStats({!r})'.format(self.as_dict())
@@ -3,7 +3,7 @@ from setuptools import setup, find_packages
 setup(
     name='ooquery',
     version='0.22.0',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     url='https://github.com/gisce/ooquery',
     license='MIT',
     author='GISCE-TI, S.L.',
@@ -0,0 +1,126 @@
+# coding=utf-8
+import sys
+
+from ooquery import OOQuery
+
+from expects import *
+from mamba import *
+
+
+FKS = {
+    ('table', 'table_2_id'): 'table2',
+    ('table', 'table_4_id'): 'table4',
+    ('table2', 'table_3_id'): 'table3',
+}
+
+
+def get_fk(table, field):
+    return {
+        'constraint_name': 'fk_contraint_name',
+        'table_name': table,
+        'column_name': field,
+        'foreign_table_name': FKS[(table, field)],
+        'foreign_column_name': 'id'
+    }
+
+
+if sys.version_info >= (3, 7):
+    import asyncio
+    import os
+    import shutil
+    import sqlite3
+    import tempfile
+    from ooquery.aio import AsyncOOQuery, AsyncParallelExecutor
+    from ooquery.executor import ConnectionPool
+    from sql import Flavor
+
+    with description('An async OOQuery'):
+        with before.each:
+            self.loop = asyncio.new_event_loop()
+            self.calls = []
+            self.state = {'in_flight': 0, 'max_in_flight': 0}
+
+            def async_fk(table, field):
+                loop = asyncio.get_event_loop()
+                future = loop.create_future()
+                self.calls.append((table, field))
+                self.state['in_flight'] += 1
+                self.state['max_in_flight'] = max(
+                    self.state['max_in_flight'], self.state['in_flight']
+                )
+
+                def done():
+                    self.state['in_flight'] -= 1
+                    future.set_result(get_fk(table, field))
+
+                loop.call_soon(done)
+                return future
+
+            self.async_fk = async_fk
+
+        with after.each:
+            self.loop.close()
+
+        with it('must build the same query as the sync one'):
+            domain = [
+                ('table_4_id.failed', '=', True),
+                ('table_2_id.table_3_id.code', '=', 'XXX'),
+            ]
+            fields = ['field1', 'table_2_id.name']
+            q = AsyncOOQuery('table', self.async_fk)
+            sql = self.loop.run_until_complete(
+                q.select(fields, order_by=('table_4_id.code.asc', )).where(
+                    domain
+                )
+            )
+            expected = OOQuery('table', get_fk).select(
+                fields, order_by=('table_4_id.code.asc', )
+            ).where(domain)
+            expect(tuple(sql)).to(equal(tuple(expected)))
+
+        with it('must resolve each foreign key once and concurrently'):
+            q = AsyncOOQuery('table', self.async_fk)
+            self.loop.run_until_complete(q.compile(
+                ['table_2_id.name', 'table_4_id.name'],
+                [('table_2_id.table_3_id.code', '=', 'XXX')]
+            ))
+            expect(sorted(self.calls)).to(equal(sorted(FKS)))
+            expect(self.state['max_in_flight']).to(equal(2))
+            self.loop.run_until_complete(q.compile(
+                ['table_2_id.name'], [('table_2_id.table_3_id.code', '=', 'Y')]
+            ))
+            expect(self.calls).to(have_len(3))
+
+    with description('An async parallel executor'):
+        with before.each:
+            Flavor.set(Flavor(paramstyle='qmark'))
+            self.dir = tempfile.mkdtemp()
+            path = os.path.join(self.dir, 'test.db')
+            conn = sqlite3.connect(path)
+            conn.execute('CREATE TABLE invoice (id INTEGER PRIMARY KEY)')
+            conn.executemany(
+                'INSERT INTO invoice VALUES (?)', [(i, ) for i in range(5)]
+            )
+            conn.commit()
+            conn.close()
+            self.pool = ConnectionPool(
+                lambda: sqlite3.connect(path, check_same_thread=False),
+                maxsize=2
+            )
+            self.executor = AsyncParallelExecutor(self.pool)
+            self.loop = asyncio.new_event_loop()
+
+        with after.each:
+            self.loop.close()
+            self.pool.close()
+            Flavor.set(Flavor())
+            shutil.rmtree(self.dir)
+
+        with it('must return the results in order'):
+            q = OOQuery('invoice')
+            queries = [q.compile(['id'], [('id', '>=', i)]) for i in range(5)]
+            results = self.loop.run_until_complete(
+                self.executor.execute(queries)
+            )
+            expect([len(r.rows) for r in results]).to(equal([5, 4, 3, 2, 1]))
+            expect(self.pool.created).to(be_below_or_equal(2))
@@ -0,0 +1,244 @@
+# coding=utf-8
+import gc
+import weakref
+
+from ooquery import OOQuery
+from ooquery.cache import (
+    ByteLRUCache, ForeignKeyCache, LRUCache, ResultCache, shared_fk_cache
+)
+from ooquery.parser import Parser
+from sql import Table
+
+from expects import *
+from mamba import *
+
+
+FKS = {
+    'table': {
+        'table_2_id': {
+            'constraint_name': 'fk_contraint_name',
+            'table_name': 'table',
+            'column_name': 'table_2_id',
+            'foreign_table_name': 'table2',
+            'foreign_column_name': 'id'
+        },
+    },
+    'table2': {
+        'table_3_id': {
+            'constraint_name': 'fk_contraint_name',
+            'table_name': 'table2',
+            'column_name': 'table_3_id',
+            'foreign_table_name': 'table3',
+            'foreign_column_name': 'id'
+        }
+    }
+}
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+with description('A LRU cache'):
+    with it('must evict the least recently used entry'):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        expect(cache.get('a')).to(equal(1))
+        cache.set('c', 3)
+        expect(cache.keys()).to(equal(['a', 'c']))
+
+    with it('must expire entries after the ttl'):
+        timer = FakeTimer()
+        cache = LRUCache(ttl=10, timer=timer)
+        cache.set('a', 1)
+        timer.now = 9
+        expect(cache.get('a')).to(equal(1))
+        timer.now = 10
+        expect(cache.get('a')).to(be_none)
+        expect(cache).to(have_len(0))
+
+    with it('must count hits and misses'):
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('b')
+        expect(cache.stats).to(have_keys(hits=1, misses=1, size=1))
+
+
+with description('A foreign key cache'):
+    with before.each:
+        self.calls = []
+
+        def dummy_fk(table, field):
+            self.calls.append((table, field))
+            return FKS[table][field]
+
+        self.dummy_fk = dummy_fk
+
+    with it('must call the resolver only once for each field'):
+        cache = ForeignKeyCache(self.dummy_fk)
+        expect(cache('table', 'table_2_id')).to(
+            equal(FKS['table']['table_2_id'])
+        )
+        cache('table', 'table_2_id')
+        expect(self.calls).to(equal([('table', 'table_2_id')]))
+        expect(cache.hits).to(equal(1))
+        expect(cache.misses).to(equal(1))
+
+    with it('must allow to invalidate a table'):
+        cache = ForeignKeyCache(self.dummy_fk)
+        cache('table', 'table_2_id')
+        cache('table2', 'table_3_id')
+        cache.invalidate('table')
+        expect(cache.keys()).to(equal([('table2', 'table_3_id')]))
+        cache.invalidate()
+        expect(cache).to(have_len(0))
+
+    with it('must preload all the foreign keys of the tables'):
+        loaded = []
+
+        def table_loader(table):
+            loaded.append(table)
+            return FKS[table]
+
+        cache = ForeignKeyCache(table_loader=table_loader)
+        cache.preload(['table', 'table2'])
+        expect(cache).to(have_len(2))
+        cache('table2', 'table_3_id')
+        expect(loaded).to(equal(['table', 'table2']))
+
+    with it('must load the whole table on a miss with a table loader'):
+        loaded = []
+
+        def table_loader(table):
+            loaded.append(table)
+            return FKS[table]
+
+        cache = ForeignKeyCache(table_loader=table_loader)
+        cache('table', 'table_2_id')
+        cache('table', 'table_2_id')
+        expect(loaded).to(equal(['table']))
+
+    with it('must be shared between queries with different resolvers'):
+        cache = ForeignKeyCache()
+        for _ in range(3):
+            q = OOQuery('table', self.dummy_fk, fk_cache=cache)
+            q.select(['id']).where([
+                ('table_2_id.table_3_id.code', '=', 'XXX')
+            ])
+        expect(self.calls).to(have_len(2))
+        expect(cache.hits).to(equal(4))
+
+    with it('must be used transparently by OOQuery'):
+        q = OOQuery('table', self.dummy_fk)
+        for _ in range(3):
+            q.select(['id', 'table_2_id.name']).where([
+                ('table_2_id.table_3_id.code', '=', 'XXX')
+            ])
+        expect(self.calls).to(equal([
+            ('table', 'table_2_id'), ('table2', 'table_3_id')
+        ]))
+
+    with it('must share the cache of a resolver when requested'):
+        for _ in range(3):
+            q = OOQuery(
+                'table', self.dummy_fk,
+                fk_cache=shared_fk_cache(self.dummy_fk)
+            )
+            q.select(['id', 'table_2_id.name']).where([
+                ('table_2_id.table_3_id.code', '=', 'XXX')
+            ])
+        expect(self.calls).to(have_len(2))
+        expect(q.fk_cache.ttl).to(equal(3600))
+        expect(shared_fk_cache(lambda t, f: None)).not_to(be(q.fk_cache))
+
+        Parser(Table('table'), self.dummy_fk).parse([
+            ('table_2_id.name', '=', 'XXX')
+        ])
+        expect(self.calls).to(have_len(3))
+
+    with it('must not keep the resolvers of the shared caches alive'):
+        class Resolver(object):
+            def resolve(self, table, field):
+                return FKS[table][field]
+
+        resolver = Resolver()
+        cache = shared_fk_cache(resolver.resolve)
+        expect(shared_fk_cache(resolver.resolve)).to(be(cache))
+        reference = weakref.ref(resolver)
+        del resolver
+        gc.collect()
+        expect(reference()).to(be_none)
+
+
+with description('A byte LRU cache'):
+    with it('must evict the least recently used entries over the budget'):
+        cache = ByteLRUCache(max_bytes=10, sizeof=len)
+        cache.set('a', 'xxxx')
+        cache.set('b', 'xxxx')
+        cache.get('a')
+        cache.set('c', 'xxxx')
+        expect(cache.keys()).to(equal(['a', 'c']))
+        expect(cache.bytes).to(equal(8))
+        cache.set('a', 'x')
+        expect(cache.bytes).to(equal(5))
+
+    with it('must not store values bigger than the budget'):
+        cache = ByteLRUCache(max_bytes=10, sizeof=len)
+        cache.set('a', 'x' * 11)
+        expect(cache).to(have_len(0))
+        expect(cache.bytes).to(equal(0))
+
+    with it('must forget the size of the expired entries'):
+        timer = FakeTimer()
+        cache = ByteLRUCache(max_bytes=10, sizeof=len, ttl=1, timer=timer)
+        cache.set('a', 'xxxx')
+        timer.now = 1
+        expect(cache.get('a')).to(be_none)
+        expect(cache.stats).to(have_keys(bytes=0, max_bytes=10))
+
+
+with description('A result cache'):
+    with before.each:
+        self.cache = ResultCache()
+        self.calls = []
+
+        def execute(query):
+            self.calls.append(tuple(query))
+            return [(len(self.calls), )]
+
+        self.execute = execute
+
+    with it('must execute each query once'):
+        q = OOQuery('table', lambda table, field: FKS[table][field])
+        query = q.compile(['table_2_id.name'], [('id', '=', 1)])
+        expect(query.tables).to(equal(('table', 'table2')))
+        self.cache.fetch(query, self.execute)
+        rows = self.cache.fetch(query, self.execute)
+        expect(rows).to(equal([(1, )]))
+        expect(self.cache.get(query)).to(equal([(1, )]))
+        other = q.compile(['table_2_id.name'], [('id', '=', 2)])
+        expect(self.cache.fetch(other, self.execute)).to(equal([(2, )]))
+
+    with it('must invalidate the results of the changed tables'):
+        q = OOQuery('table', lambda table, field: FKS[table][field])
+        query = q.select(['table_2_id.name']).where([('id', '=', 1)])
+        other = q.select(['id']).where([('id', '=', 1)])
+        self.cache.fetch(query, self.execute)
+        self.cache.fetch(other, self.execute)
+        self.cache.invalidate('table2')
+        expect(self.cache.fetch(query, self.execute)).to(equal([(3, )]))
+        expect(self.cache.fetch(other, self.execute)).to(equal([(2, )]))
+
+    with it('must require the tables of plain queries'):
+        query = ('SELECT 1', ())
+        expect(lambda: self.cache.get(query)).to(raise_error(ValueError))
+        self.cache.set(query, [(1, )], tables=['table'])
+        expect(self.cache.get(query, tables=['table'])).to(equal([(1, )]))
+        self.cache.invalidate('table')
+        expect(self.cache.get(query, tables=['table'])).to(be_none)
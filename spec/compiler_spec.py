@@ -0,0 +1,293 @@
+# coding=utf-8
+from ooquery import OOQuery
+from ooquery.cache import CompileCache
+from ooquery.compiler import domain_skeleton, domain_values, freeze
+from ooquery.expression import Field
+from ooquery.operators import LeftJoin
+from ooquery.stats import QueryStats
+from sql.aggregate import Max
+
+from expects import *
+from mamba import *
+
+
+def dummy_fk(table, field):
+    fks = {
+        'table_2': {
+            'constraint_name': 'fk_contraint_name',
+            'table_name': 'table',
+            'column_name': 'table_2',
+            'foreign_table_name': 'table2',
+            'foreign_column_name': 'id'
+        }
+    }
+    return fks[field]
+
+
+class CountingQuery(OOQuery):
+    parsers = 0
+
+    def create_parser(self):
+        CountingQuery.parsers += 1
+        return super(CountingQuery, self).create_parser()
+
+
+with description('Compiling queries'):
+    with context('the skeleton of a domain'):
+        with it('must not depend on the values'):
+            skel1 = domain_skeleton([
+                '|', ('a', '=', 1), ('b', 'in', [1, 2]), ('c', '=', 'x')
+            ])
+            skel2 = domain_skeleton([
+                '|', ('a', '=', 3), ('b', 'in', (5, 6)), ('c', '=', 'y')
+            ])
+            expect(skel1).to(equal(skel2))
+
+        with it('must depend on the length of the lists'):
+            skel1 = domain_skeleton([('b', 'in', [1, 2])])
+            skel2 = domain_skeleton([('b', 'in', [1, 2, 3])])
+            expect(skel1).not_to(equal(skel2))
+
+        with it('must keep nulls and fields'):
+            skel1 = domain_skeleton([('a', '=', None), ('b', '=', Field('c'))])
+            skel2 = domain_skeleton([('a', '=', 1), ('b', '=', Field('d'))])
+            expect(skel1).not_to(equal(skel2))
+            expect(hash(skel1)).to(be_an(int))
+
+    with it('must return the values of the leaves in order'):
+        values = domain_values(['|', ('a', '=', 1), ('b', 'in', [2])])
+        expect(values).to(equal([1, [2]]))
+
+    with it('must freeze python-sql expressions and join types'):
+        expect(freeze(Max('a'))).to(equal(freeze(Max('a'))))
+        expect(freeze(Max('a'))).not_to(equal(freeze(Max('b'))))
+        expect(freeze(LeftJoin('a.b'))).to(equal(('LeftJoin', 'a.b')))
+
+    with context('with a compile cache'):
+        with it('must render the same SQL as without cache'):
+            domain = [
+                ('table_2.code', '=', 'XXX'),
+                '|', ('state', 'in', ['open', 'paid']), ('field1', '=', None)
+            ]
+            q = OOQuery('table', dummy_fk, compile_cache=CompileCache())
+            expected = OOQuery('table', dummy_fk).compile(
+                ['field1', 'table_2.name'], domain, limit=10
+            )
+            q.compile(['field1', 'table_2.name'], domain, limit=10)
+            sql = q.compile(['field1', 'table_2.name'], domain, limit=10)
+            expect(sql).to(equal(expected))
+
+        with it('must bind the new values without parsing the domain'):
+            cache = CompileCache()
+            CountingQuery.parsers = 0
+            q = CountingQuery('table', dummy_fk, compile_cache=cache)
+            q.compile(['field1'], [('table_2.code', '=', 'XXX')])
+            parsers = CountingQuery.parsers
+            sql, params = q.compile(['field1'], [('table_2.code', '=', 'YYY')])
+            expect(CountingQuery.parsers).to(equal(parsers))
+            expect(params).to(equal(('YYY', )))
+            expect(cache.stats).to(have_keys(hits=1, misses=1))
+
+        with it('must not share templates between different selects'):
+            cache = CompileCache()
+            q = OOQuery('table', dummy_fk, compile_cache=cache)
+            q.compile(['field1'], [('field2', '=', 1)])
+            q.compile(['field1'], [('field2', '=', 1)], limit=5)
+            q.compile(['field2'], [('field2', '=', 1)])
+            expect(cache).to(have_len(3))
+
+        with it('must not share templates between different aliases'):
+            cache = CompileCache()
+            q = OOQuery('table', dummy_fk, compile_cache=cache)
+            q.compile(['field1'], [('field2', '=', 1)])
+            q2 = OOQuery('table', dummy_fk, compile_cache=cache)
+            q2.select(['field1'], as_={'field1': 'other'})
+            sql, params = q2.compile(['field1'], [('field2', '=', 1)])
+            expect(sql).to(contain('"other"'))
+
+        with it('must not share templates between different resolvers'):
+            def other_fk(table, field):
+                fk = dict(dummy_fk(table, field))
+                fk['foreign_table_name'] = 'table3'
+                return fk
+
+            cache = CompileCache()
+            q = OOQuery('table', dummy_fk, compile_cache=cache)
+            q.compile(['table_2.name'], [])
+            q2 = OOQuery('table', other_fk, compile_cache=cache)
+            sql, params = q2.compile(['table_2.name'], [])
+            expect(sql).to(contain('"table3"'))
+
+    with context('a compiled query'):
+        with it('must unpack as sql and params'):
+            q = OOQuery('table', dummy_fk)
+            compiled = q.compile(['field1'], [('table_2.code', '=', 'XXX')])
+            expected = OOQuery('table', dummy_fk).select(['field1']).where([
+                ('table_2.code', '=', 'XXX')
+            ])
+            expect(tuple(compiled)).to(equal(tuple(expected)))
+            expect(compiled.params).to(equal(('XXX', )))
+
+        with it('must be immutable'):
+            compiled = OOQuery('table').compile(['a'], [('b', '=', 1)])
+
+            def callback():
+                compiled.params = (2, )
+
+            expect(callback).to(raise_error(AttributeError))
+
+        with it('must not change the state of the query'):
+            q = OOQuery('table', dummy_fk)
+            parser = q.parser
+            q.compile(['table_2.name'], [('table_2.code', '=', 'XXX')])
+            expect(q.parser).to(be(parser))
+            expect(q.parser.joins).to(have_len(0))
+
+        with it('must be bound to new values'):
+            q = OOQuery('table')
+            compiled = q.compile(['a'], ['|', ('b', '=', 1), ('c', 'in', [1])])
+            rebound = compiled.bind(['|', ('b', '=', 2), ('c', 'in', [3])])
+            expect(rebound.sql).to(equal(compiled.sql))
+            expect(rebound.params).to(equal((2, 3)))
+            expect(compiled.params).to(equal((1, 1)))
+
+        with it('must refuse to bind a domain with a different shape'):
+            compiled = OOQuery('table').compile(['a'], [('b', '=', 1)])
+
+            def callback():
+                compiled.bind([('b', 'in', [1, 2])])
+
+            expect(callback).to(raise_error(ValueError))
+
+        with it('must be compiled from different threads'):
+            from threading import Thread
+            q = OOQuery('table', dummy_fk, compile_cache=CompileCache())
+            results = {}
+
+            def compile_query(idx):
+                results[idx] = q.compile(
+                    ['field1', 'table_2.name'], [('table_2.code', '=', idx)]
+                )
+
+            threads = [Thread(target=compile_query, args=(i,)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            expected = OOQuery('table', dummy_fk).compile(
+                ['field1', 'table_2.name'], [('table_2.code', '=', 0)]
+            )
+            for idx, compiled in results.items():
+                expect(compiled.sql).to(equal(expected.sql))
+                expect(compiled.params).to(equal((idx, )))
+
+        with it('must bind large IN lists as one array parameter'):
+            q = OOQuery('table', compile_cache=CompileCache(), in_threshold=2)
+            compiled = q.compile(['a'], [('id', 'in', [1, 2, 3])])
+            rebound = q.compile(['a'], [('id', 'in', [4, 5, 6])])
+            expect(compiled.params).to(equal(([1, 2, 3], )))
+            expect(rebound.params).to(equal(([4, 5, 6], )))
+            expect(rebound.sql).to(contain('ANY(%s)'))
+
+        with it('must share the template of large IN lists of any length'):
+            cache = CompileCache()
+            q = OOQuery('table', compile_cache=cache, in_threshold=2)
+            q.compile(['a'], [('id', 'in', [1, 2, 3])])
+            compiled = q.compile(['a'], [('id', 'not in', (4, 5))])
+            compiled = q.compile(['a'], [('id', 'not in', (6, 7, 8, 9))])
+            expect(cache.stats['misses']).to(equal(2))
+            expect(compiled.template.params_map).to(have_len(1))
+            expect(compiled.params).to(equal(([6, 7, 8, 9], )))
+            rebound = compiled.bind([('id', 'not in', list(range(10)))])
+            expect(rebound.params).to(equal((list(range(10)), )))
+
+        with it('must bind optimized domains'):
+            q = OOQuery(
+                'table', compile_cache=CompileCache(), optimize=True,
+                in_threshold=2
+            )
+            q.compile(['a'], ['|', ('b', '=', 1), ('b', '=', 2)])
+            compiled = q.compile(['a'], ['|', ('b', '=', 3), ('b', '=', 3)])
+            expect(compiled.params).to(equal(([3, 3], )))
+            expect(compiled.sql).to(contain('ANY(%s)'))
+
+    with context('compiling many domains'):
+        with before.each:
+            self.calls = []
+
+            def counting_fk(table, field):
+                self.calls.append((table, field))
+                return {
+                    'constraint_name': 'fk_contraint_name',
+                    'table_name': table,
+                    'column_name': field,
+                    'foreign_table_name': field[:-3],
+                    'foreign_column_name': 'id'
+                }
+
+            self.fk = counting_fk
+            self.fields = ['field1', 'partner_id.name']
+            self.domains = [
+                [('partner_id.country_id.code', '=', 'ES')],
+                [('state', '=', 'open'), ('company_id.name', '=', 'X')],
+                [('partner_id.country_id.code', '=', 'FR')],
+                [],
+            ]
+
+        with it('must return the same queries as compiling one by one'):
+            q = OOQuery('table', self.fk)
+            compiled = q.compile_many(self.fields, self.domains, limit=10)
+            expected = [
+                OOQuery('table', self.fk).compile(self.fields, domain, limit=10)
+                for domain in self.domains
+            ]
+            expect(compiled).to(equal(expected))
+
+        with it('must resolve each foreign key once'):
+            q = OOQuery('table', self.fk)
+            q.compile_many(self.fields, self.domains)
+            expect(sorted(self.calls)).to(equal([
+                ('partner', 'country_id'),
+                ('table', 'company_id'),
+                ('table', 'partner_id'),
+            ]))
+
+        with it('must render each domain shape once'):
+            CountingQuery.parsers = 0
+            stats = QueryStats()
+            q = CountingQuery('table', self.fk, stats=stats)
+            q.compile_many(self.fields, self.domains)
+            expect(stats.counters['render']).to(equal(3))
+            # The select list is only parsed once for all the domains
+            expect(CountingQuery.parsers).to(equal(2))
+
+    with context('with subquery values'):
+        with it('must render them with their parameters'):
+            cache = CompileCache()
+            partners = OOQuery('partner').select(['id'])
+            partners.where([('customer', '=', True)])
+            q = OOQuery('invoice', compile_cache=cache)
+            sql, params = q.compile(['number'], [
+                ('partner_id', 'in', partners), ('state', '=', 'open')
+            ])
+            expect(params).to(equal((True, 'open')))
+
+            partners.where([('customer', '=', False)])
+            sql, params = q.compile(['number'], [
+                ('partner_id', 'in', partners), ('state', '=', 'paid')
+            ])
+            expect(params).to(equal((False, 'paid')))
+            expect(cache).to(have_len(2))
+
+        with it('must not bind them'):
+            compiled = OOQuery('partner').compile(['id'], [('name', '=', 'A')])
+            domain = [('partner_id', 'in', compiled), ('id', '=', 1)]
+            expect(domain_skeleton(domain)).to(equal((
+                ('partner_id', 'in', (
+                    'subquery', '({})'.format(compiled.sql), ('A', )
+                )),
+                ('id', '=', 'value')
+            )))
+            expect(domain_skeleton(domain)).not_to(equal(domain_skeleton(
+                [('partner_id', 'in', [1, 2]), ('id', '=', 1)]
+            )))
@@ -1,5 +1,10 @@
 # coding=utf-8
-from ooquery.domain_converter import convert_from_domain, convert_to_domain
+import sys
+
+from ooquery.domain_converter import (
+    convert_from_domain, convert_from_domains, convert_to_domain,
+    convert_to_domains
+)
 
 from expects import *
 from mamba import *
@@ -136,6 +141,53 @@ with description('The domain converter'):
                 ]
             }))
 
+    with description('when converting big domains'):
+        with it('should flatten nested groups with the same combinator'):
+            result = convert_from_domain([
+                '|', '&', ('a', '=', 1), '&', ('b', '=', 2), ('c', '=', 3),
+                ['|', ('d', '=', 4), ('e', '=', 5)]
+            ])
+            expect(result).to(equal({
+                'combinator': 'or',
+                'rules': [
+                    {'combinator': 'and', 'rules': [
+                        {'field': 'a', 'operator': '=', 'value': 1},
+                        {'field': 'b', 'operator': '=', 'value': 2},
+                        {'field': 'c', 'operator': '=', 'value': 3}
+                    ]},
+                    {'field': 'd', 'operator': '=', 'value': 4},
+                    {'field': 'e', 'operator': '=', 'value': 5}
+                ]
+            }))
+
+        with it('should convert a domain with 100k ORed leaves'):
+            n_leaves = 100000
+            domain = ['|'] * (n_leaves - 1) + [
+                ('id', '=', idx) for idx in range(n_leaves)
+            ]
+            result = convert_from_domain(domain)
+            expect(result['combinator']).to(equal('or'))
+            expect(result['rules']).to(have_len(n_leaves))
+            expect(result['rules'][-1]).to(equal(
+                {'field': 'id', 'operator': '=', 'value': n_leaves - 1}
+            ))
+
+        with it('should convert nested domains deeper than the recursion limit'):
+            depth = sys.getrecursionlimit() * 2
+            domain = ('id', '=', 0)
+            for idx in range(1, depth):
+                combinator = '|' if idx % 2 else '&'
+                domain = [combinator, ('id', '=', idx), domain]
+            result = convert_from_domain(domain)
+            levels = 0
+            group = result
+            while group is not None:
+                levels += 1
+                group = next(
+                    (rule for rule in group['rules'] if 'rules' in rule), None
+                )
+            expect(levels).to(equal(depth - 1))
+
 
 with description('The domain converter to_domain'):
     with description('when converting empty or invalid queries'):
@@ -295,6 +347,51 @@ with description('The domain converter to_domain'):
                 '|', ('state', '=', 'open'), ('state', '=', 'draft')
             ]))
             
+    with description('when converting big queries'):
+        with it('should keep empty groups as nested lists within AND'):
+            query = {
+                'combinator': 'and',
+                'rules': [
+                    {'field': 'active', 'operator': '=', 'value': True},
+                    {'combinator': 'or', 'rules': []}
+                ]
+            }
+            result = convert_to_domain(query)
+            expect(result).to(equal([('active', '=', True), []]))
+
+        with it('should convert a query with 100k ORed rules'):
+            n_rules = 100000
+            query = {
+                'combinator': 'or',
+                'rules': [
+                    {'field': 'id', 'operator': '=', 'value': idx}
+                    for idx in range(n_rules)
+                ]
+            }
+            result = convert_to_domain(query)
+            expect(result).to(have_len(2 * n_rules - 1))
+            expect(result[n_rules - 2:n_rules + 1]).to(equal(
+                ['|', ('id', '=', 0), ('id', '=', 1)]
+            ))
+
+        with it('should convert queries nested deeper than the recursion limit'):
+            depth = sys.getrecursionlimit() * 2
+            query = {'combinator': 'and', 'rules': []}
+            group = query
+            expected = []
+            for idx in range(depth):
+                nested = {
+                    'combinator': 'or',
+                    'rules': [{'field': 'id', 'operator': '=', 'value': idx}]
+                }
+                group['rules'].append(nested)
+                group = nested
+                expected.extend(['|', ('id', '=', idx)])
+            group['rules'].append({'field': 'id', 'operator': '=', 'value': depth})
+            expected.append(('id', '=', depth))
+            result = convert_to_domain(query)
+            expect(result).to(equal(expected))
+
     with description('when handling round-trip conversions'):
         with it('should maintain consistency for simple AND domain'):
             original_domain = [('name', '=', 'John'), ('age', '>', 18)]
@@ -331,4 +428,56 @@ with description('The domain converter to_domain'):
             ]
             json_query = convert_from_domain(original_domain)
             result_domain = convert_to_domain(json_query)
-            expect(result_domain).to(equal(original_domain))
\ No newline at end of file
+            expect(result_domain).to(equal(original_domain))
+
+
+with description('The batch domain converter'):
+    with before.each:
+        self.company = [
+            '|', ('company_id', '=', False), ('company_id', 'child_of', 1)
+        ]
+        self.domains = [
+            self.company + [('state', '=', 'open')],
+            self.company + [('type', 'in', ['out_invoice', 'out_refund'])],
+            self.company + [('state', '=', 'open')],
+            [('active', '=', True)],
+            [('active', '=', 1)],
+            [],
+        ]
+
+    with it('should convert domains like convert_from_domain'):
+        result = convert_from_domains(self.domains)
+        expect(result).to(equal(
+            [convert_from_domain(domain) for domain in self.domains]
+        ))
+
+    with it('should share identical groups and conditions'):
+        first, second, third = convert_from_domains(self.domains)[:3]
+        expect(first['rules'][0]).to(be(second['rules'][0]))
+        expect(first).to(be(third))
+
+    with it('should not share conditions with equal values of other types'):
+        active_true, active_one = convert_from_domains(self.domains)[3:5]
+        expect(active_true['rules'][0]['value']).to(be(True))
+        expect(active_one['rules'][0]['value']).to(equal(1))
+        expect(active_one['rules'][0]['value']).not_to(be(True))
+
+    with it('should convert queries like convert_to_domain'):
+        queries = [convert_from_domain(domain) for domain in self.domains]
+        queries.append(None)
+        result = convert_to_domains(queries)
+        expect(result).to(equal(
+            [convert_to_domain(query) for query in queries]
+        ))
+
+    with it('should build the domain of repeated groups once'):
+        queries = convert_from_domains(self.domains)
+        result = convert_to_domains(queries)
+        expect(result[:3]).to(equal(self.domains[:3]))
+        expect(result[0][1]).to(be(result[1][1]))
+
+    with it('should raise like convert_to_domain with invalid rules'):
+        queries = [{'combinator': 'and', 'rules': [{'field': 'name'}]}]
+        expect(lambda: convert_to_domains(queries)).to(
+            raise_error(ValueError)
+        )
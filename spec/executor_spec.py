@@ -0,0 +1,311 @@
+# coding=utf-8
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+from ooquery import OOQuery
+from ooquery.executor import (
+    ConnectionPool, Empty, ParallelExecutor, QueryExecutor, server_side_cursor
+)
+from ooquery.stats import QueryStats
+from sql import Flavor
+
+from expects import *
+from mamba import *
+
+
+class FakeConnection(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.names = []
+
+    def cursor(self, name=None):
+        self.names.append(name)
+        return self.connection.cursor()
+
+
+class ClosingCursor(object):
+    closed = 0
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def close(self):
+        ClosingCursor.closed += 1
+        self.cursor.close()
+
+
+with description('The query executor'):
+    with before.each:
+        Flavor.set(Flavor(paramstyle='qmark'))
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute(
+            'CREATE TABLE invoice (id INTEGER PRIMARY KEY, number TEXT)'
+        )
+        self.conn.executemany(
+            'INSERT INTO invoice VALUES (?, ?)',
+            [(i, 'INV{:03}'.format(i)) for i in range(1, 11)]
+        )
+        self.q = OOQuery('invoice')
+
+    with after.each:
+        Flavor.set(Flavor())
+        self.conn.close()
+
+    with it('must execute queries and return their rows'):
+        executor = QueryExecutor(self.conn)
+        sql = self.q.select(['number'], order_by=['id.asc']).where([
+            ('id', '<', 3)
+        ])
+        expect(executor.execute(sql)).to(equal([('INV001', ), ('INV002', )]))
+        compiled = self.q.compile(['id'], [('number', '=', 'INV005')])
+        expect(executor(compiled)).to(equal([(5, )]))
+
+    with it('must stream the rows in batches'):
+        stats = QueryStats()
+        executor = QueryExecutor(self.conn, batch_size=4, stats=stats)
+        sql = self.q.select(['id'], order_by=['id.asc']).where([])
+        batches = list(executor.batches(sql))
+        expect([len(rows) for rows in batches]).to(equal([4, 4, 2]))
+        expect(stats.counters).to(have_keys(**{
+            'execute': 1, 'fetch.batches': 3, 'fetch.rows': 10
+        }))
+        rows = list(executor.iterate(sql, batch_size=3))
+        expect(rows).to(equal([(i, ) for i in range(1, 11)]))
+
+    with it('must close the cursor when the generator is closed'):
+        class Connection(object):
+            def cursor(conn):
+                return ClosingCursor(self.conn.cursor())
+
+        ClosingCursor.closed = 0
+        executor = QueryExecutor(Connection(), batch_size=2)
+        rows = executor.iterate(self.q.select(['id']).where([]))
+        next(rows)
+        rows.close()
+        expect(ClosingCursor.closed).to(equal(1))
+
+    with it('must use named cursors when streaming'):
+        conn = FakeConnection(self.conn)
+        executor = QueryExecutor(conn)
+        list(executor.iterate(self.q.select(['id']).where([])))
+        executor.execute(self.q.select(['id']).where([]))
+        expect(conn.names[0]).to(start_with('ooquery_'))
+        expect(conn.names[1]).to(be_none)
+
+        conn = FakeConnection(self.conn)
+        executor = QueryExecutor(conn, server_side=False)
+        list(executor.iterate(self.q.select(['id']).where([])))
+        expect(conn.names).to(equal([None]))
+
+    with it('must fall back to plain cursors'):
+        cursor = server_side_cursor(self.conn)
+        expect(cursor).to(be_a(sqlite3.Cursor))
+
+    with it('must cache the results'):
+        from ooquery.cache import ResultCache
+        cache = ResultCache()
+        executor = QueryExecutor(self.conn, cache=cache)
+        query = self.q.compile(['number'], [('id', '=', 1)])
+        expect(executor.execute(query)).to(equal([('INV001', )]))
+        self.conn.execute("UPDATE invoice SET number = 'X' WHERE id = 1")
+        expect(executor.execute(query)).to(equal([('INV001', )]))
+        cache.invalidate('invoice')
+        expect(executor.execute(query)).to(equal([('X', )]))
+
+    with it('must write the queries in order'):
+        executor = QueryExecutor(self.conn)
+        rows = ((i, 'INV{:03}'.format(i)) for i in range(5, 16))
+        result = executor.write(self.q.iter_insert(
+            ['id', 'number'], rows, on_conflict=['id'], batch_size=4
+        ))
+        expect(result).to(equal([]))
+        result = executor.write([
+            self.q.delete([('id', '>', 12)], returning=['id'])
+        ])
+        expect(sorted(result)).to(equal([(13, ), (14, ), (15, )]))
+        expect(self.conn.execute(
+            'SELECT COUNT(*) FROM invoice'
+        ).fetchone()).to(equal((12, )))
+
+    with it('must fetch the pages of paginate'):
+        executor = QueryExecutor(self.conn)
+        pages = list(self.q.paginate(
+            ['number'], [], ['number.desc'], 4, executor.execute
+        ))
+        expect([len(rows) for rows in pages]).to(equal([4, 4, 2]))
+        expect(pages[0][0]).to(equal(('INV010', 10)))
+
+
+class TrackingConnection(object):
+    """sqlite connection counting the queries running at the same time."""
+    lock = threading.Lock()
+
+    def __init__(self, path, state):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.state = state
+        self.rollbacks = 0
+        self.commits = 0
+
+    def cursor(self):
+        connection = self
+
+        class Cursor(object):
+            def __init__(self):
+                self.cursor = connection.connection.cursor()
+
+            def execute(self, sql, params):
+                with connection.lock:
+                    connection.state['running'] += 1
+                    connection.state['max_running'] = max(
+                        connection.state['max_running'],
+                        connection.state['running']
+                    )
+                try:
+                    time.sleep(0.01)
+                    return self.cursor.execute(sql, params)
+                finally:
+                    with connection.lock:
+                        connection.state['running'] -= 1
+
+            def __getattr__(self, name):
+                return getattr(self.cursor, name)
+
+        return Cursor()
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.connection.rollback()
+
+    def commit(self):
+        self.commits += 1
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+with description('The parallel executor'):
+    with before.each:
+        Flavor.set(Flavor(paramstyle='qmark'))
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test.db')
+        conn = sqlite3.connect(self.path)
+        conn.execute(
+            'CREATE TABLE invoice (id INTEGER PRIMARY KEY, number TEXT)'
+        )
+        conn.executemany(
+            'INSERT INTO invoice VALUES (?, ?)',
+            [(i, 'INV{:03}'.format(i)) for i in range(1, 11)]
+        )
+        conn.commit()
+        conn.close()
+        self.state = {'running': 0, 'max_running': 0}
+        self.connections = []
+
+        def connect():
+            connection = TrackingConnection(self.path, self.state)
+            self.connections.append(connection)
+            return connection
+
+        self.pool = ConnectionPool(connect, maxsize=3)
+        self.q = OOQuery('invoice')
+
+    with after.each:
+        Flavor.set(Flavor())
+        self.pool.close()
+        shutil.rmtree(self.dir)
+
+    with it('must return the results in order'):
+        queries = [
+            self.q.compile(['number'], [('id', '=', i)]) for i in range(1, 11)
+        ]
+        results = ParallelExecutor(self.pool).execute(queries)
+        expect([r.rows for r in results]).to(equal(
+            [[('INV{:03}'.format(i), )] for i in range(1, 11)]
+        ))
+        expect([r.query for r in results]).to(equal(queries))
+        expect(all(r.elapsed > 0 for r in results)).to(be_true)
+
+    with it('must not use more connections than the pool'):
+        queries = [self.q.compile(['id'], [('id', '>', i)]) for i in range(20)]
+        ParallelExecutor(self.pool, max_workers=10).execute(queries)
+        expect(self.connections).to(have_len(3))
+        expect(self.state['max_running']).to(be_above(1))
+        expect(self.state['max_running']).to(be_below_or_equal(3))
+
+    with it('must raise the error of the first failed query'):
+        queries = [
+            self.q.compile(['id'], []),
+            ('SELECT * FROM missing', ()),
+            self.q.compile(['id'], [('id', '=', 1)]),
+        ]
+        executor = ParallelExecutor(self.pool)
+        expect(lambda: executor.execute(queries)).to(
+            raise_error(sqlite3.OperationalError)
+        )
+        # The successful queries are also rolled back
+        expect(sum(c.rollbacks for c in self.connections)).to(equal(3))
+        expect(executor.execute(queries[:1])[0].rows).to(have_len(10))
+
+    with it('must end the transaction of the released connections'):
+        pool = self.pool
+        with pool.connection() as connection:
+            connection.cursor().execute(
+                'UPDATE invoice SET number = ? WHERE id = ?', ('X', 1)
+            )
+        expect(connection.rollbacks).to(equal(1))
+        rows = ParallelExecutor(self.pool).execute([
+            self.q.compile(['number'], [('id', '=', 1)])
+        ])[0].rows
+        expect(rows).to(equal([('INV001', )]))
+
+        pool = ConnectionPool(self.pool.connect, commit=True)
+        with pool.connection() as connection:
+            connection.cursor().execute(
+                'UPDATE invoice SET number = ? WHERE id = ?', ('X', 1)
+            )
+        expect(connection.commits).to(equal(1))
+        rows = ParallelExecutor(pool).execute([
+            self.q.compile(['number'], [('id', '=', 1)])
+        ])[0].rows
+        expect(rows).to(equal([('X', )]))
+        pool.close()
+
+    with it('must wake the waiters when a connection is discarded'):
+        class BrokenConnection(object):
+            def rollback(self):
+                raise sqlite3.OperationalError('Connection lost')
+
+            def close(self):
+                pass
+
+        pool = ConnectionPool(BrokenConnection, maxsize=1)
+        context = pool.connection()
+        connection = context.__enter__()
+        acquired = []
+        waiter = threading.Thread(
+            target=lambda: acquired.append(pool.acquire())
+        )
+        waiter.daemon = True
+        waiter.start()
+        time.sleep(0.05)
+        context.__exit__(None, None, None)
+        waiter.join(1)
+        expect(waiter.is_alive()).to(be_false)
+        expect(acquired).to(have_len(1))
+        expect(acquired[0]).not_to(be(connection))
+        expect(pool.created).to(equal(1))
+
+    with it('must wait for a connection when the pool is full'):
+        pool = ConnectionPool(lambda: sqlite3.connect(':memory:'), maxsize=1)
+        connection = pool.acquire()
+        expect(lambda: pool.acquire(timeout=0.01)).to(raise_error(Empty))
+        pool.release(connection)
+        expect(pool.acquire()).to(be(connection))
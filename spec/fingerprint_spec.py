@@ -0,0 +1,113 @@
+# coding=utf-8
+from ooquery.fingerprint import (
+    canonical_domain, domain_fingerprint, domain_skeleton_fingerprint
+)
+from ooquery.expression import Field
+
+from expects import *
+from mamba import *
+
+
+with description('The domain fingerprint'):
+    with it('must be the same for equivalent domains'):
+        domain = [
+            ('state', '!=', 'draft'),
+            '|', ('partner_id.name', 'like', 'A%'), ('amount', '>', 10)
+        ]
+        equivalent = [
+            '|', ['amount', '>', 10], ['partner_id.name', '=like', 'A%'],
+            ['state', '<>', 'draft']
+        ]
+        expect(domain_fingerprint(domain)).to(
+            equal(domain_fingerprint(equivalent))
+        )
+
+    with it('must be different for different domains'):
+        fingerprints = set([
+            domain_fingerprint([]),
+            domain_fingerprint([('a', '=', 1)]),
+            domain_fingerprint([('a', '=', True)]),
+            domain_fingerprint([('a', '=', 1.0)]),
+            domain_fingerprint([('a', '=', '1')]),
+            domain_fingerprint([('a', '=', Field('b'))]),
+            domain_fingerprint([('a', '=', 'b')]),
+            domain_fingerprint([('a', '!=', 1)]),
+            domain_fingerprint(['|', ('a', '=', 1), ('b', '=', 1)]),
+            domain_fingerprint([('a', '=', 1), ('b', '=', 1)]),
+            domain_fingerprint(['!', ('a', '=', 1)]),
+        ])
+        expect(fingerprints).to(have_len(11))
+
+    with it('must ignore the order and duplicates of in values'):
+        expect(domain_fingerprint([('a', 'in', [2, 1, 2])])).to(
+            equal(domain_fingerprint([('a', 'in', (1, 2))]))
+        )
+        expect(
+            domain_fingerprint([('a', 'in', [2, 1])], normalize_values=False)
+        ).not_to(equal(
+            domain_fingerprint([('a', 'in', [1, 2])], normalize_values=False)
+        ))
+
+    with it('must ignore duplicated operands and double negations'):
+        expect(domain_fingerprint(
+            ['&', ('a', '=', 1), '!', '!', ('a', '=', 1)]
+        )).to(equal(domain_fingerprint([('a', '=', 1)])))
+
+    with it('must be a hexadecimal sha1'):
+        fingerprint = domain_fingerprint([('a', '=', 1)])
+        expect(fingerprint).to(match(r'^[0-9a-f]{40}$'))
+
+    with context('without values'):
+        with it('must only depend on the shape of the values'):
+            expect(domain_skeleton_fingerprint(
+                [('a', '=', 1), ('b', 'in', [1, 2])]
+            )).to(equal(domain_skeleton_fingerprint(
+                [('b', 'in', ('x', 'y')), ['a', '=', 'z']]
+            )))
+
+        with it('must keep list lengths, nulls and duplicated operands'):
+            fingerprints = set([
+                domain_skeleton_fingerprint([('a', 'in', [1, 2])]),
+                domain_skeleton_fingerprint([('a', 'in', [1])]),
+                domain_skeleton_fingerprint([('a', '=', None)]),
+                domain_skeleton_fingerprint([('a', '=', 1)]),
+                domain_skeleton_fingerprint([('a', '=', 1), ('a', '=', 2)]),
+            ])
+            expect(fingerprints).to(have_len(5))
+
+
+with description('The canonical domain'):
+    with it('must sort the operands, conditions first'):
+        domain = [
+            '|', ('b', '=', 2), ('a', '=', 1),
+            ('state', '<>', 'draft'), ['amount', '>', 10]
+        ]
+        expect(canonical_domain(domain)).to(equal([
+            ('amount', '>', 10), ('state', '!=', 'draft'),
+            '|', ('a', '=', 1), ('b', '=', 2)
+        ]))
+
+    with it('must flatten operands reduced to the same operator'):
+        domain = [('a', '=', 1), '|', ('b', '=', 2), ('b', '=', 2)]
+        expect(canonical_domain(domain)).to(equal(
+            [('a', '=', 1), ('b', '=', 2)]
+        ))
+
+    with it('must keep empty domains'):
+        expect(canonical_domain([])).to(equal([]))
+
+    with it('must raise with unsupported operators'):
+        expect(lambda: canonical_domain([('a', 'child_of', 1)])).to(
+            raise_error(ValueError)
+        )
+
+    with it('must depend on the subquery values'):
+        from ooquery import OOQuery
+        a = OOQuery('partner').compile(['id'], [('name', '=', 'A')])
+        b = OOQuery('partner').compile(['id'], [('name', '=', 'B')])
+        expect(domain_fingerprint([('partner_id', 'in', a)])).not_to(
+            equal(domain_fingerprint([('partner_id', 'in', b)]))
+        )
+        expect(domain_skeleton_fingerprint([('partner_id', 'in', a)])).to(
+            equal(domain_skeleton_fingerprint([('partner_id', 'in', b)]))
+        )
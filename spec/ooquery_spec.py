@@ -1,10 +1,11 @@
 # coding=utf-8
 from ooquery import OOQuery
 from ooquery.expression import Field
+from ooquery.parser import Parser
 from ooquery.operators import *
 from sql import Table, Literal, NullsFirst, NullsLast
-from sql.operators import And, Concat
-from sql.aggregate import Max
+from sql.operators import And, Concat, NotIn, Or
+from sql.aggregate import Count, Max
 from sql.conditionals import Coalesce, Greatest, Least
 
 from expects import *
@@ -466,6 +467,56 @@ with description('The OOQuery object'):
                 ])
                 expect(q.parser).to(not_(equal(parser)))
 
+        with context('when resolving the fields'):
+            with before.each:
+                self.calls = []
+                calls = self.calls
+
+                class CountingParser(Parser):
+                    def get_table_field(self, table, field):
+                        calls.append(field)
+                        return super(CountingParser, self).get_table_field(
+                            table, field
+                        )
+
+                class CountingQuery(OOQuery):
+                    def create_parser(self):
+                        return CountingParser(self.table, self._foreign_key)
+
+                def dummy_fk(table, field):
+                    return {
+                        'constraint_name': 'fk_contraint_name',
+                        'table_name': table,
+                        'column_name': field,
+                        'foreign_table_name': field[:-3],
+                        'foreign_column_name': 'id'
+                    }
+
+                self.query = CountingQuery('table', dummy_fk)
+
+            with it('must resolve them only once for each select'):
+                self.query.select(['a', 'b', 'table_2_id.name']).where([
+                    ('table_3_id.code', '=', 'XXX')
+                ])
+                expect(self.calls[:4]).to(equal(
+                    ['a', 'b', 'table_2_id.name', 'table_3_id.code']
+                ))
+                expect(self.calls.count('table_2_id.name')).to(equal(1))
+
+            with it('must resolve them again if their joins change'):
+                q = self.query.select(['a', 'table_2_id.name'])
+                t2 = Table('table_2')
+                join = q.table.join(t2, type_='LEFT')
+                join.condition = q.table.table_2_id == t2.id
+                q.parser.joins_map['table_2_id'] = join
+                q.parser.joins[:] = [join]
+                sql = q.where([])
+                expect(self.calls).to(equal(
+                    ['a', 'table_2_id.name', 'a', 'table_2_id.name']
+                ))
+                sel = join.select(q.table.a.as_('a'), t2.name.as_('table_2_id.name'))
+                expect(tuple(sql)).to(equal(tuple(sel)))
+
         with it('must support different joins'):
 
             def dummy_fk(table, field):
@@ -506,3 +557,379 @@ with description('The OOQuery object'):
             sel = join2.select(t.field1.as_('field1'), t.field2.as_('field2'), t2.name.as_('table_2.name'))
             sel.where = And((join2.right.code == 'XXX',))
             expect(tuple(sql)).to(equal(tuple(sel)))
+
+    with context('when paginating'):
+        with before.each:
+            self.calls = []
+            self.pages = []
+
+            def fetch(select):
+                self.calls.append(tuple(select))
+                return self.pages[len(self.calls) - 1]
+
+            self.fetch = fetch
+
+        with it('must filter every page with the last row of the previous'):
+            self.pages = [
+                [{'name': 'a', 'id': 1}, {'name': 'b', 'id': 5}],
+                [{'name': 'c', 'id': 2}]
+            ]
+            q = OOQuery('table')
+            pages = list(q.paginate(
+                ['name'], [('active', '=', True)], ['name.asc'], 2, self.fetch
+            ))
+            expect(pages).to(equal(self.pages))
+
+            t = Table('table')
+            first = t.select(
+                t.name.as_('name'), t.id.as_('id'),
+                where=And((t.active == True,)),
+                order_by=[t.name.asc, t.id.asc], limit=2
+            )
+            second = t.select(
+                t.name.as_('name'), t.id.as_('id'),
+                where=And([
+                    And((t.active == True,)),
+                    Or([
+                        And([Or([t.name > 'b', t.name == None])]),
+                        And([t.name == 'b', t.id > 5])
+                    ])
+                ]),
+                order_by=[t.name.asc, t.id.asc], limit=2
+            )
+            expect(self.calls).to(equal([tuple(first), tuple(second)]))
+
+        with it('must stop on an empty page'):
+            self.pages = [[(1, ), (2, )], []]
+            q = OOQuery('table')
+            pages = list(q.paginate(['id'], [], ['id.desc'], 2, self.fetch))
+            expect(pages).to(equal([[(1, ), (2, )]]))
+            t = Table('table')
+            second = t.select(
+                t.id.as_('id'),
+                where=And([t.id <= 2, And([t.id < 2])]),
+                order_by=[t.id.desc], limit=2
+            )
+            expect(self.calls[1]).to(equal(tuple(second)))
+
+        with it('must read the keys by position from sequence rows'):
+            self.pages = [[('x', None, 3)], []]
+            q = OOQuery('table')
+            list(q.paginate(
+                ['code', 'name'], [], [NullsFirst('name.desc')], 1, self.fetch
+            ))
+            t = Table('table')
+            second = t.select(
+                t.code.as_('code'), t.name.as_('name'), t.id.as_('id'),
+                where=Or([
+                    And([t.name != None]), And([t.name == None, t.id > 3])
+                ]),
+                order_by=[NullsFirst(t.name.desc), t.id.asc], limit=1
+            )
+            expect(self.calls[1]).to(equal(tuple(second)))
+
+        with it('must seek on joined fields'):
+
+            def dummy_fk(table, field):
+                return {
+                    'constraint_name': 'fk_contraint_name',
+                    'table_name': 'table',
+                    'column_name': 'partner_id',
+                    'foreign_table_name': 'partner',
+                    'foreign_column_name': 'id'
+                }
+
+            self.pages = [[{'partner_id.name': None, 'id': 7}], []]
+            q = OOQuery('table', dummy_fk)
+            list(q.paginate(
+                ['id'], [], ['partner_id.name.asc'], 1, self.fetch
+            ))
+            t = Table('table')
+            t2 = Table('partner')
+            join = t.join(t2)
+            join.condition = join.left.partner_id == join.right.id
+            second = join.select(
+                t.id.as_('id'), t2.name.as_('partner_id.name'),
+                where=And([t2.name == None, t.id > 7]),
+                order_by=[t2.name.asc, t.id.asc], limit=1
+            )
+            expect(self.calls[1]).to(equal(tuple(second)))
+
+        with it('must refuse a limit or an offset'):
+            q = OOQuery('table')
+            pages = q.paginate(['id'], [], ['id.asc'], 2, self.fetch, limit=5)
+            expect(lambda: next(pages)).to(
+                raise_error(ValueError, contain('page_size'))
+            )
+            expect(self.calls).to(be_empty)
+
+    with context('when counting'):
+        with before.each:
+            def dummy_fk(table, field):
+                return {
+                    'partner_id': {
+                        'column_name': 'partner_id',
+                        'foreign_table_name': 'partner',
+                        'foreign_column_name': 'id'
+                    },
+                    'country_id': {
+                        'column_name': 'country_id',
+                        'foreign_table_name': 'country',
+                        'foreign_column_name': 'id'
+                    },
+                    'line_ids': {
+                        'column_name': 'id',
+                        'foreign_table_name': 'line',
+                        'foreign_column_name': 'invoice_id'
+                    }
+                }[field]
+
+            self.q = OOQuery('invoice', dummy_fk)
+            self.t = Table('invoice')
+
+        with it('must drop the select list, the order and the left joins'):
+            self.q.select(
+                ['number', LeftJoin('partner_id.name')],
+                order_by=['number.desc'], limit=10
+            )
+            sql = self.q.count([('state', '=', 'open')])
+            expect(tuple(sql)).to(equal(
+                ('SELECT COUNT(*) AS "count" FROM "invoice" AS "a" '
+                 'WHERE (("a"."state" = %s))', ('open', ))
+            ))
+
+        with it('must keep the joins filtering rows'):
+            self.q.select(['number', LeftJoin('partner_id.name'),
+                           'partner_id.country_id.code'])
+            sql = self.q.count([])
+            expect(tuple(sql)).to(equal((
+                'SELECT COUNT(*) AS "count" FROM "invoice" AS "a" '
+                'LEFT JOIN "partner" AS "b" ON ("a"."partner_id" = "b"."id") '
+                'INNER JOIN "country" AS "c" '
+                'ON ("b"."country_id" = "c"."id")', ()
+            )))
+
+        with it('must count distinct ids with to-many joins'):
+            self.q.select(['number', LeftJoin('line_ids.name')])
+            sql = self.q.count([('line_ids.price', '>', 10)])
+            line = Table('line')
+            join = self.t.join(line, type_='LEFT')
+            join.condition = self.t.id == line.invoice_id
+            sel = join.select(
+                Count(self.t.id, distinct=True).as_('count'),
+                where=And((line.price > 10,))
+            )
+            expect(tuple(sql)).to(equal(tuple(sel)))
+
+        with it('must not change the select'):
+            self.q.select(['number', LeftJoin('partner_id.name')])
+            self.q.count([])
+            sql = self.q.where([])
+            expect(str(sql)).to(contain('LEFT JOIN "partner"'))
+
+    with context('when eliminating joins'):
+        with it('must not join the tables only compared by id'):
+            def dummy_fk(table, field):
+                return {
+                    'column_name': 'partner_id',
+                    'foreign_table_name': 'partner',
+                    'foreign_column_name': 'id'
+                }
+
+            q = OOQuery('invoice', dummy_fk, eliminate_joins=True)
+            sql = q.select(['number']).where([
+                '|', (LeftJoin('partner_id.id'), '=', 1), ('state', '=', 'x')
+            ])
+            t = Table('invoice')
+            sel = t.select(t.number.as_('number'))
+            sel.where = And((Or((t.partner_id == 1, t.state == 'x')),))
+            expect(tuple(sql)).to(equal(tuple(sel)))
+
+    with context('when promoting outer joins'):
+        with it('must use inner joins for the null rejected tables'):
+            def dummy_fk(table, field):
+                return {
+                    'column_name': 'partner_id',
+                    'foreign_table_name': 'partner',
+                    'foreign_column_name': 'id'
+                }
+
+            q = OOQuery('invoice', dummy_fk, promote_joins=True)
+            sql = q.select(['number', LeftJoin('partner_id.name')]).where([
+                ('partner_id.name', 'ilike', 'A%')
+            ])
+            t = Table('invoice')
+            t2 = Table('partner')
+            join = t.join(t2)
+            join.condition = t.partner_id == t2.id
+            sel = join.select(
+                t.number.as_('number'), t2.name.as_('partner_id.name')
+            )
+            sel.where = And((t2.name.ilike('A%'),))
+            expect(tuple(sql)).to(equal(tuple(sel)))
+            expect(q.parser.promoted_joins).to(equal(
+                [('partner_id', 'LEFT', 'INNER')]
+            ))
+
+    with context('when using a query as a value'):
+        with it('must use the select of an OOQuery as a subquery'):
+            partners = OOQuery('partner').select(['id'])
+            partners.where([('customer', '=', True)])
+            q = OOQuery('invoice')
+            sql = q.select(['number']).where([
+                ('partner_id', 'not in', partners)
+            ])
+            t = Table('invoice')
+            t2 = Table('partner')
+            sub = t2.select(t2.id.as_('id'), where=And((t2.customer == True,)))
+            sel = t.select(t.number.as_('number'))
+            sel.where = And((NotIn(t.partner_id, sub),))
+            expect(tuple(sql)).to(equal(tuple(sel)))
+
+        with it('must refuse a query without select as a subquery'):
+            partners = OOQuery('partner')
+            partners.where([('customer', '=', True)])
+            q = OOQuery('invoice').select(['number'])
+            expect(lambda: q.where([('partner_id', 'in', partners)])).to(
+                raise_error(ValueError, contain('call select'))
+            )
+
+        with it('must use the SQL of a CompiledQuery as a subquery'):
+            partners = OOQuery('partner').compile(
+                ['id'], [('name', '=', 'A')]
+            )
+            q = OOQuery('invoice')
+            sql = q.select(['number']).where([
+                ('partner_id', 'in', partners), ('state', '=', 'open')
+            ])
+            expect(tuple(sql)).to(equal((
+                'SELECT "a"."number" AS "number" FROM "invoice" AS "a" '
+                'WHERE (("a"."partner_id" IN ({})) AND ("a"."state" = %s))'
+                .format(partners.sql),
+                ('A', 'open')
+            )))
+
+    with context('when updating and deleting'):
+        with before.each:
+            def dummy_fk(table, field):
+                return {
+                    'partner_id': {
+                        'column_name': 'partner_id',
+                        'foreign_table_name': 'partner',
+                        'foreign_column_name': 'id'
+                    },
+                    'country_id': {
+                        'column_name': 'country_id',
+                        'foreign_table_name': 'country',
+                        'foreign_column_name': 'id'
+                    }
+                }[field]
+
+            self.q = OOQuery('invoice', dummy_fk)
+
+        with it('must update the rows of the domain'):
+            sql = self.q.update(
+                {'state': 'cancel', 'amount': Field('amount_total')},
+                [('state', '=', 'open')], returning=['id']
+            )
+            expect(tuple(sql)).to(equal((
+                'UPDATE "invoice" AS "a" SET "amount" = "a"."amount_total", '
+                '"state" = %s WHERE (("a"."state" = %s)) RETURNING "a"."id"',
+                ('cancel', 'open')
+            )))
+
+        with it('must update from the joined tables'):
+            sql = self.q.update({'state': 'cancel'}, [
+                ('partner_id.country_id.code', '=', 'ES')
+            ])
+            expect(tuple(sql)).to(equal((
+                'UPDATE "invoice" AS "c" SET "state" = %s '
+                'FROM "partner" AS "a", "country" AS "b" '
+                'WHERE (("c"."partner_id" = "a"."id") '
+                'AND ("a"."country_id" = "b"."id") AND (("b"."code" = %s)))',
+                ('cancel', 'ES')
+            )))
+
+        with it('must delete using the joined tables'):
+            sql = self.q.delete(
+                [('partner_id.name', '=', 'A')], returning=['id']
+            )
+            expect(tuple(sql)).to(equal((
+                'DELETE FROM "invoice" AS "a" USING "partner" AS "b" '
+                'WHERE (("a"."partner_id" = "b"."id") '
+                'AND (("b"."name" = %s))) RETURNING "a"."id"',
+                ('A', )
+            )))
+
+        with it('must filter the ids with a subquery with outer joins'):
+            sql = self.q.delete([(LeftJoin('partner_id.name'), '=', None)])
+            expect(tuple(sql)).to(equal((
+                'DELETE FROM "invoice" WHERE ("id" IN ('
+                'SELECT "a"."id" FROM "invoice" AS "a" '
+                'LEFT JOIN "partner" AS "b" ON ("a"."partner_id" = "b"."id") '
+                'WHERE (("b"."name" IS NULL))))',
+                ()
+            )))
+            sql = self.q.update({'state': 'cancel'}, [
+                ('partner_id.name', '=', 'A')
+            ], strategy='subquery')
+            expect(tuple(sql)).to(equal((
+                'UPDATE "invoice" AS "a" SET "state" = %s '
+                'WHERE ("a"."id" IN (SELECT "b"."id" FROM "invoice" AS "b" '
+                'INNER JOIN "partner" AS "c" ON ("b"."partner_id" = "c"."id") '
+                'WHERE (("c"."name" = %s))))',
+                ('cancel', 'A')
+            )))
+
+        with it('must only write the fields of the table'):
+            expect(lambda: self.q.update({'partner_id.name': 'A'}, [])).to(
+                raise_error(ValueError)
+            )
+            expect(lambda: self.q.update({}, [])).to(raise_error(ValueError))
+            expect(lambda: self.q.delete([], strategy='merge')).to(
+                raise_error(ValueError)
+            )
+
+    with context('when inserting'):
+        with it('must batch the rows under the rows and parameters limits'):
+            q = OOQuery('country')
+            rows = iter([('C{}'.format(i), 'Country') for i in range(7)])
+            queries = q.insert(['code', 'name'], rows, batch_size=3)
+            expect([len(sql.params) for sql in queries]).to(
+                equal([6, 6, 2])
+            )
+            queries = q.insert(['code', 'name'], [
+                ('ES', Literal('Spain')), ('FR', 'France'), ('PT', 'Portugal')
+            ], max_params=4)
+            expect(tuple(queries[0])).to(equal((
+                'INSERT INTO "country" AS "a" ("code", "name") '
+                'VALUES (%s, %s), (%s, %s)', ('ES', 'Spain', 'FR', 'France')
+            )))
+            expect(queries).to(have_len(2))
+
+        with it('must upsert the rows on conflict'):
+            q = OOQuery('country')
+            sql, = q.insert(
+                ['code', 'name', 'currency'],
+                [{'code': 'ES', 'name': 'Spain', 'currency': 'EUR'}],
+                on_conflict=['code'], returning=['id']
+            )
+            expect(tuple(sql)).to(equal((
+                'INSERT INTO "country" AS "a" ("code", "name", "currency") '
+                'VALUES (%s, %s, %s) ON CONFLICT ("code") DO UPDATE SET '
+                '"name" = EXCLUDED."name", "currency" = EXCLUDED."currency" '
+                'RETURNING "a"."id"', ('ES', 'Spain', 'EUR')
+            )))
+            sql, = q.insert(
+                ['code', 'name'], [('ES', 'Spain')], on_conflict=['code'],
+                update=[]
+            )
+            expect(str(sql)).to(
+                end_with('ON CONFLICT ("code") DO NOTHING')
+            )
+
+        with it('must raise with rows of a different length'):
+            q = OOQuery('country')
+            expect(lambda: q.insert(['code', 'name'], [('ES', )])).to(
+                raise_error(ValueError)
+            )
@@ -12,3 +12,9 @@ with description('An operator'):
         }
         for op, n_pops in pops_operator.items():
             expect(OPERATORS_MAP[op].n_pops).to(equal(n_pops))
+
+    with it('must only export the operators and join types'):
+        names = {}
+        exec('from ooquery.operators import *', names)
+        expect(names).not_to(have_keys('Select', 'operators', 'IN_STRATEGIES'))
+        expect(names).to(have_keys('And', 'OPERATORS_MAP', 'LeftJoin'))
@@ -0,0 +1,121 @@
+# coding=utf-8
+from ooquery.optimizer import optimize_domain
+from ooquery.parser import Parser
+from ooquery.expression import Field, InvalidExpressionException
+from sql import Literal, Table
+from sql.operators import And, Equal, In, Or
+
+from expects import *
+from mamba import *
+
+
+with description('The domain optimizer'):
+    with it('must keep empty and simple domains'):
+        expect(optimize_domain([])).to(equal([]))
+        expect(optimize_domain([('a', '=', 1), ('b', '=', 2)])).to(equal(
+            [('a', '=', 1), ('b', '=', 2)]
+        ))
+
+    with it('must flatten nested operators'):
+        domain = ['&', '&', ('a', '=', 1), ('b', '=', 2), ('c', '=', 3)]
+        expect(optimize_domain(domain)).to(equal(
+            [('a', '=', 1), ('b', '=', 2), ('c', '=', 3)]
+        ))
+        domain = ['|', ('a', '>', 1), '|', ('b', '>', 2), ('c', '>', 3)]
+        expect(optimize_domain(domain)).to(equal(
+            ['|', '|', ('a', '>', 1), ('b', '>', 2), ('c', '>', 3)]
+        ))
+
+    with it('must remove duplicated leaves'):
+        domain = [('a', '=', 1), ['a', '=', 1], ('b', 'in', [1, 2]),
+                  ('b', 'in', (1, 2))]
+        expect(optimize_domain(domain)).to(equal(
+            [('a', '=', 1), ('b', 'in', [1, 2])]
+        ))
+
+    with it('must merge ORed equalities into an in'):
+        domain = ['|', '|', ('state', '=', 'open'), ('state', '=', 'paid'),
+                  ('state', 'in', ['draft', 'open'])]
+        expect(optimize_domain(domain)).to(equal(
+            [('state', 'in', ['open', 'paid', 'draft'])]
+        ))
+
+    with it('must not merge nulls nor fields'):
+        domain = ['|', '|', ('a', '=', None), ('a', '=', 1), ('a', '=', Field('b'))]
+        expect(optimize_domain(domain)).to(have_len(5))
+
+    with it('must not merge subqueries nor expressions'):
+        from ooquery import OOQuery
+        sub1 = OOQuery('partner').select(['id'])
+        sub1.where([('name', '=', 'A')])
+        sub2 = OOQuery('partner').compile(['id'], [('name', '=', 'B')])
+        domain = [
+            '|', '|', ('partner_id', '=', sub1), ('partner_id', '=', sub2),
+            ('partner_id', '=', Literal(1))
+        ]
+        expect(optimize_domain(domain)).to(equal(domain))
+        q = OOQuery('invoice', optimize=True)
+        sql = q.select(['id']).where(domain)
+        expect(sql.params).to(equal(('A', 'B', 1)))
+
+    with it('must convert single value in lists to equalities'):
+        domain = [('a', 'in', [1]), ('b', 'not in', (2, ))]
+        expect(optimize_domain(domain)).to(equal(
+            [('a', '=', 1), ('b', '!=', 2)]
+        ))
+
+    with it('must factor the conjuncts shared by all the branches of an OR'):
+        domain = [
+            '|',
+            '&', ('company_id', '=', 1), ('state', '=', 'open'),
+            '&', ('company_id', '=', 1), ('amount', '>', 10)
+        ]
+        expect(optimize_domain(domain)).to(equal([
+            ('company_id', '=', 1),
+            '|', ('state', '=', 'open'), ('amount', '>', 10)
+        ]))
+
+    with it('must fold branches which are always true'):
+        domain = [
+            '|', ('company_id', '=', 1),
+            '&', ('company_id', '=', 1), ('state', '=', 'open'),
+        ]
+        expect(optimize_domain(domain)).to(equal([('company_id', '=', 1)]))
+
+    with it('must not fold branches with the only leaves of a join'):
+        domain = [
+            '|', ('amount', '=', 1),
+            '&', ('amount', '=', 1), ('partner_id.name', '=', 'x'),
+        ]
+        expect(optimize_domain(domain)).to(equal(domain))
+        domain = [
+            '|', ('partner_id.ref', '=', 1),
+            '&', ('partner_id.ref', '=', 1), ('partner_id.name', '=', 'x'),
+        ]
+        expect(optimize_domain(domain)).to(equal([('partner_id.ref', '=', 1)]))
+
+    with it('must remove double negations'):
+        domain = ['!', '!', ('a', '=', 1), '!', ('b', '=', 1)]
+        expect(optimize_domain(domain)).to(equal(
+            [('a', '=', 1), '!', ('b', '=', 1)]
+        ))
+
+    with it('must raise with invalid domains'):
+        def callback():
+            optimize_domain([('a', '=', 1), 'x'])
+
+        expect(callback).to(raise_error(InvalidExpressionException))
+
+    with it('must handle large domains without recursion'):
+        domain = ['|'] * 9999 + [('id', '=', i) for i in range(10000)]
+        result = optimize_domain(domain)
+        expect(result).to(equal([('id', 'in', list(range(10000)))]))
+
+    with it('must be used by the parser when enabled'):
+        t = Table('table')
+        parser = Parser(t, optimize=True)
+        parsed = parser.parse(['|', ('a', '=', 1), ('a', '=', 2)])
+        expect(parsed).to(equal(And((In(t.a, [1, 2]), ))))
+        parser = Parser(t)
+        parsed = parser.parse(['|', ('a', '=', 1), ('a', '=', 2)])
+        expect(parsed).to(equal(And((Or((Equal(t.a, 1), Equal(t.a, 2))), ))))
@@ -1,5 +1,5 @@
 # coding=utf-8
-from sql import Table
+from sql import Literal, Table
 from sql.operators import *
 from ooquery.parser import Parser
 from ooquery.expression import InvalidExpressionException
@@ -233,3 +233,400 @@ with description('A parser'):
 
             expect(str(p.joins[index])).to(equal(str(custom_join)))
             expect(p.joins[index]).to(equal(custom_join))
+
+    with context('with a threshold for large IN lists'):
+        with it('must compile them as one array parameter'):
+            t = Table('table')
+            p = Parser(t, in_threshold=3)
+            ids = list(range(10))
+            x = p.parse([('id', 'in', ids), ('state', 'not in', ('a', 'b', 'c'))])
+            sel = t.select(t.id, where=x)
+            expect(tuple(sel)).to(equal((
+                'SELECT "a"."id" FROM "table" AS "a" WHERE '
+                '(("a"."id" = ANY(%s)) AND ("a"."state" != ALL(%s)))',
+                (ids, ['a', 'b', 'c'])
+            )))
+
+        with it('must keep the SQL constant whatever the number of values'):
+            t = Table('table')
+            p = Parser(t, in_threshold=3)
+            sql1 = str(t.select(t.id, where=p.parse([('id', 'in', [1, 2, 3])])))
+            sql2 = str(t.select(t.id, where=p.parse([('id', 'in', [1] * 500)])))
+            expect(sql1).to(equal(sql2))
+
+        with it('must keep small lists as IN'):
+            t = Table('table')
+            p = Parser(t, in_threshold=3)
+            x = p.parse([('id', 'in', [1, 2])])
+            expect(x).to(equal(And((In(t.id, [1, 2]),))))
+
+        with it('must support the unnest strategy'):
+            t = Table('table')
+            p = Parser(t, in_threshold=1, in_strategy='unnest')
+            x = p.parse([('id', 'not in', [1, 2])])
+            sel = t.select(t.id, where=x)
+            expect(tuple(sel)).to(equal((
+                'SELECT "a"."id" FROM "table" AS "a" WHERE '
+                '(("a"."id" NOT IN (SELECT UNNEST(%s))))',
+                ([1, 2],)
+            )))
+
+        with it('must refuse unknown strategies'):
+            def callback():
+                Parser(Table('table'), in_threshold=1, in_strategy='foo')
+
+            expect(callback).to(raise_error(ValueError))
+
+    with context('getting the join paths of a query'):
+        with it('must return every prefix of the dotted fields'):
+            from ooquery.parser import get_join_paths
+            from ooquery.expression import Field
+            from ooquery.operators import LeftJoin
+            from sql import NullsFirst
+            from sql.aggregate import Max
+            paths = get_join_paths(
+                fields=['a', LeftJoin('b_id.name'), Max('c_id.amount')],
+                domain=[('d_id.e_id.code', '=', 1), ('x', '=', Field('f_id.y'))],
+                order_by=[NullsFirst('g_id.name.asc'), 'z.desc'],
+                group_by=['h_id.code']
+            )
+            expect(paths).to(equal({
+                ('b_id', ), ('c_id', ), ('d_id', ), ('d_id', 'e_id'),
+                ('f_id', ), ('g_id', ), ('h_id', )
+            }))
+
+    with context('pruning the joins'):
+        with before.each:
+            def dummy_fk(table, field):
+                return {
+                    'partner_id': {
+                        'column_name': 'partner_id',
+                        'foreign_table_name': 'partner',
+                        'foreign_column_name': 'id'
+                    },
+                    'country_id': {
+                        'column_name': 'country_id',
+                        'foreign_table_name': 'country',
+                        'foreign_column_name': 'id'
+                    },
+                    'line_ids': {
+                        'column_name': 'id',
+                        'foreign_table_name': 'line',
+                        'foreign_column_name': 'invoice_id'
+                    }
+                }[field]
+
+            self.t = Table('invoice')
+            self.p = Parser(self.t, dummy_fk)
+            self.p.parse([
+                ('line_ids.price', '>', 1),
+                ('partner_id.country_id.code', '=', 'ES')
+            ])
+
+        with it('must keep the joins of the paths and their parents'):
+            line_join = self.p.joins_map['line_ids']
+            self.p.prune_joins(['partner_id.country_id'])
+            expect(list(self.p.joins_map)).to(equal(
+                ['partner_id', 'partner_id.country_id']
+            ))
+            expect(self.p.joins).to(have_len(2))
+
+            partner = Table('partner')
+            country = Table('country')
+            join = self.t.join(partner)
+            join.condition = self.t.partner_id == partner.id
+            join = join.join(country)
+            join.condition = partner.country_id == country.id
+            expect(str(self.p.joins[-1])).to(equal(str(join)))
+            expect(self.p.joins[-1].left.left).to(be(self.t))
+            expect(line_join.left).not_to(be(self.t))
+
+        with it('must know the to-many joins'):
+            expect(self.p.is_to_many('line_ids')).to(be_true)
+            expect(self.p.is_to_many('partner_id')).to(be_false)
+            expect(self.p.is_to_many('missing')).to(be_false)
+
+    with context('eliminating joins'):
+        with before.each:
+            def dummy_fk(table, field):
+                return {
+                    'partner_id': {
+                        'column_name': 'partner_id',
+                        'foreign_table_name': 'partner',
+                        'foreign_column_name': 'id'
+                    },
+                    'country_id': {
+                        'column_name': 'country_id',
+                        'foreign_table_name': 'country',
+                        'foreign_column_name': 'id'
+                    },
+                    'line_ids': {
+                        'column_name': 'id',
+                        'foreign_table_name': 'line',
+                        'foreign_column_name': 'invoice_id'
+                    }
+                }[field]
+
+            self.t = Table('invoice')
+            self.p = Parser(self.t, dummy_fk, eliminate_joins=True)
+
+        with it('must compare the ids on the foreign key column'):
+            from ooquery.operators import LeftJoin
+            x = self.p.parse([
+                ('partner_id.id', '=', 1),
+                '|', (LeftJoin('partner_id.id'), '=', 2), ('state', '=', 'x')
+            ])
+            expect(x).to(equal(And((
+                self.t.partner_id == 1,
+                Or((self.t.partner_id == 2, self.t.state == 'x'))
+            ))))
+            self.p.prune_unused_joins([x])
+            expect(self.p.joins).to(be_empty)
+
+        with it('must keep the join type of the compared ids'):
+            from ooquery.operators import LeftJoin
+            x = self.p.parse([
+                '|', ('partner_id.name', '=', 'A'),
+                (LeftJoin('partner_id.id'), '=', None)
+            ])
+            self.p.prune_unused_joins([x])
+            partner = self.p.joins_map['partner_id']
+            expect(partner.type_).to(equal('LEFT'))
+            expect(x).to(equal(And((Or((
+                partner.right.name == 'A', self.t.partner_id == None
+            )),))))
+
+        with it('must keep the joins filtering rows'):
+            self.p.parse([
+                '|', ('partner_id.id', '=', 2), ('state', '=', 'x'),
+                ('line_ids.id', '=', 1),
+                ('partner_id.country_id.id', '=', None)
+            ])
+            expect(list(self.p.joins_map)).to(equal(
+                ['partner_id', 'partner_id.country_id', 'line_ids']
+            ))
+
+        with it('must only compare the last join of a path'):
+            x = self.p.parse([('partner_id.country_id.id', 'in', [1, 2])])
+            partner = self.p.joins_map['partner_id'].right
+            expect(x).to(equal(And((In(partner.country_id, [1, 2]),))))
+            self.p.prune_unused_joins([x])
+            expect(list(self.p.joins_map)).to(equal(['partner_id']))
+
+        with it('must drop the unused left to-one joins'):
+            from ooquery.operators import LeftJoin
+            self.p.parse([
+                (LeftJoin('partner_id.name'), '=', 'A'),
+                (LeftJoin('line_ids.name'), '=', 'B'),
+                (LeftJoin('partner_id.country_id.code'), '=', 'C'),
+            ])
+            country = self.p.joins_map['partner_id.country_id'].right
+            self.p.prune_unused_joins([country.code == 'C'])
+            expect(list(self.p.joins_map)).to(equal(
+                ['partner_id', 'partner_id.country_id', 'line_ids']
+            ))
+            self.p.prune_unused_joins([])
+            expect(list(self.p.joins_map)).to(equal(['line_ids']))
+
+    with context('getting the conjunct leaves of a domain'):
+        with it('must return the leaves ANDed with the whole domain'):
+            from ooquery.parser import conjunct_leaves
+            expect(conjunct_leaves([
+                ('a', '=', 1),
+                '&', ('b', '=', 1), '|', ('c', '=', 1), ('d', '=', 1),
+                '!', ('e', '=', 1),
+                ('f', '=', 1)
+            ])).to(equal({0, 2, 8}))
+
+    with context('promoting outer joins'):
+        with before.each:
+            def dummy_fk(table, field):
+                return {
+                    'partner_id': {
+                        'column_name': 'partner_id',
+                        'foreign_table_name': 'partner',
+                        'foreign_column_name': 'id'
+                    },
+                    'country_id': {
+                        'column_name': 'country_id',
+                        'foreign_table_name': 'country',
+                        'foreign_column_name': 'id'
+                    }
+                }[field]
+
+            self.t = Table('invoice')
+            self.p = Parser(self.t, dummy_fk, promote_joins=True)
+
+        with it('must promote the joins of the null rejected tables'):
+            from ooquery.operators import LeftJoin
+            where = self.p.parse([
+                (LeftJoin('partner_id.country_id.code'), '=', 'ES')
+            ])
+            promoted = self.p.promote_outer_joins(where)
+            expect(promoted).to(equal([
+                ('partner_id', 'LEFT', 'INNER'),
+                ('partner_id.country_id', 'LEFT', 'INNER')
+            ]))
+            expect(self.p.promoted_joins).to(equal(promoted))
+            expect([j.type_ for j in self.p.joins]).to(equal(
+                ['INNER', 'INNER']
+            ))
+            expect(self.p.joins[-1].left).to(be(self.p.joins[0]))
+
+        with it('must not promote the joins of null accepting conditions'):
+            from ooquery.operators import LeftJoin
+            where = self.p.parse([
+                '|', (LeftJoin('partner_id.name'), '=', 'A'),
+                ('state', '=', 'open'),
+                (LeftJoin('partner_id.country_id.code'), '=', None)
+            ])
+            expect(self.p.promote_outer_joins(where)).to(be_empty)
+            expect([j.type_ for j in self.p.joins]).to(equal(
+                ['LEFT', 'LEFT']
+            ))
+
+        with it('must promote the joins of negated conditions'):
+            from ooquery.operators import LeftJoin
+            where = self.p.parse([
+                '!', (LeftJoin('partner_id.country_id.code'), '=', None)
+            ])
+            expect(self.p.promote_outer_joins(where)).to(equal([
+                ('partner_id', 'LEFT', 'INNER'),
+                ('partner_id.country_id', 'LEFT', 'INNER')
+            ]))
+            p = Parser(self.t, self.p.foreign_key, promote_joins=True)
+            where = p.parse([
+                '!', '&', (LeftJoin('partner_id.name'), '=', 'A'),
+                '|', (LeftJoin('partner_id.ref'), '=', 'B'),
+                (LeftJoin('partner_id.country_id.code'), '=', 'ES')
+            ])
+            # NOT (a AND (b OR c)) is NOT a OR (NOT b AND NOT c)
+            expect(p.promote_outer_joins(where)).to(equal([
+                ('partner_id', 'LEFT', 'INNER')
+            ]))
+
+        with it('must not promote the joins of negated null accepting '
+                'conditions'):
+            from ooquery.operators import LeftJoin
+            where = self.p.parse([
+                '!', (LeftJoin('partner_id.name'), '!=', None)
+            ])
+            expect(self.p.promote_outer_joins(where)).to(be_empty)
+
+        with it('must reduce right and full joins'):
+            from ooquery.operators import FullJoin, RightJoin
+            where = self.p.parse([
+                ('state', '=', 'open'),
+                (FullJoin('partner_id.name'), '!=', None),
+            ])
+            expect(self.p.promote_outer_joins(where)).to(equal([
+                ('partner_id', 'FULL', 'INNER')
+            ]))
+            p = Parser(self.t, self.p.foreign_key)
+            where = p.parse([
+                (RightJoin('partner_id.name'), '=', 'A'),
+                (FullJoin('partner_id.country_id.code'), '=', 'ES'),
+            ])
+            # Both joins are FULL, the domain is parsed backwards
+            expect(p.promote_outer_joins(where)).to(equal([
+                ('partner_id', 'FULL', 'RIGHT'),
+                ('partner_id.country_id', 'FULL', 'INNER')
+            ]))
+
+    with context('compiling semi-joins'):
+        with before.each:
+            def dummy_fk(table, field):
+                return {
+                    ('invoice', 'line_ids'): {
+                        'column_name': 'id',
+                        'foreign_table_name': 'line',
+                        'foreign_column_name': 'invoice_id'
+                    },
+                    ('invoice', 'partner_id'): {
+                        'column_name': 'partner_id',
+                        'foreign_table_name': 'partner',
+                        'foreign_column_name': 'id'
+                    },
+                    ('partner', 'bank_ids'): {
+                        'column_name': 'id',
+                        'foreign_table_name': 'bank',
+                        'foreign_column_name': 'partner_id'
+                    },
+                    ('line', 'product_id'): {
+                        'column_name': 'product_id',
+                        'foreign_table_name': 'product',
+                        'foreign_column_name': 'id'
+                    }
+                }[(table, field)]
+
+            self.t = Table('invoice')
+            self.fk = dummy_fk
+
+        with it('must check the to-many paths with exists'):
+            p = Parser(self.t, self.fk, semi_joins=True)
+            x = p.parse([
+                ('line_ids.product_id.name', '=', 'A'),
+                ('line_ids.quantity', '>', 1),
+                ('state', '=', 'open')
+            ])
+            line = Table('line')
+            product = Table('product')
+            join = line.join(product)
+            join.condition = line.product_id == product.id
+            sub = join.select(Literal(1), where=And([
+                self.t.id == line.invoice_id,
+                product.name == 'A',
+                line.quantity > 1
+            ]))
+            expected = self.t.select(
+                self.t.id, where=And((Exists(sub), self.t.state == 'open'))
+            )
+            expect(tuple(self.t.select(self.t.id, where=x))).to(
+                equal(tuple(expected))
+            )
+            expect(p.joins).to(be_empty)
+
+        with it('must join the to-one paths before the to-many join'):
+            from ooquery.operators import SemiJoin
+            p = Parser(self.t, self.fk)
+            x = p.parse([
+                '|', (SemiJoin('partner_id.bank_ids.iban'), '=', 'ES'),
+                ('partner_id.name', '=', 'A')
+            ])
+            partner = p.joins_map['partner_id'].right
+            bank = Table('bank')
+            sub = bank.select(Literal(1), where=And([
+                partner.id == bank.partner_id, bank.iban == 'ES'
+            ]))
+            expected = p.join_on.select(
+                self.t.id, where=And((Or((Exists(sub), partner.name == 'A')),))
+            )
+            expect(tuple(p.join_on.select(self.t.id, where=x))).to(
+                equal(tuple(expected))
+            )
+            expect(list(p.joins_map)).to(equal(['partner_id']))
+
+        with it('must group the leaves of nested ands'):
+            leaves = [
+                ('line_ids.quantity', '>', 1), ('line_ids.quantity', '<', 5)
+            ]
+            x = Parser(self.t, self.fk, semi_joins=True).parse(leaves)
+            y = Parser(self.t, self.fk, semi_joins=True).parse(['&'] + leaves)
+            expect(tuple(self.t.select(self.t.id, where=y))).to(
+                equal(tuple(self.t.select(self.t.id, where=x)))
+            )
+            expect(str(x).count('EXISTS')).to(equal(1))
+            x = Parser(self.t, self.fk, semi_joins=True).parse([
+                '|', ('state', '=', 'open'), '&', '!', ('state', '=', 'x'),
+                '&', ('line_ids.quantity', '>', 1),
+                ('line_ids.quantity', '<', 5)
+            ])
+            expect(str(x).count('EXISTS')).to(equal(1))
+
+        with it('must use one exists for each leaf inside or'):
+            p = Parser(self.t, self.fk, semi_joins=True)
+            x = p.parse([
+                '|', ('line_ids.quantity', '>', 1),
+                ('line_ids.quantity', '<', 5)
+            ])
+            expect(str(x).count('EXISTS')).to(equal(2))
@@ -0,0 +1,101 @@
+# coding=utf-8
+import threading
+
+from ooquery import OOQuery
+from ooquery.parser import Parser
+from ooquery.stats import QueryStats
+from sql import Table
+
+from expects import *
+from mamba import *
+
+
+def dummy_fk(table, field):
+    return {
+        'constraint_name': 'fk_contraint_name',
+        'table_name': table,
+        'column_name': field,
+        'foreign_table_name': field[:-3],
+        'foreign_column_name': 'id'
+    }
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+
+with description('The query stats'):
+    with it('must record counters and timings'):
+        stats = QueryStats(timer=FakeTimer())
+        stats.incr('leaves', 2)
+        with stats.timing('parse'):
+            pass
+        expect(stats.as_dict()).to(equal({
+            'counters': {'leaves': 2, 'parse': 1},
+            'timings': {'parse': 1}
+        }))
+        stats.reset()
+        expect(stats.counters).to(have_len(0))
+
+    with it('must call the subscribed callbacks'):
+        events = []
+        stats = QueryStats(timer=FakeTimer())
+        stats.subscribe(lambda event, value: events.append((event, value)))
+        stats.incr('leaves')
+        with stats.timing('render'):
+            pass
+        expect(events).to(equal([('leaves', 1), ('render', 1)]))
+
+    with it('must not lose updates from several threads'):
+        stats = QueryStats()
+
+        def record():
+            for _ in range(1000):
+                stats.incr('leaves')
+                stats.add_time('parse', 1)
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        expect(stats.as_dict()).to(equal({
+            'counters': {'leaves': 8000, 'parse': 8000},
+            'timings': {'parse': 8000}
+        }))
+
+    with it('must record the parser hot paths'):
+        stats = QueryStats()
+        p = Parser(Table('table'), dummy_fk, stats=stats)
+        p.parse([
+            ('partner_id.country_id.code', '=', 'ES'),
+            ('partner_id.name', '=', 'Pepito'),
+            ('state', '=', 'open'),
+        ])
+        expect(stats.counters).to(have_keys({
+            'parse': 1,
+            'leaves': 3,
+            'foreign_key': 2,
+            'joins.created': 2,
+        }))
+        expect(stats.counters['joins.reused']).to(be_above(0))
+        expect(stats.counters['parse_join.iterations']).to(equal(
+            stats.counters['joins.created'] + stats.counters['joins.reused']
+        ))
+        expect(stats.timings).to(have_keys('parse', 'foreign_key'))
+
+    with it('must record the rendering of compiled queries'):
+        stats = QueryStats()
+        q = OOQuery('table', dummy_fk, stats=stats)
+        q.compile(['id', 'partner_id.name'], [('state', '=', 'open')])
+        expect(stats.counters).to(have_keys({'render': 1, 'parse': 1}))
+
+    with it('must not record anything when disabled'):
+        p = Parser(Table('table'), dummy_fk)
+        p.parse([('partner_id.name', '=', 'Pepito')])
+        expect(p.stats).to(be_none)